@@ -0,0 +1,316 @@
+"""
+Aggregated analytics of form submissions
+
+A form's submissions are summarized by one aggregation with a $facet per
+question into mergeable counts: option histograms for choice questions,
+value counts for ratings, fixed-bin histograms and totals for numbers,
+answered counts and submissions per hour of day. Summaries are cached per
+form and schema version and refreshed by aggregating only the submissions
+stored since, which are merged in.
+"""
+from collections import OrderedDict
+from datetime import timedelta
+import math
+import os
+import threading
+import time
+
+CHOICE_TYPES = ('radio', 'select', 'checkbox')
+NUMERIC_TYPES = ('rating', 'number')
+
+# Number answers are counted in fixed bins (0 and a 1-2-5 series each way up to
+# 10^12, open-ended beyond), so a histogram stays small however many distinct
+# answers there are and histograms of different submissions add up
+_BIN_STEPS = [step * 10 ** exponent for exponent in range(-3, 12) for step in (1, 2, 5)] + [10 ** 12]
+NUMBER_BINS = [-math.inf] + [-step for step in reversed(_BIN_STEPS)] + [0] + _BIN_STEPS + [math.inf]
+
+# Submissions can be stored a little after their submitted_at (e.g. by the
+# ingestion queue); refreshes look back this far and skip what they've counted
+LATE_SUBMISSION_WINDOW = timedelta(minutes=5)
+
+def _is_answered(field):
+    return {'$cond': [{'$in': [{'$ifNull': [field, None]}, [None, '', []]]}, 0, 1]}
+
+def build_pipeline(form_id, questions, since=None, counted=(), recent_after=None):
+    """Build the aggregation summarizing a form's submissions
+
+    With since, only submissions from then on are read, except the IDs in
+    counted. With recent_after, the submissions from then on are listed in
+    'recent' so the next refresh can skip them.
+    """
+    match = {'form_id': form_id}
+    if since is not None:
+        match['submitted_at'] = {'$gte': since}
+        if counted:
+            match['id'] = {'$nin': list(counted)}
+
+    answered = {'_id': None}
+    facets = {
+        'totals': [{'$group': {'_id': None, 'count': {'$sum': 1}, 'last': {'$max': '$submitted_at'}}}],
+        'hours': [{'$group': {'_id': {'$hour': '$submitted_at'}, 'count': {'$sum': 1}}}],
+        'answered': [{'$group': answered}]
+    }
+    if recent_after is not None:
+        facets['recent'] = [
+            {'$match': {'submitted_at': {'$gte': recent_after}}},
+            {'$project': {'_id': 0, 'id': 1, 'submitted_at': 1}}
+        ]
+
+    # Facet and group field names are positional: question IDs may not be valid field names
+    for index, question in enumerate(questions):
+        field = f"$responses.{question['id']}"
+        answered[f'q{index}'] = {'$sum': _is_answered(field)}
+
+        if question.get('type') in CHOICE_TYPES:
+            # Checkbox answers are lists; single choices unwind to themselves
+            facets[f'q{index}'] = [
+                {'$unwind': field},
+                {'$match': {field[1:]: {'$nin': ['', None]}}},
+                {'$group': {'_id': field, 'count': {'$sum': 1}}}
+            ]
+        elif question.get('type') == 'rating':
+            # A rating scale has few values; answers may be stored as strings and are parsed when merged
+            facets[f'q{index}'] = [
+                {'$match': {field[1:]: {'$nin': ['', None]}}},
+                {'$group': {'_id': field, 'count': {'$sum': 1}}}
+            ]
+        elif question.get('type') == 'number':
+            # Number answers are stored as numbers; text stored before that isn't counted
+            numbers = {'$match': {field[1:]: {'$type': 'number'}}}
+            facets[f'q{index}'] = [
+                numbers,
+                {'$bucket': {'groupBy': field, 'boundaries': NUMBER_BINS, 'default': 'other',
+                             'output': {'count': {'$sum': 1}}}}
+            ]
+            facets[f'n{index}'] = [
+                numbers,
+                {'$group': {'_id': None, 'count': {'$sum': 1}, 'sum': {'$sum': field},
+                            'min': {'$min': field}, 'max': {'$max': field}}}
+            ]
+
+    return [{'$match': match}, {'$facet': facets}]
+
+def _number(value):
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return None
+    return number if math.isfinite(number) else None
+
+def summarize(result, questions):
+    """Turn an aggregation result into a summary that can be merged with others"""
+    totals = (result.get('totals') or [{}])[0]
+    answered = (result.get('answered') or [{}])[0]
+    summary = {
+        'count': totals.get('count', 0),
+        'last': totals.get('last'),
+        'hours': {row['_id']: row['count'] for row in result.get('hours', []) if row['_id'] is not None},
+        'answered': {},
+        'values': {},
+        'numbers': {},
+        'recent': {row['id']: row['submitted_at'] for row in result.get('recent', [])}
+    }
+
+    for index, question in enumerate(questions):
+        summary['answered'][question['id']] = answered.get(f'q{index}', 0)
+        if question.get('type') not in CHOICE_TYPES + NUMERIC_TYPES:
+            continue
+
+        if question['type'] == 'number':
+            # Bins are keyed by their lower bound
+            summary['values'][question['id']] = {
+                row['_id']: row['count'] for row in result.get(f'q{index}', []) if row['_id'] != 'other'
+            }
+            totals = (result.get(f'n{index}') or [None])[0]
+            summary['numbers'][question['id']] = {
+                'count': totals['count'], 'sum': totals['sum'], 'min': totals['min'], 'max': totals['max']
+            } if totals and totals['count'] else None
+            continue
+
+        values = {}
+        for row in result.get(f'q{index}', []):
+            value = row['_id']
+            if question['type'] == 'rating':
+                value = _number(value)
+                if value is None:
+                    continue
+            elif isinstance(value, (str, int, float, bool)):
+                # Options are compared as strings, as submissions are validated
+                value = str(value)
+            else:
+                continue
+            values[value] = values.get(value, 0) + row['count']
+        summary['values'][question['id']] = values
+
+    return summary
+
+def merge(base, delta):
+    """Add the summary of newer submissions to a summary"""
+    def add(counts, more):
+        merged = dict(counts)
+        for key, count in more.items():
+            merged[key] = merged.get(key, 0) + count
+        return merged
+
+    def add_totals(totals, more):
+        if totals is None or more is None:
+            return totals or more
+        return {
+            'count': totals['count'] + more['count'],
+            'sum': totals['sum'] + more['sum'],
+            'min': min(totals['min'], more['min']),
+            'max': max(totals['max'], more['max'])
+        }
+
+    lasts = [last for last in (base['last'], delta['last']) if last is not None]
+    return {
+        'count': base['count'] + delta['count'],
+        'last': max(lasts) if lasts else None,
+        'hours': add(base['hours'], delta['hours']),
+        'answered': add(base['answered'], delta['answered']),
+        'values': {
+            question_id: add(base['values'].get(question_id, {}), values)
+            for question_id, values in {**base['values'], **delta['values']}.items()
+        },
+        'numbers': {
+            question_id: add_totals(base['numbers'].get(question_id), delta['numbers'].get(question_id))
+            for question_id in {**base['numbers'], **delta['numbers']}
+        },
+        'recent': {**base['recent'], **delta['recent']}
+    }
+
+def _display_number(value):
+    return int(value) if value == int(value) else value
+
+def _bin_bound(value):
+    return value if math.isfinite(value) else None
+
+def report(summary, questions):
+    """Build the analytics response of a form from its summary"""
+    count = summary['count']
+    result = {
+        'submission_count': count,
+        'last_submission_at': summary['last'].isoformat() if summary['last'] else None,
+        'submissions_by_hour': [summary['hours'].get(hour, 0) for hour in range(24)],
+        'questions': []
+    }
+
+    for question in questions:
+        answered = summary['answered'].get(question['id'], 0)
+        entry = {
+            'id': question['id'],
+            'title': question.get('title', ''),
+            'type': question.get('type'),
+            'required': bool(question.get('required')),
+            'answered': answered
+        }
+        if entry['required']:
+            entry['completion_rate'] = answered / count if count else 0.0
+
+        values = summary['values'].get(question['id'], {})
+        if question.get('type') in CHOICE_TYPES:
+            # Every option is listed, in the form's order; answers no longer offered come last
+            options = [str(option) for option in question.get('options') or []]
+            entry['options'] = [{'value': option, 'count': values.get(option, 0)} for option in options]
+            entry['options'] += [
+                {'value': value, 'count': values[value]}
+                for value in sorted(values) if value not in options
+            ]
+        elif question.get('type') == 'rating':
+            total = sum(values.values())
+            entry['count'] = total
+            entry['mean'] = sum(value * n for value, n in values.items()) / total if total else None
+            entry['min'] = _display_number(min(values)) if values else None
+            entry['max'] = _display_number(max(values)) if values else None
+            entry['distribution'] = [
+                {'value': _display_number(value), 'count': values[value]} for value in sorted(values)
+            ]
+        elif question.get('type') == 'number':
+            totals = summary['numbers'].get(question['id'])
+            entry['count'] = totals['count'] if totals else 0
+            entry['mean'] = totals['sum'] / totals['count'] if totals else None
+            entry['min'] = totals['min'] if totals else None
+            entry['max'] = totals['max'] if totals else None
+            # Open-ended outer bins have no bound on that side
+            entry['histogram'] = [
+                {'from': _bin_bound(lower), 'to': _bin_bound(NUMBER_BINS[NUMBER_BINS.index(lower) + 1]),
+                 'count': values[lower]}
+                for lower in sorted(values)
+            ]
+
+        result['questions'].append(entry)
+
+    return result
+
+class AnalyticsCache:
+    """LRU of form summaries keyed by form ID, checked against the schema version
+
+    Entries remember how far they have counted (a watermark and the IDs of
+    the submissions near it) so a refresh only aggregates newer submissions.
+    Entries expire after ttl seconds, after which a full aggregation runs.
+    """
+
+    def __init__(self, max_entries=1000, ttl=3600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.refreshes = 0
+        self.rebuilds = 0
+
+    def get(self, form_id, schema_version):
+        """Get a form's cached summary, or None"""
+        with self._lock:
+            entry = self._entries.get(form_id)
+            if entry is None:
+                return None
+            if entry[0] <= time.monotonic() or entry[1] != schema_version:
+                del self._entries[form_id]
+                return None
+            self._entries.move_to_end(form_id)
+            return entry[2]
+
+    def set(self, form_id, schema_version, summary, rebuilt):
+        """Cache a form's summary after a refresh or a full aggregation"""
+        with self._lock:
+            expires = time.monotonic() + self.ttl
+            if not rebuilt and form_id in self._entries:
+                # Refreshes keep the expiry of the full aggregation they build on
+                expires = self._entries[form_id][0]
+            self._entries[form_id] = (expires, schema_version, summary)
+            self._entries.move_to_end(form_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            if rebuilt:
+                self.rebuilds += 1
+            else:
+                self.refreshes += 1
+
+    def invalidate(self, form_id):
+        """Drop a form's summary, e.g. after a submission is deleted"""
+        with self._lock:
+            self._entries.pop(form_id, None)
+
+    def clear(self):
+        """Drop every entry and reset the metrics"""
+        with self._lock:
+            self._entries.clear()
+            self.refreshes = 0
+            self.rebuilds = 0
+
+    def stats(self):
+        """Get refresh metrics"""
+        with self._lock:
+            return {
+                'refreshes': self.refreshes,
+                'rebuilds': self.rebuilds,
+                'size': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl': self.ttl
+            }
+
+# Global analytics cache instance
+analytics_cache = AnalyticsCache(
+    max_entries=int(os.getenv('ANALYTICS_CACHE_SIZE', 1000)),
+    ttl=int(os.getenv('ANALYTICS_CACHE_TTL', 3600))
+)
@@ -1,13 +1,27 @@
-from flask import Flask, render_template, request, jsonify, redirect, url_for, session
+from flask import Flask, render_template, request, jsonify, redirect, url_for, session, Response, stream_with_context, send_file
 from flask_mail import Mail, Message
 import json
 import os
+import time
 import uuid
 from datetime import datetime
 from dotenv import load_dotenv
 from auth import auth_manager, login_required, permission_required, role_required
 from database import db_manager
-from models import UserModel, FormModel
+from models import UserModel, FormModel, DuplicateSubmissionError, SchemaConflictError
+from cache import form_cache, user_cache, idempotency_cache
+from analytics import analytics_cache
+from mailer import mail_queue
+from exports import EXPORT_FORMATS, export_submissions
+from validation import ValidationError, number_answer, validator_cache
+from ingest import IngestBackpressure, submission_ingestor
+from ratelimit import RATE_LIMIT_BUCKETS, RATE_LIMIT_SCOPES, RedisBucketStore, parse_rate, rate_limiter
+from uploads import UploadError, upload_manager
+from http_client import oauth_http
+from sessions import RedisSessionInterface
+from events import ChangeStreamListener, RedisEventRelay, event_broker, format_sse
+from werkzeug.middleware.proxy_fix import ProxyFix
+from werkzeug.utils import secure_filename
 
 # Load environment variables
 load_dotenv()
@@ -15,6 +29,11 @@ load_dotenv()
 app = Flask(__name__)
 app.secret_key = os.getenv('SECRET_KEY', 'development_secret_key_change_in_production')
 
+# Behind reverse proxies, take the client address (which rate limits are kept per) from X-Forwarded-For
+TRUSTED_PROXIES = int(os.getenv('TRUSTED_PROXIES', 0))
+if TRUSTED_PROXIES:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUSTED_PROXIES)
+
 # Configure OAuth
 app.config['GOOGLE_CLIENT_ID'] = os.getenv('GOOGLE_CLIENT_ID')
 app.config['GOOGLE_CLIENT_SECRET'] = os.getenv('GOOGLE_CLIENT_SECRET')
@@ -27,18 +46,56 @@ app.config['MAIL_USERNAME'] = os.getenv('MAIL_USERNAME')
 app.config['MAIL_PASSWORD'] = os.getenv('MAIL_PASSWORD')
 app.config['MAIL_DEFAULT_SENDER'] = os.getenv('MAIL_DEFAULT_SENDER')
 
+# Largest number of invites accepted by the bulk invite endpoint
+MAX_BULK_INVITES = int(os.getenv('MAX_BULK_INVITES', 500))
+
+# Largest number of question operations accepted in one form builder save
+MAX_PATCH_OPS = int(os.getenv('MAX_PATCH_OPS', 200))
+
+# Seconds between keepalives (and presence heartbeats) on live event streams
+EVENT_KEEPALIVE = int(os.getenv('EVENT_KEEPALIVE', 15))
+
+# Longest idempotency key accepted on form submissions
+MAX_IDEMPOTENCY_KEY_LENGTH = 255
+
 # Initialize services
 mail = Mail(app)
+mail_queue.init_app(app, mail)
 auth_manager.init_app(app)
 
 # Only initialize database if not in testing mode
 if not app.config.get('TESTING', False) and not os.getenv('FLASK_ENV') == 'testing':
     try:
         db_manager.init_app(app)
+        # Forms stored before the members map only show up on dashboards once it is built
+        backfilled = FormModel.backfill_members()
+        if backfilled:
+            print(f"Built the members map of {backfilled} form(s)")
     except Exception as e:
         print(f"Warning: Database initialization failed: {e}")
         print("Running without database connection (likely in testing mode)")
 
+# Follow new submissions with a MongoDB change stream (needs a replica set) instead of publishing them on write
+if os.getenv('SUBMISSION_FEED_SOURCE') == 'change_stream' and db_manager.get_submissions_collection() is not None:
+    event_broker.watch('submissions', ChangeStreamListener(
+        db_manager.get_submissions_collection(),
+        FormModel.submission_change_event,
+        pipeline=[{'$match': {'operationType': 'insert'}}]
+    ))
+
+# Share cached forms, rate limits, live events and (optionally) sessions between processes when Redis is configured
+if os.getenv('REDIS_URL'):
+    try:
+        import redis
+        redis_client = redis.Redis.from_url(os.getenv('REDIS_URL'), decode_responses=True)
+        form_cache.backend = redis_client
+        rate_limiter.store = RedisBucketStore(redis_client)
+        event_broker.use_relay(RedisEventRelay(redis_client))
+        if os.getenv('SESSION_STORE') == 'redis':
+            app.session_interface = RedisSessionInterface(redis_client)
+    except ImportError:
+        print("Warning: REDIS_URL is set but redis is not installed; using the in-process form cache, rate limits and events only")
+
 def load_forms():
     """Load forms from MongoDB (deprecated - use FormModel methods directly)"""
     # This method is kept for backward compatibility but is deprecated
@@ -52,7 +109,7 @@ def save_forms(forms):
     pass
 
 def send_invitation_email(to_email, inviter_name, form_name, role, form_url):
-    """Send invitation email to collaborator"""
+    """Queue invitation email to collaborator; returns False if it could not be queued"""
     try:
         if not app.config.get('MAIL_USERNAME') or app.config.get('MAIL_USERNAME') == 'your-email@gmail.com':
             print(f"📧 Email not configured - invitation would be sent to: {to_email}")
@@ -99,20 +156,102 @@ def send_invitation_email(to_email, inviter_name, form_name, role, form_url):
             html=html_body
         )
         
-        mail.send(msg)
-        return True
+        return mail_queue.enqueue(msg, kind='invitation')
         
     except Exception as e:
-        print(f"Failed to send email: {e}")
+        print(f"Failed to queue email: {e}")
         return False
 
+def too_many_requests(retry_after, html=False):
+    """Build the 429 response for a rate-limited request"""
+    message = 'Too many requests, please try again shortly'
+    if html:
+        response = app.make_response((render_template('error.html', message=message), 429))
+    else:
+        response = app.make_response((jsonify({'error': message}), 429))
+    response.headers['Retry-After'] = str(retry_after)
+    return response
+
+def schema_conflict(form_name, error, since_version):
+    """Build the 409 response for edits based on an outdated schema version
+    
+    Carries the changes since the client's version (or the current questions
+    when they can't be replayed), so the builder can rebase without a reload.
+    """
+    body = {'error': str(error), 'version': error.current_version}
+    body.update(FormModel.get_schema_changes(form_name, since_version) or {})
+    return jsonify(body), 409
+
+def change_author():
+    """Describe the current user (and their builder tab, from X-Client-Id) for change events"""
+    current_user = auth_manager.get_current_user()
+    return {
+        'id': current_user['id'],
+        'name': current_user['name'],
+        'client': request.headers.get('X-Client-Id')
+    }
+
+def event_stream(channel, member=None, client_id=None, replay=()):
+    """Build a Server-Sent Events response streaming a channel's events
+    
+    Replayed events are sent first. A member is announced on the channel
+    while the stream is open, and the stream ends with a resync event if the
+    client falls too far behind to catch up.
+    """
+    # Subscribe before anything is read, so no event falls between the replay and the live stream
+    subscription = event_broker.subscribe(channel)
+    
+    def stream():
+        try:
+            yield 'retry: 3000\n\n'
+            for event in replay:
+                yield format_sse(event['type'], event['data'], event.get('id'))
+            
+            if member is not None:
+                event_broker.heartbeat(channel, client_id, member)
+                yield format_sse('presence', {'members': event_broker.presence(channel)})
+            last_heartbeat = time.monotonic()
+            
+            while True:
+                event = subscription.get(timeout=EVENT_KEEPALIVE)
+                if subscription.overflowed:
+                    yield format_sse('resync', {})
+                    return
+                
+                if event is None:
+                    yield ': keepalive\n\n'
+                elif event['type'] == 'presence':
+                    yield format_sse('presence', {'members': event_broker.presence(channel)})
+                else:
+                    yield format_sse(event['type'], event['data'], event.get('id'))
+                
+                if member is not None and time.monotonic() - last_heartbeat >= EVENT_KEEPALIVE:
+                    event_broker.heartbeat(channel, client_id, member)
+                    last_heartbeat = time.monotonic()
+        finally:
+            event_broker.unsubscribe(subscription)
+            if member is not None:
+                event_broker.leave(channel, client_id)
+    
+    response = Response(stream_with_context(stream()), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+def submission_received(submission_id, replayed=False):
+    """Build the response acknowledging a submission"""
+    response = jsonify({'message': 'Form submitted successfully!', 'submission_id': submission_id})
+    if replayed:
+        response.headers['Idempotent-Replayed'] = 'true'
+    return response
+
 @app.route('/')
 @login_required
 def index():
     current_user = auth_manager.get_current_user()
     
     # Get forms that user has access to (including form-level permissions)
-    accessible_forms = auth_manager.get_user_forms()
+    accessible_forms = auth_manager.get_user_forms('dashboard')
     
     return render_template('my_forms_modern.html', forms=accessible_forms, current_user=current_user)
 
@@ -139,34 +278,11 @@ def auth_callback():
         if not code:
             raise Exception("No authorization code received")
         
-        print(f"=== CODE RECEIVED: {bool(code)} ===")
-        
-        # Exchange code for access token using requests
-        import requests
-        token_data = {
-            'client_id': app.config['GOOGLE_CLIENT_ID'],
-            'client_secret': app.config['GOOGLE_CLIENT_SECRET'],
-            'code': code,
-            'grant_type': 'authorization_code',
-            'redirect_uri': url_for('auth_callback', _external=True)
-        }
-        
-        # Get access token
-        token_response = requests.post('https://oauth2.googleapis.com/token', data=token_data)
-        token_json = token_response.json()
-        
-        if 'access_token' not in token_json:
-            raise Exception(f"Token exchange failed: {token_json}")
-        
-        access_token = token_json['access_token']
-        print(f"=== ACCESS TOKEN RECEIVED ===")
+        if not auth_manager.google:
+            raise Exception("Google OAuth is not configured")
         
-        # Get user info using access token
-        userinfo_response = requests.get(
-            'https://www.googleapis.com/oauth2/v2/userinfo',
-            headers={'Authorization': f'Bearer {access_token}'}
-        )
-        user_info = userinfo_response.json()
+        # Exchange the code for a token and get user info over the pooled OAuth connections
+        user_info = auth_manager.fetch_user_info()
         
         print(f"=== USER INFO: {user_info.get('email')} ===")
         
@@ -176,7 +292,7 @@ def auth_callback():
         
         # Create or update user in our database
         user = auth_manager.create_or_update_user(user_info)
-        session['user'] = user
+        auth_manager.login_user(user)
         
         print(f"=== USER SET IN SESSION: {user['email']} (ID: {user['id']}) ===")
         
@@ -214,7 +330,7 @@ def dev_login():
         }
         
         user = auth_manager.create_or_update_user(test_user_info)
-        session['user'] = user
+        auth_manager.login_user(user)
         
         return redirect(url_for('index'))
     
@@ -241,7 +357,7 @@ def create_form():
         return jsonify({'error': 'Form name is required'}), 400
     
     # Check if form name already exists
-    if FormModel.get_form_by_name(form_name):
+    if FormModel.get_form_by_name(form_name, 'meta'):
         return jsonify({'error': 'Form name already exists'}), 400
     
     current_user = auth_manager.get_current_user()
@@ -258,7 +374,6 @@ def create_form():
             'viewer': []   # Users who can view submissions (beyond public link)
         },
         'invites': [],  # Pending invitations
-        'submissions': [],
         'questions': [
             {
                 'id': 'q_1',
@@ -278,7 +393,7 @@ def create_form():
 @login_required
 @permission_required('edit_form')
 def edit_form(form_name):
-    form = FormModel.get_form_by_name(form_name)
+    form = FormModel.get_form_by_name(form_name, 'schema', 'permissions')
     
     if not form:
         return redirect(url_for('index'))
@@ -294,7 +409,7 @@ def edit_form(form_name):
 @login_required
 def invite_user_to_form(form_name):
     """Invite a user to collaborate on a form"""
-    form = FormModel.get_form_by_name(form_name)
+    form = FormModel.get_form_by_name(form_name, 'permissions')
     
     if not form:
         return jsonify({'error': 'Form not found'}), 404
@@ -323,10 +438,7 @@ def invite_user_to_form(form_name):
     current_user = auth_manager.get_current_user()
     
     # Check if user already has permission
-    permissions = form.get('permissions', {})
-    if (invited_user_id in permissions.get('admin', []) or
-        invited_user_id in permissions.get('editor', []) or
-        invited_user_id in permissions.get('viewer', [])):
+    if auth_manager.get_form_role(form, invited_user_id):
         return jsonify({'error': 'User already has access to this form'}), 400
     
     # Add user to form permissions using FormModel
@@ -342,7 +454,7 @@ def invite_user_to_form(form_name):
         form_url=form_url
     )
     
-    email_status = " (email sent)" if email_sent else " (email failed)"
+    email_status = " (email queued)" if email_sent else " (email failed)"
     
     return jsonify({
         'message': f'User {email} invited as {role}{email_status}',
@@ -354,11 +466,103 @@ def invite_user_to_form(form_name):
         }
     })
 
+@app.route('/api/form/<form_name>/invite/bulk', methods=['POST'])
+@login_required
+def bulk_invite_users_to_form(form_name):
+    """Invite many users to collaborate on a form in one request"""
+    form = FormModel.get_form_by_name(form_name, 'permissions')
+    
+    if not form:
+        return jsonify({'error': 'Form not found'}), 404
+    
+    # Check if user is form admin
+    if not auth_manager.has_form_permission(form, 'admin'):
+        return jsonify({'error': 'Only form admins can invite users'}), 403
+    
+    data = request.get_json() or {}
+    invites = data.get('invites')
+    default_role = data.get('role', 'viewer')
+    
+    if not isinstance(invites, list) or not invites:
+        return jsonify({'error': 'A list of invites is required'}), 400
+    
+    if len(invites) > MAX_BULK_INVITES:
+        return jsonify({'error': f'At most {MAX_BULK_INVITES} invites can be sent at once'}), 400
+    
+    # Normalize the requested invites, keeping the first one for each email
+    results = []
+    requested = {}
+    for invite in invites:
+        if not isinstance(invite, dict):
+            # A bare email takes the default role
+            invite = {'email': invite}
+        email = str(invite.get('email') or '').strip().lower()
+        role = invite.get('role', default_role)
+        result = {'email': email, 'role': role}
+        results.append(result)
+        
+        if not email:
+            result['status'] = 'invalid'
+            result['error'] = 'Email is required'
+        elif role not in ['editor', 'viewer']:
+            result['status'] = 'invalid'
+            result['error'] = 'Invalid role'
+        elif email in requested:
+            result['status'] = 'duplicate'
+        else:
+            requested[email] = result
+    
+    # Resolve every email with one query
+    users_by_email = UserModel.get_users_by_emails(requested.keys()) if requested else {}
+    existing_ids = FormModel.get_members(form)
+    
+    roles_by_user = {}
+    for email, result in requested.items():
+        invited_user = users_by_email.get(email)
+        if not invited_user:
+            result['status'] = 'not_found'
+            result['error'] = 'User not found. They must sign up first.'
+        elif invited_user['id'] in existing_ids or invited_user['id'] in roles_by_user:
+            result['status'] = 'already_member'
+        else:
+            roles_by_user[invited_user['id']] = result['role']
+            result['status'] = 'invited'
+            result['user'] = {
+                'id': invited_user['id'],
+                'name': invited_user['name'],
+                'email': invited_user['email'],
+                'role': result['role']
+            }
+    
+    # Apply every role change in one update, then queue the emails
+    if roles_by_user:
+        FormModel.add_collaborators(form_name, roles_by_user)
+        
+        current_user = auth_manager.get_current_user()
+        form_url = f"{request.url_root}form/{form_name}"
+        for result in results:
+            if result.get('status') == 'invited':
+                result['email_queued'] = send_invitation_email(
+                    to_email=result['email'],
+                    inviter_name=current_user['name'],
+                    form_name=form_name,
+                    role=result['role'],
+                    form_url=form_url
+                )
+    
+    invited = sum(1 for result in results if result.get('status') == 'invited')
+    
+    return jsonify({
+        'message': f'{invited} of {len(results)} user(s) invited',
+        'invited': invited,
+        'results': results
+    })
+
 @app.route('/api/form/<form_name>/collaborators', methods=['GET'])
 @login_required
 def get_form_collaborators(form_name):
     """Get list of form collaborators"""
-    form = FormModel.get_form_by_name(form_name)
+    form = FormModel.get_form_by_name(form_name, 'permissions')
     
     if not form:
         return jsonify({'error': 'Form not found'}), 404
@@ -367,24 +571,22 @@ def get_form_collaborators(form_name):
     if not auth_manager.has_form_permission(form, 'edit'):
         return jsonify({'error': 'Access denied'}), 403
     
-    users = UserModel.get_all_users()
-    users_by_id = {u['id']: u for u in users}
+    members = FormModel.get_members(form)
+    users_by_id = UserModel.get_users_by_ids(members, ['name', 'email'])
     
-    permissions = form.get('permissions', {})
     collaborators = []
     
-    # Add all collaborators with their roles
-    for role in ['admin', 'editor', 'viewer']:
-        for user_id in permissions.get(role, []):
-            if user_id in users_by_id:
-                user = users_by_id[user_id]
-                collaborators.append({
-                    'id': user['id'],
-                    'name': user['name'],
-                    'email': user['email'],
-                    'role': role,
-                    'is_creator': user_id == form.get('created_by')
-                })
+    # Add all collaborators with their roles, admins first
+    for user_id, role in sorted(members.items(), key=lambda member: FormModel.ROLES.index(member[1])):
+        if user_id in users_by_id:
+            user = users_by_id[user_id]
+            collaborators.append({
+                'id': user['id'],
+                'name': user['name'],
+                'email': user['email'],
+                'role': role,
+                'is_creator': user_id == form.get('created_by')
+            })
     
     return jsonify({'collaborators': collaborators})
 
@@ -392,7 +594,7 @@ def get_form_collaborators(form_name):
 @login_required
 def remove_form_collaborator(form_name, user_id):
     """Remove a collaborator from a form"""
-    form = FormModel.get_form_by_name(form_name)
+    form = FormModel.get_form_by_name(form_name, 'permissions')
     
     if not form:
         return jsonify({'error': 'Form not found'}), 404
@@ -406,15 +608,7 @@ def remove_form_collaborator(form_name, user_id):
         return jsonify({'error': 'Cannot remove form creator'}), 400
     
     # Check if user exists in collaborators
-    permissions = form.get('permissions', {})
-    user_exists = False
-    
-    for role in ['admin', 'editor', 'viewer']:
-        if user_id in permissions.get(role, []):
-            user_exists = True
-            break
-    
-    if not user_exists:
+    if not auth_manager.get_form_role(form, user_id):
         return jsonify({'error': 'User not found in collaborators'}), 404
     
     # Remove user from all permission levels using FormModel
@@ -428,7 +622,7 @@ def remove_form_collaborator(form_name, user_id):
 @app.route('/api/form/<form_name>/save', methods=['POST'])
 @login_required
 def save_form_data(form_name):
-    form = FormModel.get_form_by_name(form_name)
+    form = FormModel.get_form_by_name(form_name, 'permissions')
     
     if not form:
         return jsonify({'error': 'Form not found'}), 404
@@ -442,16 +636,29 @@ def save_form_data(form_name):
         'questions': data.get('questions', [])
     }
     
+    # Saves that say which version they replace don't overwrite other editors' changes
+    version = data.get('version')
+    if version is not None and (not isinstance(version, int) or isinstance(version, bool) or version < 0):
+        return jsonify({'error': 'Invalid schema version'}), 400
+    
     try:
-        FormModel.update_form(form_name, update_data)
-        return jsonify({'message': 'Form saved successfully'})
+        if version is None:
+            FormModel.update_form(form_name, update_data)
+        else:
+            FormModel.update_form(form_name, update_data, expected_version=version)
+    except SchemaConflictError as e:
+        return schema_conflict(form_name, e, version)
     except ValueError as e:
         return jsonify({'error': str(e)}), 500
+    
+    if version is None:
+        return jsonify({'message': 'Form saved successfully'})
+    return jsonify({'message': 'Form saved successfully', 'version': version + 1})
 
 @app.route('/api/form/<form_name>/question', methods=['POST'])
 @login_required
 def add_question(form_name):
-    form = FormModel.get_form_by_name(form_name)
+    form = FormModel.get_form_by_name(form_name, 'schema', 'permissions')
     
     if not form:
         return jsonify({'error': 'Form not found'}), 404
@@ -462,27 +669,134 @@ def add_question(form_name):
     
     questions = form.get('questions', [])
     question_num = len(questions) + 1
+    # Deleted questions leave gaps, so number past the highest existing ID
+    taken = {question.get('id') for question in questions}
+    suffix = question_num
+    while f'q_{suffix}' in taken:
+        suffix += 1
     new_question = {
-        'id': f'q_{question_num}',
+        'id': f'q_{suffix}',
         'title': f'Question {question_num}',
         'text': '',
         'type': 'text',
         'required': False
     }
     
-    questions.append(new_question)
-    update_data = {'questions': questions}
-    
     try:
-        FormModel.update_form(form_name, update_data)
-        return jsonify({'question': new_question})
+        version = FormModel.patch_questions(form_name, form.get('schema_version', 0),
+                                            [{'op': 'add', 'question': new_question}], change_author())
+        return jsonify({'question': new_question, 'version': version})
+    except SchemaConflictError as e:
+        return schema_conflict(form_name, e, form.get('schema_version', 0))
     except ValueError as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/form/<form_name>/questions', methods=['PATCH'])
+@login_required
+def patch_form_questions(form_name):
+    """Apply the form builder's question edits, e.g. {"version": 3, "ops": [{"op": "delete", "id": "q_2"}]}"""
+    form = FormModel.get_form_by_name(form_name, 'permissions')
+    
+    if not form:
+        return jsonify({'error': 'Form not found'}), 404
+    
+    # Check form-level edit permission
+    if not auth_manager.has_form_permission(form, 'edit'):
+        return jsonify({'error': 'Access denied'}), 403
+    
+    data = request.get_json(silent=True) or {}
+    version = data.get('version')
+    ops = data.get('ops')
+    
+    if not isinstance(version, int) or isinstance(version, bool) or version < 0:
+        return jsonify({'error': 'The schema version the edits are based on is required'}), 400
+    
+    if not isinstance(ops, list) or not ops:
+        return jsonify({'error': 'A list of operations is required'}), 400
+    
+    if len(ops) > MAX_PATCH_OPS:
+        return jsonify({'error': f'At most {MAX_PATCH_OPS} operations can be saved at once'}), 400
+    
+    try:
+        version = FormModel.patch_questions(form_name, version, ops, change_author())
+    except SchemaConflictError as e:
+        return schema_conflict(form_name, e, version)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    return jsonify({'message': 'Form saved successfully', 'version': version})
+
+@app.route('/api/form/<form_name>/events')
+@login_required
+def form_builder_events(form_name):
+    """Stream question changes and who else is editing to the form builder (Server-Sent Events)
+    
+    Clients resume from a schema version (Last-Event-ID, or ?since= on the
+    first connection): the changes since are replayed from the change log,
+    or a snapshot of the questions is sent if the log can't cover them.
+    """
+    form = FormModel.get_form_by_name(form_name, 'permissions')
+    
+    if not form:
+        return jsonify({'error': 'Form not found'}), 404
+    
+    # Check form-level edit permission
+    if not auth_manager.has_form_permission(form, 'edit'):
+        return jsonify({'error': 'Access denied'}), 403
+    
+    replay = []
+    since = request.headers.get('Last-Event-ID') or request.args.get('since')
+    if since is not None:
+        try:
+            since = int(since)
+        except ValueError:
+            return jsonify({'error': 'Invalid schema version'}), 400
+        
+        delta = FormModel.get_schema_changes(form_name, since, entries=True) or {}
+        if 'changes' in delta:
+            replay = [{'type': 'change', 'data': entry, 'id': entry['version']} for entry in delta['changes']]
+        elif 'questions' in delta:
+            replay = [{'type': 'snapshot', 'data': delta, 'id': delta['version']}]
+    
+    current_user = auth_manager.get_current_user()
+    member = {'id': current_user['id'], 'name': current_user['name'], 'picture': current_user.get('picture', '')}
+    client_id = request.args.get('client') or uuid.uuid4().hex
+    
+    return event_stream(FormModel.channel(form_name), member, client_id, replay)
+
+@app.route('/api/form/<form_name>/rate-limits', methods=['PUT'])
+@login_required
+def set_form_rate_limits(form_name):
+    """Override the public rate limits of a form, e.g. {"submit": {"client": "5/60"}}"""
+    form = FormModel.get_form_by_name(form_name, 'permissions')
+    
+    if not form:
+        return jsonify({'error': 'Form not found'}), 404
+    
+    if not auth_manager.has_form_permission(form, 'admin'):
+        return jsonify({'error': 'Only form admins can change rate limits'}), 403
+    
+    data = request.get_json() or {}
+    rate_limits = {}
+    try:
+        for scope, buckets in data.items():
+            if scope not in RATE_LIMIT_SCOPES or not isinstance(buckets, dict):
+                raise ValueError(f"Unknown rate limit scope: {scope}")
+            for bucket, limit in buckets.items():
+                if bucket not in RATE_LIMIT_BUCKETS:
+                    raise ValueError(f"Unknown rate limit bucket: {bucket}")
+                parse_rate(limit)
+                rate_limits.setdefault(scope, {})[bucket] = str(limit)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    FormModel.update_form(form_name, {'rate_limits': rate_limits})
+    return jsonify({'message': 'Rate limits updated', 'rate_limits': rate_limits})
+
 @app.route('/api/form/<form_name>/publish', methods=['POST'])
 @login_required
 def publish_form(form_name):
-    form = FormModel.get_form_by_name(form_name)
+    form = FormModel.get_form_by_name(form_name, 'permissions')
     
     if not form:
         return jsonify({'error': 'Form not found'}), 404
@@ -495,6 +809,8 @@ def publish_form(form_name):
     
     try:
         FormModel.update_form(form_name, update_data)
+        # Precompute the public render schema so visitors are served from cache
+        FormModel.get_public_schema(form_name)
         share_url = f"{request.url_root}submit/{form_name}"
         return jsonify({'message': 'Form published successfully!', 'share_url': share_url})
     except ValueError as e:
@@ -503,7 +819,7 @@ def publish_form(form_name):
 @app.route('/api/form/<form_name>/hide', methods=['POST'])
 @login_required
 def hide_form(form_name):
-    form = FormModel.get_form_by_name(form_name)
+    form = FormModel.get_form_by_name(form_name, 'permissions')
     
     if not form:
         return jsonify({'error': 'Form not found'}), 404
@@ -522,41 +838,206 @@ def hide_form(form_name):
 
 @app.route('/submit/<form_name>')
 def public_form(form_name):
-    form = FormModel.get_form_by_name(form_name)
+    # Checked before the form is read, so a flood from one client costs no database reads
+    retry_after = rate_limiter.check('render', form_name, request.remote_addr, buckets=('client',))
+    if retry_after:
+        return too_many_requests(retry_after, html=True)
+    
+    form = FormModel.get_form_by_name(form_name, 'schema')
     
     if not form or form.get('status') != 'published':
         return render_template('error.html', message='Form not found or not published'), 404
     
-    return render_template('public_form_modern.html', form=form)
+    retry_after = rate_limiter.check('render', form_name, request.remote_addr, form, buckets=('form',))
+    if retry_after:
+        return too_many_requests(retry_after, html=True)
+    
+    return render_template('public_form_modern.html', form=FormModel.build_public_schema(form))
 
 @app.route('/api/form/<form_name>/submit', methods=['POST'])
 def submit_form(form_name):
-    form = FormModel.get_form_by_name(form_name)
+    retry_after = rate_limiter.check('submit', form_name, request.remote_addr, buckets=('client',))
+    if retry_after:
+        return too_many_requests(retry_after)
+    
+    form = FormModel.get_form_by_name(form_name, 'schema')
     
     if not form or form.get('status') != 'published':
         return jsonify({'error': 'Form not found or not published'}), 404
     
-    data = request.get_json()
-    responses = data.get('responses', {})
+    retry_after = rate_limiter.check('submit', form_name, request.remote_addr, form, buckets=('form',))
+    if retry_after:
+        return too_many_requests(retry_after)
+    
+    data = request.get_json() or {}
+    
+    # Retries carrying the same idempotency key get the original submission back
+    idempotency_key = request.headers.get('Idempotency-Key') or data.get('idempotency_key')
+    if idempotency_key is not None:
+        idempotency_key = str(idempotency_key).strip()
+        if not idempotency_key or len(idempotency_key) > MAX_IDEMPOTENCY_KEY_LENGTH:
+            return jsonify({'error': f'Idempotency key must be 1 to {MAX_IDEMPOTENCY_KEY_LENGTH} characters'}), 400
+        
+        original_id = idempotency_cache.get(form['_id'], idempotency_key)
+        if original_id:
+            return submission_received(original_id, replayed=True)
+    
+    # Reject invalid answers before anything is stored; file answers must refer to finished uploads
+    try:
+        responses = validator_cache.get(form).validate(data.get('responses', {}))
+        responses = upload_manager.attach(form, responses)
+    except ValidationError as e:
+        return jsonify({'error': 'Some answers are invalid', 'errors': e.errors}), 400
     
     # Create submission
     submission = {
         'id': str(uuid.uuid4()),
         'responses': responses
     }
+    if idempotency_key:
+        submission['idempotency_key'] = idempotency_key
     
-    # Add submission to form using FormModel
-    success = FormModel.add_submission(form_name, submission)
+    try:
+        if submission_ingestor.enabled:
+            # Batched writes through the ingestion queue
+            submission_ingestor.submit(form['_id'], submission)
+        else:
+            # Add submission to form using FormModel
+            success = FormModel.add_submission(form_name, submission)
+            
+            if not success:
+                return jsonify({'error': 'Failed to submit form'}), 500
+    except IngestBackpressure as e:
+        body = {'error': str(e)}
+        if e.idempotency_key:
+            # The submission may still be stored; a retry with this key returns it instead of storing it twice
+            body['idempotency_key'] = e.idempotency_key
+        response = jsonify(body)
+        response.headers['Retry-After'] = str(e.retry_after)
+        if e.idempotency_key:
+            response.headers['Idempotency-Key'] = e.idempotency_key
+        return response, e.status
+    except DuplicateSubmissionError as e:
+        # Another process stored the first attempt
+        idempotency_cache.set(form['_id'], idempotency_key, e.submission_id)
+        return submission_received(e.submission_id, replayed=True)
+    
+    if idempotency_key:
+        idempotency_cache.set(form['_id'], idempotency_key, submission['id'])
+    
+    return submission_received(submission['id'])
+
+def upload_error(e):
+    """Build the JSON response for a rejected upload request"""
+    body = {'error': str(e)}
+    if e.offset is not None:
+        body['offset'] = e.offset
+    response = jsonify(body)
+    if e.offset is not None:
+        response.headers['Upload-Offset'] = str(e.offset)
+    return response, e.status
+
+def upload_status(upload, status=200):
+    """Build the JSON response describing an upload's progress"""
+    response = jsonify({
+        'upload_id': upload['id'],
+        'offset': upload['received'],
+        'size': upload['size'],
+        'chunk_size': upload_manager.chunk_size,
+        'complete': upload['status'] == 'complete'
+    })
+    response.headers['Upload-Offset'] = str(upload['received'])
+    return response, status
+
+@app.route('/api/form/<form_name>/uploads', methods=['POST'])
+def create_upload(form_name):
+    """Start a resumable upload for a file question: {question_id, name, size, type}"""
+    retry_after = rate_limiter.check('upload', form_name, request.remote_addr, buckets=('client',))
+    if retry_after:
+        return too_many_requests(retry_after)
     
-    if not success:
-        return jsonify({'error': 'Failed to submit form'}), 500
+    form = FormModel.get_form_by_name(form_name, 'schema')
+    
+    if not form or form.get('status') != 'published':
+        return jsonify({'error': 'Form not found or not published'}), 404
+    
+    retry_after = rate_limiter.check('upload', form_name, request.remote_addr, form, buckets=('form',))
+    if retry_after:
+        return too_many_requests(retry_after)
+    
+    data = request.get_json() or {}
+    try:
+        upload = upload_manager.create(form, data.get('question_id'), data.get('name'),
+                                       data.get('size'), data.get('type'))
+    except UploadError as e:
+        return upload_error(e)
+    
+    return upload_status(upload, 201)
+
+@app.route('/api/form/<form_name>/uploads/<upload_id>', methods=['GET'])
+def get_upload_status(form_name, upload_id):
+    """Get how many bytes of an upload were received, to resume it"""
+    form = FormModel.get_form_by_name(form_name, 'schema')
+    
+    if not form or form.get('status') != 'published':
+        return jsonify({'error': 'Form not found or not published'}), 404
+    
+    try:
+        return upload_status(upload_manager.get(form, upload_id))
+    except UploadError as e:
+        return upload_error(e)
+
+@app.route('/api/form/<form_name>/uploads/<upload_id>', methods=['PUT'])
+def upload_chunk(form_name, upload_id):
+    """Receive the next chunk of an upload as the raw request body, at the Upload-Offset header"""
+    form = FormModel.get_form_by_name(form_name, 'schema')
+    
+    if not form or form.get('status') != 'published':
+        return jsonify({'error': 'Form not found or not published'}), 404
     
-    return jsonify({'message': 'Form submitted successfully!', 'submission_id': submission['id']})
+    try:
+        offset = int(request.headers.get('Upload-Offset', ''))
+    except ValueError:
+        return jsonify({'error': 'Upload-Offset header is required'}), 400
+    
+    try:
+        upload = upload_manager.write_chunk(form, upload_id, offset, request.stream)
+    except UploadError as e:
+        return upload_error(e)
+    
+    return upload_status(upload)
+
+@app.route('/api/form/<form_name>/uploads/<upload_id>/file')
+@login_required
+def download_upload(form_name, upload_id):
+    """Download a file submitted to a form"""
+    form = FormModel.get_form_by_name(form_name, 'schema', 'permissions')
+    
+    if not form:
+        return jsonify({'error': 'Form not found'}), 404
+    
+    if not auth_manager.has_form_permission(form, 'view_submissions'):
+        return jsonify({'error': 'Access denied'}), 403
+    
+    try:
+        upload = upload_manager.get(form, upload_id)
+    except UploadError as e:
+        return upload_error(e)
+    
+    if upload['status'] != 'complete':
+        return jsonify({'error': 'Upload is not complete'}), 404
+    
+    return send_file(
+        upload_manager.open(upload),
+        mimetype=upload['type'] or 'application/octet-stream',
+        as_attachment=True,
+        download_name=upload['name']
+    )
 
 @app.route('/form/<form_name>/submissions')
 @login_required
 def view_submissions(form_name):
-    form = FormModel.get_form_by_name(form_name)
+    form = FormModel.get_form_by_name(form_name, 'meta', 'schema', 'permissions')
     
     if not form:
         return redirect(url_for('index'))
@@ -567,12 +1048,156 @@ def view_submissions(form_name):
     
     return render_template('submissions.html', form=form)
 
+@app.route('/api/form/<form_name>/submissions', methods=['GET'])
+@login_required
+def get_form_submissions(form_name):
+    """Get a page of form submissions (keyset pagination, sort, projection, filters)"""
+    form = FormModel.get_form_by_name(form_name, 'schema', 'permissions')
+    
+    if not form:
+        return jsonify({'error': 'Form not found'}), 404
+    
+    if not auth_manager.has_form_permission(form, 'view_submissions'):
+        return jsonify({'error': 'Access denied'}), 403
+    
+    question_ids = {q['id'] for q in form.get('questions', [])}
+    
+    fields = None
+    if request.args.get('fields'):
+        fields = [f.strip() for f in request.args['fields'].split(',') if f.strip()]
+    
+    # Per-question filters are passed as filter.<question_id>=<value>
+    filters = {
+        key[len('filter.'):]: value
+        for key, value in request.args.items() if key.startswith('filter.')
+    }
+    
+    unknown = set(fields or []) | set(filters)
+    unknown -= question_ids
+    if unknown:
+        return jsonify({'error': f"Unknown question(s): {', '.join(sorted(unknown))}"}), 400
+    
+    # Number answers are stored as numbers, or as text if stored before they were parsed
+    number_ids = {q['id'] for q in form.get('questions', []) if q.get('type') == 'number'}
+    for question_id in number_ids & set(filters):
+        number = number_answer(filters[question_id])
+        if number is not None:
+            filters[question_id] = [filters[question_id], number]
+    
+    try:
+        submissions, next_cursor = FormModel.get_submissions_page(
+            form_name,
+            limit=request.args.get('limit', 50, type=int),
+            cursor=request.args.get('cursor'),
+            sort=request.args.get('sort', 'desc'),
+            fields=fields,
+            filters=filters
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    return jsonify({'submissions': submissions, 'next_cursor': next_cursor})
+
+@app.route('/api/form/<form_name>/submissions/events')
+@login_required
+def form_submission_events(form_name):
+    """Stream new and deleted submissions of a form to its dashboard (Server-Sent Events)
+    
+    Clients resume after a submission cursor (Last-Event-ID, or ?after= on
+    the first connection); missed submissions are replayed, or a resync
+    event is sent when too many were missed.
+    """
+    form = FormModel.get_form_by_name(form_name, 'permissions')
+    
+    if not form:
+        return jsonify({'error': 'Form not found'}), 404
+    
+    if not auth_manager.has_form_permission(form, 'view_submissions'):
+        return jsonify({'error': 'Access denied'}), 403
+    
+    replay = []
+    after = request.headers.get('Last-Event-ID') or request.args.get('after')
+    if after:
+        try:
+            replay = FormModel.get_submission_events(form_name, after)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        if replay is None:
+            replay = [{'type': 'resync', 'data': {}}]
+    
+    return event_stream(FormModel.submissions_channel(form['_id']), replay=replay)
+
+
+@app.route('/api/form/<form_name>/analytics', methods=['GET'])
+@login_required
+def get_form_analytics(form_name):
+    """Get per-question analytics of a form's submissions"""
+    form = FormModel.get_form_by_name(form_name, 'permissions')
+    
+    if not form:
+        return jsonify({'error': 'Form not found'}), 404
+    
+    if not auth_manager.has_form_permission(form, 'view_analytics'):
+        return jsonify({'error': 'Access denied'}), 403
+    
+    analytics = FormModel.get_analytics(form_name)
+    if analytics is None:
+        return jsonify({'error': 'Form not found'}), 404
+    
+    return jsonify(analytics)
+
+@app.route('/api/form/<form_name>/export', methods=['GET'])
+@login_required
+@permission_required('export_data')
+def export_form_submissions(form_name):
+    """Stream form submissions as CSV, NDJSON or XLSX"""
+    form = FormModel.get_form_by_name(form_name, 'schema', 'permissions')
+    
+    if not form:
+        return jsonify({'error': 'Form not found'}), 404
+    
+    if not auth_manager.has_form_permission(form, 'view_submissions'):
+        return jsonify({'error': 'Access denied'}), 403
+    
+    export_format = request.args.get('format', 'csv')
+    if export_format not in EXPORT_FORMATS:
+        return jsonify({'error': f"Format must be one of: {', '.join(EXPORT_FORMATS)}"}), 400
+    
+    since = None
+    if request.args.get('since'):
+        try:
+            since = datetime.fromisoformat(request.args['since'])
+        except ValueError:
+            return jsonify({'error': 'since must be an ISO 8601 timestamp'}), 400
+        if since.tzinfo is not None:
+            # Submission times are stored in the server's local time without an offset
+            since = since.astimezone().replace(tzinfo=None)
+    
+    # Nightly jobs pass the cursor their last export returned to only pull new rows
+    after = request.args.get('after')
+    try:
+        next_cursor = FormModel.get_export_cursor(form_name, after)
+        rows = export_submissions(
+            export_format,
+            form.get('questions', []),
+            FormModel.iter_submissions(form_name, since=since, after=after)
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    mimetype, extension = EXPORT_FORMATS[export_format]
+    filename = f"{secure_filename(form_name) or 'form'}-submissions.{extension}"
+    headers = {'Content-Disposition': f'attachment; filename="{filename}"'}
+    if next_cursor:
+        headers['X-Export-Cursor'] = next_cursor
+    
+    return Response(stream_with_context(rows), mimetype=mimetype, headers=headers)
 
 @app.route('/api/form/<form_name>/delete', methods=['DELETE'])
 @login_required
 @permission_required('delete_form')
 def delete_form(form_name):
-    form = FormModel.get_form_by_name(form_name)
+    form = FormModel.get_form_by_name(form_name, 'permissions')
     
     if not form:
         return jsonify({'error': 'Form not found'}), 404
@@ -590,16 +1215,13 @@ def delete_form(form_name):
 
 @app.route('/api/form/<form_name>/submission/<submission_id>/delete', methods=['DELETE'])
 def delete_submission(form_name, submission_id):
-    form = FormModel.get_form_by_name(form_name)
+    form = FormModel.get_form_by_name(form_name, 'meta')
     
     if not form:
         return jsonify({'error': 'Form not found'}), 404
     
     # Check if submission exists
-    submissions = form.get('submissions', [])
-    submission_exists = any(s['id'] == submission_id for s in submissions)
-    
-    if not submission_exists:
+    if not FormModel.get_submission(form_name, submission_id):
         return jsonify({'error': 'Submission not found'}), 404
     
     success = FormModel.delete_submission(form_name, submission_id)
@@ -616,9 +1238,50 @@ def my_forms():
     current_user = auth_manager.get_current_user()
     
     # Get forms that user has access to (including form-level permissions)
-    accessible_forms = auth_manager.get_user_forms()
+    accessible_forms = auth_manager.get_user_forms('dashboard')
     
     return render_template('my_forms_modern.html', forms=accessible_forms, current_user=current_user)
 
+@app.route('/api/metrics', methods=['GET'])
+@role_required('admin')
+def get_metrics():
+    """Get runtime metrics (global admins only)"""
+    return jsonify({
+        'form_cache': form_cache.stats(),
+        'user_cache': user_cache.stats(),
+        'idempotency_cache': idempotency_cache.stats(),
+        'mail_queue': mail_queue.stats(),
+        'submission_ingest': submission_ingestor.stats(),
+        'rate_limits': rate_limiter.stats(),
+        'uploads': upload_manager.stats(),
+        'oauth_http': oauth_http.stats(),
+        'events': event_broker.stats(),
+        'analytics_cache': analytics_cache.stats()
+    })
+
+@app.cli.command('migrate-submissions')
+def migrate_submissions_command():
+    """Move submissions embedded in form documents to the submissions collection"""
+    migrated = FormModel.migrate_embedded_submissions()
+    print(f"Migrated {migrated} submission(s) to the submissions collection")
+
+@app.cli.command('migrate-number-answers')
+def migrate_number_answers_command():
+    """Store number answers kept as text as numbers"""
+    migrated = FormModel.migrate_number_answers()
+    print(f"Migrated {migrated} number answer(s)")
+
+@app.cli.command('rebuild-form-members')
+def rebuild_form_members_command():
+    """Rebuild every form's members map from its role lists"""
+    rebuilt = FormModel.rebuild_members()
+    print(f"Rebuilt members of {rebuilt} form(s)")
+
+@app.cli.command('rebuild-submission-counters')
+def rebuild_submission_counters_command():
+    """Recompute every form's submission counters"""
+    FormModel.rebuild_submission_counters()
+    print("Submission counters rebuilt")
+
 if __name__ == '__main__':
     app.run(host='127.0.0.1', port=5000, debug=True)
\ No newline at end of file
@@ -4,41 +4,84 @@ Authentication module for OAuth2 with Google
 import os
 import json
 from functools import wraps
-from flask import session, redirect, url_for, request, jsonify, current_app
+from flask import session, redirect, url_for, request, jsonify, current_app, g
 from authlib.integrations.flask_client import OAuth
 from datetime import datetime
 from database import db_manager
+from http_client import oauth_http
 from models import UserModel, FormModel
 
+# Google OAuth endpoints
+GOOGLE_AUTHORIZE_URL = 'https://accounts.google.com/o/oauth2/auth'
+GOOGLE_TOKEN_URL = 'https://oauth2.googleapis.com/token'
+GOOGLE_USERINFO_URL = 'https://www.googleapis.com/oauth2/v2/userinfo'
+
+# User fields read to resolve the session's user on each request
+SESSION_USER_FIELDS = ['name', 'email', 'picture', 'role', 'status', 'session_version']
+
+# Form roles granted each form-level permission
+FORM_PERMISSION_ROLES = {
+    'admin': frozenset(['admin']),
+    'edit': frozenset(['admin', 'editor']),
+    'view_submissions': frozenset(['admin', 'editor', 'viewer']),
+    'view_analytics': frozenset(['admin', 'editor', 'viewer'])
+}
+
 class AuthManager:
     def __init__(self, app=None):
+        self.app = None
         self.oauth = OAuth()
+        self.google = None
+        self.userinfo_url = GOOGLE_USERINFO_URL
         if app:
             self.init_app(app)
     
     def init_app(self, app):
+        self.app = app
         self.oauth.init_app(app)
+        # g can outlive a request when an app context is already pushed; resolve the user afresh
+        if self._forget_current_user not in app.before_request_funcs.get(None, []):
+            app.before_request(self._forget_current_user)
         
         # Only configure Google OAuth if credentials are provided
         client_id = app.config.get('GOOGLE_CLIENT_ID')
         client_secret = app.config.get('GOOGLE_CLIENT_SECRET')
         
         if client_id and client_secret and client_id != 'placeholder_client_id':
-            # Configure Google OAuth without OpenID Connect to avoid JWT issues
-            self.google = self.oauth.register(
-                name='google',
-                client_id=client_id,
-                client_secret=client_secret,
-                authorize_url='https://accounts.google.com/o/oauth2/auth',
-                access_token_url='https://oauth2.googleapis.com/token',
-                client_kwargs={
-                    'scope': 'email profile'  # Remove 'openid' to avoid JWT validation
-                },
-            )
+            self.register_google(client_id, client_secret)
         else:
             # Set google to None if credentials not configured
             self.google = None
     
+    def register_google(self, client_id, client_secret, authorize_url=GOOGLE_AUTHORIZE_URL,
+                        token_url=GOOGLE_TOKEN_URL, userinfo_url=GOOGLE_USERINFO_URL):
+        """Register the Google OAuth client; its HTTP calls go through the shared oauth_http pool"""
+        # authlib keeps the first client registered under a name; reconfiguring starts a fresh registry
+        if self.oauth.create_client('google') is not None:
+            self.oauth = OAuth(self.app)
+        
+        # Configure Google OAuth without OpenID Connect to avoid JWT issues
+        self.google = self.oauth.register(
+            name='google',
+            client_id=client_id,
+            client_secret=client_secret,
+            authorize_url=authorize_url,
+            access_token_url=token_url,
+            client_kwargs={
+                'scope': 'email profile'  # Remove 'openid' to avoid JWT validation
+            },
+            compliance_fix=oauth_http.mount,
+        )
+        self.userinfo_url = userinfo_url
+        return self.google
+    
+    def fetch_user_info(self):
+        """Exchange the callback's authorization code for a token and fetch the user's profile"""
+        token = self.google.authorize_access_token()
+        response = self.google.get(self.userinfo_url, token=token)
+        response.raise_for_status()
+        return response.json()
+    
     def load_users(self):
         """Load users from MongoDB"""
         return UserModel.get_all_users()
@@ -55,31 +98,58 @@ class AuthManager:
     
     def create_or_update_user(self, user_info):
         """Create or update user from OAuth response"""
-        # Check if user exists
-        existing_user = self.get_user_by_email(user_info['email'])
-        
-        if existing_user:
-            # Update existing user
-            update_data = {
-                'name': user_info.get('name', existing_user.get('name')),
-                'picture': user_info.get('picture', existing_user.get('picture'))
-            }
-            user = UserModel.update_user(existing_user['id'], update_data)
-        else:
-            # Create new user
-            user = UserModel.create_user(user_info)
+        return UserModel.upsert_user(user_info)
+    
+    def login_user(self, user):
+        """Start a session for a user
         
-        return user
+        The session only holds the user's ID, role and session version; the
+        rest is looked up per request through the user cache.
+        """
+        session['user'] = {
+            'id': user['id'],
+            'role': user.get('role', 'user'),
+            'v': user.get('session_version', 0)
+        }
+        self._forget_current_user()
+    
+    def _forget_current_user(self):
+        g.pop('current_user', None)
     
     def get_current_user(self):
-        """Get current logged-in user"""
-        if 'user' in session:
-            return session['user']
-        return None
+        """Get current logged-in user, resolved once per request"""
+        if 'current_user' not in g:
+            g.current_user = self._resolve_session_user()
+        return g.current_user
+    
+    def _resolve_session_user(self):
+        """Look up the session's user; ends the session if the user is gone, inactive or revoked"""
+        stamp = session.get('user')
+        if not isinstance(stamp, dict) or not stamp.get('id'):
+            return None
+        
+        user = UserModel.get_users_by_ids([stamp['id']], SESSION_USER_FIELDS).get(stamp['id'])
+        if (not user or user.get('status', 'active') != 'active' or
+                user.get('session_version', 0) != stamp.get('v', 0)):
+            session.pop('user', None)
+            return None
+        
+        compact = {'id': user['id'], 'role': user.get('role', 'user'), 'v': user.get('session_version', 0)}
+        if stamp != compact:
+            # Sessions holding a whole user document or an outdated role are rewritten once
+            session['user'] = compact
+        
+        return {
+            'id': user['id'],
+            'name': user.get('name', ''),
+            'email': user.get('email', ''),
+            'picture': user.get('picture', ''),
+            'role': compact['role']
+        }
     
     def is_authenticated(self):
         """Check if user is authenticated"""
-        return 'user' in session
+        return self.get_current_user() is not None
     
     def has_role(self, role):
         """Check if current user has specific role"""
@@ -108,11 +178,11 @@ class AuthManager:
             ],
             'editor': [
                 'create_form', 'edit_form', 'delete_form', 'view_form',
-                'view_submissions', 'delete_submissions'
+                'view_submissions', 'delete_submissions', 'export_data'
             ],
             'user': [
                 'create_form', 'edit_form', 'delete_form', 'view_form',
-                'view_submissions'
+                'view_submissions', 'export_data'
             ],
             'viewer': [
                 'view_form', 'view_submissions'
@@ -130,34 +200,26 @@ class AuthManager:
         if user.get('role') == 'admin':
             return True
         
-        user_id = user['id']
-        permissions = form.get('permissions', {})
-        
         # Check form-level permissions
-        if permission_type == 'admin':
-            return user_id in permissions.get('admin', [])
-        elif permission_type == 'edit':
-            return (user_id in permissions.get('admin', []) or 
-                    user_id in permissions.get('editor', []))
-        elif permission_type == 'view_submissions':
-            return (user_id in permissions.get('admin', []) or 
-                    user_id in permissions.get('editor', []) or
-                    user_id in permissions.get('viewer', []))
-        
-        return False
+        role = self.get_form_role(form, user['id'])
+        return role in FORM_PERMISSION_ROLES.get(permission_type, ())
+    
+    def get_form_role(self, form, user_id):
+        """Get a user's role on a form, or None if they don't collaborate on it"""
+        return FormModel.get_members(form).get(user_id)
     
-    def get_user_forms(self, forms=None):
-        """Get forms that the current user has access to"""
+    def get_user_forms(self, *profiles):
+        """Get forms that the current user has access to, limited to the given field profiles"""
         user = self.get_current_user()
         if not user:
             return []
         
         # Global admins see all forms
         if user.get('role') == 'admin':
-            return FormModel.get_all_forms()
+            return FormModel.get_all_forms(*profiles)
         
         # Get user's accessible forms from MongoDB
-        return FormModel.get_user_forms(user['id'])
+        return FormModel.get_user_forms(user['id'], *profiles)
 
 # Initialize auth manager
 auth_manager = AuthManager()
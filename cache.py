@@ -0,0 +1,315 @@
+"""
+Form, user and idempotency key caches: in-process LRUs with TTL, plus an optional shared backend for forms
+"""
+from collections import OrderedDict
+import copy
+import json
+import os
+import threading
+import time
+
+class FormCache:
+    """Cache of form documents keyed by form name and field profiles
+
+    Entries are version-stamped with the form's updated_at. Writes must call
+    invalidate() with the new updated_at: local entries are dropped, and when a
+    shared backend is configured the new version is published there so other
+    processes stop serving their local copies too. Without a shared backend,
+    another process's writes can't reach this one, so local entries are
+    served without a database read for only local_ttl seconds: a form
+    changed elsewhere is stale here for at most that long.
+
+    The shared backend is any object with get(key), set(key, value, ex=seconds)
+    and delete(key), such as a redis.Redis client with decode_responses=True.
+    """
+
+    def __init__(self, max_entries=1000, ttl=30, local_ttl=5, backend=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.local_ttl = local_ttl
+        self.backend = backend
+        self._entries = OrderedDict()
+        self._generations = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def _key(form_name, profiles):
+        return f"form:{form_name}:{','.join(sorted(set(profiles))) or 'full'}"
+
+    @staticmethod
+    def _version_key(form_name):
+        return f"form-version:{form_name}"
+
+    def _shared_version(self, form_name):
+        try:
+            return self.backend.get(self._version_key(form_name))
+        except Exception:
+            return None
+
+    def get(self, form_name, profiles):
+        """Get a cached copy of a form, or None on a miss"""
+        key = self._key(form_name, profiles)
+        now = time.monotonic()
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] <= now:
+                del self._entries[key]
+                entry = None
+            if entry:
+                self._entries.move_to_end(key)
+
+        if entry and self.backend is not None and self._shared_version(form_name) != entry[1]:
+            # Another process changed the form since this entry was cached
+            entry = None
+
+        if entry is None and self.backend is not None:
+            entry = self._get_shared(key, form_name)
+            if entry:
+                self._store(key, entry[1], entry[2])
+
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+
+        # Callers may modify the form they get back
+        return copy.deepcopy(entry[2])
+
+    def _get_shared(self, key, form_name):
+        try:
+            raw = self.backend.get(key)
+        except Exception:
+            return None
+        if not raw:
+            return None
+
+        cached = json.loads(raw)
+        if cached['version'] != self._shared_version(form_name):
+            return None
+        return (None, cached['version'], cached['doc'])
+
+    def generation(self, form_name):
+        """Get the local invalidation count of a form, taken before reading it"""
+        with self._lock:
+            return self._generations.get(form_name, 0)
+
+    def set(self, form_name, profiles, doc, generation=None):
+        """Cache a form read from the database
+
+        Pass the generation taken before the read: if the form was invalidated
+        while it was being read, the now stale document is not cached.
+        """
+        version = doc.get('updated_at')
+        if version is None:
+            # Without a version stamp the entry could never be validated
+            return
+        if generation is not None and generation != self.generation(form_name):
+            return
+
+        key = self._key(form_name, profiles)
+        self._store(key, version, copy.deepcopy(doc))
+
+        if self.backend is not None:
+            try:
+                if self._shared_version(form_name) is None:
+                    self.backend.set(self._version_key(form_name), version, ex=self.ttl * 10)
+                self.backend.set(key, json.dumps({'version': version, 'doc': doc}), ex=self.ttl)
+            except Exception:
+                pass
+
+    def _store(self, key, version, doc):
+        ttl = self.ttl if self.backend is not None else self.local_ttl
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, version, doc)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, form_name, version=None):
+        """Drop a form's entries after a write; version is its new updated_at"""
+        prefix = f"form:{form_name}:"
+        with self._lock:
+            for key in [k for k in self._entries if k.startswith(prefix)]:
+                del self._entries[key]
+            self._generations[form_name] = self._generations.get(form_name, 0) + 1
+            self.invalidations += 1
+
+        if self.backend is not None:
+            try:
+                if version is None:
+                    self.backend.delete(self._version_key(form_name))
+                else:
+                    self.backend.set(self._version_key(form_name), version, ex=self.ttl * 10)
+            except Exception:
+                pass
+
+    def clear(self):
+        """Drop every local entry and reset the metrics"""
+        with self._lock:
+            self._entries.clear()
+            self._generations.clear()
+            self.hits = 0
+            self.misses = 0
+            self.invalidations = 0
+
+    def stats(self):
+        """Get hit/miss metrics"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'invalidations': self.invalidations,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'size': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl': self.ttl,
+                'local_ttl': self.local_ttl,
+                'shared_backend': self.backend is not None
+            }
+
+class UserCache:
+    """Small LRU cache of user documents keyed by user ID
+
+    Used for lookups such as collaborator lists, which can tolerate another
+    process's change to a user's name or email showing up to ttl seconds late.
+    Each entry remembers which fields it was read with, so a lookup asking for
+    more fields than were cached is a miss.
+    """
+
+    def __init__(self, max_entries=5000, ttl=60):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_many(self, user_ids, fields=None):
+        """Get cached copies of users; returns (users by ID, IDs that missed)"""
+        wanted = set(fields) if fields is not None else None
+        now = time.monotonic()
+        found = {}
+        missing = []
+
+        with self._lock:
+            for user_id in user_ids:
+                entry = self._entries.get(user_id)
+                if entry and entry[0] <= now:
+                    del self._entries[user_id]
+                    entry = None
+
+                if entry and (entry[1] is None or (wanted is not None and wanted <= entry[1])):
+                    self._entries.move_to_end(user_id)
+                    found[user_id] = copy.deepcopy(entry[2])
+                    self.hits += 1
+                else:
+                    missing.append(user_id)
+                    self.misses += 1
+
+        return found, missing
+
+    def set_many(self, users, fields=None):
+        """Cache users read from the database with the given fields (None for all)"""
+        cached_fields = frozenset(fields) if fields is not None else None
+        expires = time.monotonic() + self.ttl
+
+        with self._lock:
+            for user in users:
+                self._entries[user['id']] = (expires, cached_fields, copy.deepcopy(user))
+                self._entries.move_to_end(user['id'])
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id):
+        """Drop a user after a write"""
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def clear(self):
+        """Drop every entry and reset the metrics"""
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        """Get hit/miss metrics"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'size': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl': self.ttl
+            }
+
+class IdempotencyCache:
+    """Short-lived map of (form ID, idempotency key) to the submission ID it created
+
+    Absorbs client retries without a database round-trip; the unique index on
+    submissions catches the retries that land on another process.
+    """
+
+    def __init__(self, max_entries=100000, ttl=600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.replays = 0
+
+    def get(self, form_id, key):
+        """Get the submission ID created with a key, or None"""
+        with self._lock:
+            entry = self._entries.get((form_id, key))
+            if entry is None:
+                return None
+            if entry[0] <= time.monotonic():
+                del self._entries[(form_id, key)]
+                return None
+            self.replays += 1
+            return entry[1]
+
+    def set(self, form_id, key, submission_id):
+        """Remember the submission ID created with a key"""
+        with self._lock:
+            self._entries[(form_id, key)] = (time.monotonic() + self.ttl, submission_id)
+            self._entries.move_to_end((form_id, key))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        """Drop every entry and reset the metrics"""
+        with self._lock:
+            self._entries.clear()
+            self.replays = 0
+
+    def stats(self):
+        """Get replay metrics"""
+        with self._lock:
+            return {'replays': self.replays, 'size': len(self._entries), 'ttl': self.ttl}
+
+# Global form cache instance
+form_cache = FormCache(
+    max_entries=int(os.getenv('FORM_CACHE_SIZE', 1000)),
+    ttl=int(os.getenv('FORM_CACHE_TTL', 30)),
+    local_ttl=int(os.getenv('FORM_CACHE_LOCAL_TTL', 5))
+)
+
+# Global user cache instance
+user_cache = UserCache(
+    max_entries=int(os.getenv('USER_CACHE_SIZE', 5000)),
+    ttl=int(os.getenv('USER_CACHE_TTL', 60))
+)
+
+# Global idempotency key cache instance
+idempotency_cache = IdempotencyCache(
+    ttl=int(os.getenv('IDEMPOTENCY_CACHE_TTL', 600))
+)
@@ -15,6 +15,10 @@ class DatabaseManager:
         self.db = None
         self.users_collection = None
         self.forms_collection = None
+        self.submissions_collection = None
+        self.mail_dead_letters_collection = None
+        self.uploads_collection = None
+        self.form_changes_collection = None
     
     def init_app(self, app):
         """Initialize database connection with Flask app"""
@@ -48,6 +52,10 @@ class DatabaseManager:
             # Get collections
             self.users_collection = self.db.users
             self.forms_collection = self.db.forms
+            self.submissions_collection = self.db.submissions
+            self.mail_dead_letters_collection = self.db.mail_dead_letters
+            self.uploads_collection = self.db.uploads
+            self.form_changes_collection = self.db.form_changes
             
             # Create indexes for better performance
             self._create_indexes()
@@ -67,9 +75,34 @@ class DatabaseManager:
             self.forms_collection.create_index("name", unique=True)
             self.forms_collection.create_index("created_by")
             self.forms_collection.create_index("status")
-            self.forms_collection.create_index("permissions.admin")
-            self.forms_collection.create_index("permissions.editor")
-            self.forms_collection.create_index("permissions.viewer")
+            self.forms_collection.create_index("member_ids")
+            
+            # Submissions collection indexes
+            self.submissions_collection.create_index("id", unique=True)
+            self.submissions_collection.create_index([("form_id", 1), ("submitted_at", -1), ("id", -1)])
+            self.submissions_collection.create_index(
+                [("form_id", 1), ("idempotency_key", 1)],
+                unique=True,
+                partialFilterExpression={"idempotency_key": {"$exists": True}}
+            )
+            
+            # Mail dead letter indexes
+            self.mail_dead_letters_collection.create_index([("failed_at", -1)])
+            
+            # Upload indexes (unfinished uploads expire)
+            self.uploads_collection.create_index("id", unique=True)
+            self.uploads_collection.create_index(
+                "expires_at",
+                expireAfterSeconds=0,
+                partialFilterExpression={"status": "pending"}
+            )
+            
+            # Form schema change log (replayed to editors; old entries expire)
+            self.form_changes_collection.create_index([("form_id", 1), ("version", 1)], unique=True)
+            self.form_changes_collection.create_index(
+                "at",
+                expireAfterSeconds=int(os.getenv('FORM_CHANGE_LOG_TTL', 7 * 24 * 3600))
+            )
             
             logger.info("Database indexes created successfully")
             
@@ -92,6 +125,22 @@ class DatabaseManager:
         """Get forms collection"""
         return self.forms_collection
     
+    def get_submissions_collection(self):
+        """Get submissions collection"""
+        return self.submissions_collection
+    
+    def get_mail_dead_letters_collection(self):
+        """Get undeliverable mail collection"""
+        return self.mail_dead_letters_collection
+    
+    def get_uploads_collection(self):
+        """Get file uploads collection"""
+        return self.uploads_collection
+    
+    def get_form_changes_collection(self):
+        """Get form schema change log collection"""
+        return self.form_changes_collection
+    
     def close_connection(self):
         """Close database connection"""
         if self.client:
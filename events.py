@@ -0,0 +1,270 @@
+"""
+Publish/subscribe of live events (form builder changes, editor presence, new submissions) for Server-Sent Events streams
+"""
+import json
+import logging
+import os
+import queue
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+def format_sse(event_type, data, event_id=None):
+    """Encode an event in the text/event-stream format"""
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"event: {event_type}")
+    lines.append(f"data: {json.dumps(data, default=str)}")
+    return '\n'.join(lines) + '\n\n'
+
+class Subscription:
+    """A subscriber's bounded queue of events on one channel
+
+    A subscriber that falls buffer_size events behind is marked overflowed
+    instead of blocking publishers; its stream should tell the client to resync.
+    """
+
+    def __init__(self, channel, buffer_size):
+        self.channel = channel
+        self.overflowed = False
+        self._queue = queue.Queue(maxsize=buffer_size)
+
+    def put(self, event):
+        """Queue an event; returns False if it was dropped"""
+        try:
+            self._queue.put_nowait(event)
+            return True
+        except queue.Full:
+            self.overflowed = True
+            return False
+
+    def get(self, timeout=None):
+        """Wait for the next event; None if none arrived within timeout seconds"""
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+class RedisEventRelay:
+    """Relays published events through Redis pub/sub so every app process delivers them
+
+    The relay's listener thread hands each message to the broker's local
+    subscribers, including those of the process that published it.
+    """
+
+    def __init__(self, client, prefix='events:'):
+        self.client = client
+        self.prefix = prefix
+        self._thread = None
+
+    def start(self, broker):
+        pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+        pubsub.psubscribe(f"{self.prefix}*")
+
+        def listen():
+            for message in pubsub.listen():
+                try:
+                    channel = message['channel']
+                    if isinstance(channel, bytes):
+                        channel = channel.decode()
+                    broker.dispatch(channel[len(self.prefix):], json.loads(message['data']))
+                except Exception as e:
+                    logger.error(f"Dropped malformed relayed event: {e}")
+
+        self._thread = threading.Thread(target=listen, name='event-relay', daemon=True)
+        self._thread.start()
+
+    def publish(self, channel, event):
+        self.client.publish(f"{self.prefix}{channel}", json.dumps(event, default=str))
+
+class ChangeStreamListener:
+    """Turns a MongoDB collection's change stream into events
+
+    to_event maps a change to (channel, event_type, data, event_id), or None
+    to skip it. Every app process follows the stream itself, so events are
+    delivered to this process's subscribers only. An interrupted stream is
+    reopened after the last change seen.
+    """
+
+    def __init__(self, collection, to_event, pipeline=None, retry_delay=1):
+        self.collection = collection
+        self.to_event = to_event
+        self.pipeline = pipeline or []
+        self.retry_delay = retry_delay
+        self.resume_token = None
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self, broker):
+        self._thread = threading.Thread(target=self._listen, args=(broker,), name='change-stream', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop following the stream once the current change (or wait) is done"""
+        self._stopped.set()
+
+    def _listen(self, broker):
+        while not self._stopped.is_set():
+            try:
+                with self.collection.watch(self.pipeline, resume_after=self.resume_token) as stream:
+                    for change in stream:
+                        self.resume_token = stream.resume_token
+                        event = self.to_event(change)
+                        if event is not None:
+                            channel, event_type, data, event_id = event
+                            broker.dispatch(channel, {'type': event_type, 'data': data, 'id': event_id})
+            except Exception as e:
+                if not self._stopped.is_set():
+                    logger.error(f"Change stream interrupted, reopening: {e}")
+                    self._stopped.wait(self.retry_delay)
+
+class EventBroker:
+    """Fans events out to the subscribers of a channel and tracks who is present on it
+
+    Events are dicts with a type, data and an optional id (replayable events
+    carry the id clients resume from). Presence is kept from 'presence'
+    events: members announce themselves with heartbeats and are dropped
+    after presence_ttl seconds without one, so presence works the same when
+    events are relayed between processes. Only joins and leaves are delivered
+    to subscribers; heartbeats just refresh the member.
+
+    With a relay, publish goes through it; if the relay fails the event is
+    still delivered to this process's subscribers. Events can also come from
+    sources such as change stream listeners, registered with watch; writers
+    check watches() to avoid publishing what a source already delivers.
+    """
+
+    def __init__(self, buffer_size=100, presence_ttl=45):
+        self.buffer_size = buffer_size
+        self.presence_ttl = presence_ttl
+        self.relay = None
+        self.sources = set()
+        self._lock = threading.Lock()
+        self._subscribers = {}
+        self._presence = {}
+        self.published = 0
+        self.delivered = 0
+        self.overflows = 0
+        self.relay_errors = 0
+
+    def use_relay(self, relay):
+        """Deliver events through a relay shared by every app process"""
+        relay.start(self)
+        self.relay = relay
+
+    def watch(self, name, source):
+        """Deliver the events of a named source, e.g. a change stream listener"""
+        source.start(self)
+        self.sources.add(name)
+
+    def watches(self, name):
+        """Check whether a named source delivers events"""
+        return name in self.sources
+
+    def subscribe(self, channel):
+        """Start receiving a channel's events"""
+        subscription = Subscription(channel, self.buffer_size)
+        with self._lock:
+            self._subscribers.setdefault(channel, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        """Stop receiving events"""
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.channel)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[subscription.channel]
+
+    def publish(self, channel, event_type, data, event_id=None):
+        """Publish an event to every subscriber of a channel"""
+        event = {'type': event_type, 'data': data}
+        if event_id is not None:
+            event['id'] = event_id
+
+        with self._lock:
+            self.published += 1
+
+        if self.relay is not None:
+            try:
+                self.relay.publish(channel, event)
+                return
+            except Exception as e:
+                logger.error(f"Event relay failed, delivering locally only: {e}")
+                with self._lock:
+                    self.relay_errors += 1
+        self.dispatch(channel, event)
+
+    def dispatch(self, channel, event):
+        """Deliver an event to this process's subscribers"""
+        with self._lock:
+            if event['type'] == 'presence' and not self._update_presence(channel, event['data']):
+                return
+            subscribers = list(self._subscribers.get(channel, ()))
+
+        delivered = sum(1 for subscription in subscribers if subscription.put(event))
+        with self._lock:
+            self.delivered += delivered
+            self.overflows += len(subscribers) - delivered
+
+    def _update_presence(self, channel, data):
+        # Returns whether membership changed; callers hold the lock
+        members = self._presence.setdefault(channel, {})
+        client = data['client']
+        if data['state'] == 'left':
+            changed = members.pop(client, None) is not None
+        else:
+            changed = client not in members
+            members[client] = (time.monotonic() + self.presence_ttl, data['member'])
+        if not members:
+            del self._presence[channel]
+        return changed
+
+    def heartbeat(self, channel, client, member):
+        """Announce (or keep announcing) that a client is present on a channel"""
+        self.publish(channel, 'presence', {'client': client, 'state': 'here', 'member': member})
+
+    def leave(self, channel, client):
+        """Announce that a client left a channel"""
+        self.publish(channel, 'presence', {'client': client, 'state': 'left'})
+
+    def presence(self, channel):
+        """Get the members present on a channel, one entry per connected client"""
+        now = time.monotonic()
+        with self._lock:
+            members = self._presence.get(channel, {})
+            for client in [client for client, (expires, _) in members.items() if expires <= now]:
+                del members[client]
+            return [dict(member, client=client) for client, (_, member) in members.items()]
+
+    def reset(self):
+        """Drop presence and reset the metrics (subscriptions are left alone)"""
+        with self._lock:
+            self._presence.clear()
+            self.published = 0
+            self.delivered = 0
+            self.overflows = 0
+            self.relay_errors = 0
+
+    def stats(self):
+        """Get subscriber counts and delivery metrics"""
+        with self._lock:
+            return {
+                'channels': len(self._subscribers),
+                'subscribers': sum(len(subscribers) for subscribers in self._subscribers.values()),
+                'published': self.published,
+                'delivered': self.delivered,
+                'overflows': self.overflows,
+                'relay_errors': self.relay_errors,
+                'shared_relay': self.relay is not None,
+                'sources': sorted(self.sources)
+            }
+
+# Global event broker instance
+event_broker = EventBroker(
+    buffer_size=int(os.getenv('EVENT_BUFFER_SIZE', 100)),
+    presence_ttl=int(os.getenv('EVENT_KEEPALIVE', 15)) * 3
+)
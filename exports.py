@@ -0,0 +1,153 @@
+"""
+Streaming export of form submissions to CSV, NDJSON and XLSX
+"""
+import csv
+import io
+import json
+import tempfile
+from datetime import datetime
+
+# XLSX export is optional - it needs openpyxl
+try:
+    from openpyxl import Workbook
+    XLSX_AVAILABLE = True
+except ImportError:
+    Workbook = None
+    XLSX_AVAILABLE = False
+
+EXPORT_FORMATS = {
+    'csv': ('text/csv', 'csv'),
+    'ndjson': ('application/x-ndjson', 'ndjson'),
+    'xlsx': ('application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', 'xlsx')
+}
+
+# Rows are written out in batches so memory stays flat for any number of submissions
+ROWS_PER_CHUNK = 500
+XLSX_CHUNK_SIZE = 64 * 1024
+
+# Spreadsheets run cells starting with these as formulas
+FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+
+def escape_cell(value):
+    """Keep an answer from running as a formula when the export is opened in a spreadsheet"""
+    if isinstance(value, str) and value.startswith(FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+def flatten_answer(question, responses):
+    """Flatten one answer into a single cell value based on the question type"""
+    answer = responses.get(question['id'], '')
+    question_type = question.get('type')
+
+    if question_type == 'file':
+        # Files are stored as upload references: [{upload_id, name, size, type, sha256}, ...]
+        return '; '.join(
+            f"{f.get('name', '')} ({f.get('size', 0)} bytes)" if isinstance(f, dict) else str(f)
+            for f in (answer or [])
+        )
+
+    if question_type == 'phone':
+        extension = responses.get(f"{question['id']}_ext")
+        return f"{answer} ext. {extension}" if answer and extension else answer
+
+    if question_type == 'rating':
+        try:
+            return int(answer)
+        except (TypeError, ValueError):
+            return answer
+
+    if isinstance(answer, list):
+        # Checkboxes and multi-selects
+        return '; '.join(str(value) for value in answer)
+
+    if isinstance(answer, dict):
+        return json.dumps(answer)
+
+    return answer
+
+def _header(questions):
+    return ['Submission ID', 'Submitted At'] + [q.get('title', q['id']) for q in questions]
+
+def _row(questions, submission):
+    submitted_at = submission.get('submitted_at')
+    if isinstance(submitted_at, datetime):
+        submitted_at = submitted_at.isoformat()
+
+    responses = submission.get('responses') or {}
+    return [submission.get('id'), submitted_at] + [escape_cell(flatten_answer(q, responses)) for q in questions]
+
+def iter_csv(questions, submissions):
+    """Yield a CSV export chunk by chunk"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(_header(questions))
+
+    for count, submission in enumerate(submissions, 1):
+        writer.writerow(_row(questions, submission))
+        if count % ROWS_PER_CHUNK == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate(0)
+
+    yield buffer.getvalue()
+
+def iter_ndjson(questions, submissions):
+    """Yield an NDJSON export, one submission object per line"""
+    lines = []
+    for submission in submissions:
+        submitted_at = submission.get('submitted_at')
+        lines.append(json.dumps({
+            'id': submission.get('id'),
+            'submitted_at': submitted_at.isoformat() if isinstance(submitted_at, datetime) else submitted_at,
+            'responses': submission.get('responses') or {}
+        }, default=str))
+
+        if len(lines) == ROWS_PER_CHUNK:
+            yield '\n'.join(lines) + '\n'
+            lines = []
+
+    if lines:
+        yield '\n'.join(lines) + '\n'
+
+def iter_xlsx(questions, submissions):
+    """Yield an XLSX export
+
+    The workbook is written in openpyxl's write-only mode, which spools rows
+    to a temporary file instead of keeping them in memory. An XLSX file is a
+    zip archive that is only complete once every row is written, so unlike
+    CSV and NDJSON the first byte is sent after the last row is read.
+    """
+    if not XLSX_AVAILABLE:
+        raise RuntimeError("XLSX export requires openpyxl")
+
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet('Submissions')
+    sheet.append(_header(questions))
+
+    for submission in submissions:
+        sheet.append(_row(questions, submission))
+
+    with tempfile.TemporaryFile() as output:
+        workbook.save(output)
+        output.seek(0)
+        while True:
+            chunk = output.read(XLSX_CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
+
+EXPORTERS = {
+    'csv': iter_csv,
+    'ndjson': iter_ndjson,
+    'xlsx': iter_xlsx
+}
+
+def export_submissions(export_format, questions, submissions):
+    """Get a generator streaming the submissions in the given format"""
+    if export_format not in EXPORTERS:
+        raise ValueError(f"Unsupported export format: {export_format}")
+
+    if export_format == 'xlsx' and not XLSX_AVAILABLE:
+        raise ValueError("XLSX export is not available on this server")
+
+    return EXPORTERS[export_format](questions, submissions)
@@ -0,0 +1,129 @@
+"""
+Pooled HTTP connections for calls to external services (the OAuth provider)
+"""
+import logging
+import os
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+logger = logging.getLogger(__name__)
+
+class PooledHTTPAdapter(HTTPAdapter):
+    """HTTP adapter shared by many sessions, applying a default timeout and timing every call
+
+    Clients such as authlib create and close a session per call; closing a
+    session closes its adapters, so this one ignores close() to keep its
+    pooled connections alive. Use shutdown() to really close it.
+    """
+
+    def __init__(self, timeout, on_response, **kwargs):
+        super().__init__(**kwargs)
+        self.timeout = timeout
+        self._on_response = on_response
+
+    def send(self, request, **kwargs):
+        if kwargs.get('timeout') is None:
+            kwargs['timeout'] = self.timeout
+
+        parts = urlsplit(request.url)
+        endpoint = f"{parts.netloc}{parts.path}"
+        started = time.monotonic()
+        try:
+            response = super().send(request, **kwargs)
+        except Exception:
+            self._on_response(endpoint, time.monotonic() - started, None)
+            raise
+        self._on_response(endpoint, time.monotonic() - started, response.status_code)
+        return response
+
+    def close(self):
+        pass
+
+    def shutdown(self):
+        super().close()
+
+class HTTPClientPool:
+    """Connection pool, timeouts, retries and per-endpoint latency metrics for outbound calls
+
+    Connection failures are retried for every method. Read failures and
+    502/503/504 responses are retried only for idempotent methods, so a
+    token request that may have reached the provider is not sent twice.
+    """
+
+    def __init__(self, pool_size=20, connect_timeout=3.05, read_timeout=10, retries=2, backoff=0.2):
+        self.timeout = (connect_timeout, read_timeout)
+        self._lock = threading.Lock()
+        self._metrics = {}
+        self.adapter = PooledHTTPAdapter(
+            self.timeout,
+            self._record,
+            pool_connections=pool_size,
+            pool_maxsize=pool_size,
+            max_retries=Retry(
+                total=retries,
+                connect=retries,
+                read=retries,
+                status=retries,
+                status_forcelist=(502, 503, 504),
+                backoff_factor=backoff,
+                raise_on_status=False
+            )
+        )
+
+    def mount(self, session):
+        """Route a session's requests through the shared pool"""
+        session.mount('https://', self.adapter)
+        session.mount('http://', self.adapter)
+        return session
+
+    def session(self):
+        """Create a requests session using the shared pool"""
+        return self.mount(requests.Session())
+
+    def _record(self, endpoint, elapsed, status):
+        with self._lock:
+            metric = self._metrics.setdefault(endpoint, {
+                'calls': 0, 'errors': 0, 'total_seconds': 0.0, 'max_seconds': 0.0
+            })
+            metric['calls'] += 1
+            if status is None or status >= 500:
+                metric['errors'] += 1
+            metric['total_seconds'] += elapsed
+            metric['max_seconds'] = max(metric['max_seconds'], elapsed)
+        if status is None:
+            logger.warning(f"Call to {endpoint} failed after {elapsed:.3f}s")
+
+    def reset(self):
+        """Reset the metrics"""
+        with self._lock:
+            self._metrics = {}
+
+    def stats(self):
+        """Get call count, errors and latency per endpoint"""
+        with self._lock:
+            return {
+                endpoint: {
+                    'calls': metric['calls'],
+                    'errors': metric['errors'],
+                    'avg_ms': round(metric['total_seconds'] / metric['calls'] * 1000, 1),
+                    'max_ms': round(metric['max_seconds'] * 1000, 1)
+                }
+                for endpoint, metric in self._metrics.items()
+            }
+
+    def close(self):
+        """Close the pooled connections"""
+        self.adapter.shutdown()
+
+# Global pool for OAuth provider calls
+oauth_http = HTTPClientPool(
+    pool_size=int(os.getenv('OAUTH_HTTP_POOL_SIZE', 20)),
+    connect_timeout=float(os.getenv('OAUTH_HTTP_CONNECT_TIMEOUT', 3.05)),
+    read_timeout=float(os.getenv('OAUTH_HTTP_READ_TIMEOUT', 10)),
+    retries=int(os.getenv('OAUTH_HTTP_RETRIES', 2))
+)
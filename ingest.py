@@ -0,0 +1,284 @@
+"""
+Queued submission ingestion: a bounded queue flushed to MongoDB in insert_many batches
+"""
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+import uuid
+from datetime import datetime
+
+from models import DuplicateSubmissionError, FormModel
+
+logger = logging.getLogger(__name__)
+
+# How often an idle writer wakes up to check for shutdown
+POLL_INTERVAL = 1.0
+
+INGEST_MODES = ('direct', 'queued')
+DURABILITY_LEVELS = ('commit', 'enqueue')
+
+class IngestBackpressure(Exception):
+    """The ingestion queue cannot take a submission right now"""
+
+    def __init__(self, message, status, retry_after, idempotency_key=None):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+        self.idempotency_key = idempotency_key
+
+class SubmissionIngestor:
+    """Accepts submissions into a bounded queue that a writer thread flushes in batches
+
+    In 'direct' mode (the default) the ingestor is disabled and submit_form
+    writes each submission itself. In 'queued' mode a batch is flushed with one
+    insert_many once batch_size submissions are waiting or flush_interval
+    seconds after the first one arrived.
+
+    Durability decides when a submission is acknowledged:
+    - 'commit': submit() waits until the batch holding it is written
+    - 'enqueue': submit() returns once it is queued; a crash before the next
+      flush loses it
+
+    A full queue is rejected with 429; a write that fails or doesn't commit
+    within commit_timeout is rejected with 503. A submission that timed out
+    stays queued, so with 'commit' durability every submission carries an
+    idempotency key, given by the server if the client sent none, which the
+    503 hands back for the retry.
+    """
+
+    def __init__(self, mode='direct', durability='commit', max_size=10000, batch_size=100,
+                 flush_interval=0.05, commit_timeout=5.0, max_attempts=3, retry_delay=0.1):
+        if mode not in INGEST_MODES:
+            raise ValueError(f"Unknown ingest mode: {mode}")
+        if durability not in DURABILITY_LEVELS:
+            raise ValueError(f"Unknown durability: {durability}")
+
+        self.mode = mode
+        self.durability = durability
+        self.max_size = max_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.commit_timeout = commit_timeout
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self._queue = queue.Queue(maxsize=max_size)
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._writer = None
+        self._atexit_registered = False
+        self.accepted = 0
+        self.committed = 0
+        self.failed = 0
+        self.duplicates = 0
+        self.rejected = 0
+        self.batches = 0
+
+    @property
+    def enabled(self):
+        return self.mode == 'queued'
+
+    def submit(self, form_id, submission):
+        """Queue a submission for a form; blocks until it is written with 'commit' durability
+
+        With 'commit' durability a submission that reused an idempotency key
+        raises DuplicateSubmissionError carrying the original submission's ID.
+        """
+        submission['form_id'] = form_id
+        submission['submitted_at'] = datetime.now()
+        if self.durability == 'commit' and not submission.get('idempotency_key'):
+            submission['idempotency_key'] = uuid.uuid4().hex
+        item = {
+            'submission': submission,
+            'done': threading.Event() if self.durability == 'commit' else None,
+            'error': None,
+            'duplicate_of': None
+        }
+
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            with self._lock:
+                self.rejected += 1
+            raise IngestBackpressure("Too many submissions right now, please retry shortly", 429, 1)
+
+        with self._lock:
+            self.accepted += 1
+        self.start()
+
+        if item['done'] is None:
+            return
+        if not item['done'].wait(self.commit_timeout):
+            # It may still be written; retrying with its key can't store it twice
+            raise IngestBackpressure("Submission could not be saved in time, please retry", 503, 5,
+                                     idempotency_key=submission.get('idempotency_key'))
+        if item['duplicate_of']:
+            raise DuplicateSubmissionError(item['duplicate_of'])
+        if item['error']:
+            raise IngestBackpressure("Submission could not be saved, please retry", 503, 5)
+
+    def start(self):
+        """Start the writer thread if it is not running"""
+        with self._lock:
+            if self._writer is not None and self._writer.is_alive():
+                return
+            self._stopping.clear()
+            self._writer = threading.Thread(target=self._run, name='submission-writer', daemon=True)
+            self._writer.start()
+
+            if not self._atexit_registered:
+                atexit.register(self.stop)
+                self._atexit_registered = True
+
+    def stop(self, timeout=10):
+        """Stop the writer after it has flushed everything already queued"""
+        self._stopping.set()
+        writer = self._writer
+        if writer is not None:
+            writer.join(timeout)
+
+    def flush(self):
+        """Write everything queued on the calling thread; returns the number of submissions stored"""
+        committed_before = self.committed
+        while True:
+            batch = self._next_batch(wait=0, linger=0)
+            if not batch:
+                break
+            self._write(batch)
+        return self.committed - committed_before
+
+    def _run(self):
+        while True:
+            stopping = self._stopping.is_set()
+            batch = self._next_batch(
+                wait=0 if stopping else POLL_INTERVAL,
+                linger=0 if stopping else self.flush_interval
+            )
+
+            if batch:
+                self._write(batch)
+            elif stopping:
+                break
+
+    def _next_batch(self, wait, linger):
+        """Wait up to wait seconds for a submission, then collect more for up to linger seconds"""
+        try:
+            batch = [self._queue.get(timeout=wait) if wait > 0 else self._queue.get_nowait()]
+        except queue.Empty:
+            return []
+
+        deadline = time.monotonic() + linger
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _write(self, batch):
+        stored = set()
+        pending = batch
+        error = None
+
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                results = FormModel.insert_submissions([item['submission'] for item in pending])
+            except Exception as e:
+                logger.warning(f"Failed to write {len(pending)} submission(s) (attempt {attempt}): {e}")
+                error = e
+                # Rows written before the failure aren't retried or reported as failed
+                recovered = self._stored(pending)
+                if recovered:
+                    FormModel.record_submissions([item['submission'] for item in recovered])
+                    stored.update(item['submission']['id'] for item in recovered)
+                    pending = [item for item in pending if item['submission']['id'] not in stored]
+                if not pending:
+                    error = None
+                    break
+                if attempt < self.max_attempts:
+                    time.sleep(self.retry_delay * 2 ** (attempt - 1))
+            else:
+                stored.update(item['submission']['id'] for item, was_stored in zip(pending, results) if was_stored)
+                error = None
+                break
+
+        dropped = set()
+        if error is not None:
+            logger.error(f"Dropping {len(pending)} submission(s) after {self.max_attempts} attempts: {error}")
+            dropped = {item['submission']['id'] for item in pending}
+
+        committed = 0
+        duplicates = 0
+        for item in batch:
+            submission = item['submission']
+            if submission['id'] in stored:
+                committed += 1
+            elif submission['id'] in dropped:
+                item['error'] = str(error)
+            else:
+                original_id = self._original_submission_id(submission)
+                if original_id == submission['id']:
+                    # Stored by an earlier attempt whose outcome was lost
+                    FormModel.record_submissions([submission])
+                    committed += 1
+                elif original_id:
+                    item['duplicate_of'] = original_id
+                    duplicates += 1
+                else:
+                    item['error'] = 'Submission was not stored'
+            if item['done'] is not None:
+                item['done'].set()
+
+        with self._lock:
+            self.batches += 1
+            self.committed += committed
+            self.duplicates += duplicates
+            self.failed += len(batch) - committed - duplicates
+
+    def _stored(self, items):
+        """Get the items of a failed write that were stored anyway"""
+        try:
+            stored_ids = FormModel.get_stored_submission_ids(item['submission']['id'] for item in items)
+        except Exception as e:
+            logger.warning(f"Failed to check which submissions were stored: {e}")
+            return []
+        return [item for item in items if item['submission']['id'] in stored_ids]
+
+    def _original_submission_id(self, submission):
+        """Get the ID of the submission an unstored one duplicated by idempotency key"""
+        if not submission.get('idempotency_key'):
+            return None
+        try:
+            return FormModel.get_submission_id_by_idempotency_key(
+                submission['form_id'], submission['idempotency_key']
+            )
+        except Exception:
+            return None
+
+    def stats(self):
+        """Get ingestion metrics"""
+        with self._lock:
+            return {
+                'mode': self.mode,
+                'durability': self.durability,
+                'queued': self._queue.qsize(),
+                'max_size': self.max_size,
+                'accepted': self.accepted,
+                'committed': self.committed,
+                'failed': self.failed,
+                'duplicates': self.duplicates,
+                'rejected': self.rejected,
+                'batches': self.batches
+            }
+
+# Global submission ingestor instance
+submission_ingestor = SubmissionIngestor(
+    mode=os.getenv('SUBMISSION_INGEST_MODE', 'direct'),
+    durability=os.getenv('SUBMISSION_DURABILITY', 'commit'),
+    max_size=int(os.getenv('SUBMISSION_QUEUE_SIZE', 10000)),
+    batch_size=int(os.getenv('SUBMISSION_BATCH_SIZE', 100)),
+    flush_interval=float(os.getenv('SUBMISSION_FLUSH_INTERVAL', 0.05))
+)
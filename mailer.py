@@ -0,0 +1,253 @@
+"""
+Background mail delivery: a queue drained by a worker thread over one SMTP connection
+"""
+import atexit
+import heapq
+import itertools
+import logging
+import os
+import queue
+import smtplib
+import threading
+import time
+
+from models import MailModel
+
+logger = logging.getLogger(__name__)
+
+# How often an idle worker wakes up to check for retries and shutdown
+POLL_INTERVAL = 1.0
+
+def _is_permanent(error):
+    """Check whether an SMTP error will fail again however often it is retried"""
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return all(500 <= code < 600 for code, _ in error.recipients.values())
+    if isinstance(error, smtplib.SMTPResponseException):
+        return 500 <= error.smtp_code < 600
+    return False
+
+class MailQueue:
+    """Queue of flask_mail messages delivered in the background
+
+    The worker thread is started by the first enqueue(), so each server process
+    gets its own worker after forking. It sends every message waiting in the
+    queue over the same SMTP connection, which is closed again once the queue
+    has been idle for idle_timeout seconds.
+
+    Failed messages are retried with exponential backoff. Messages that fail
+    max_attempts times, or are rejected permanently (5xx), are recorded in the
+    mail_dead_letters collection.
+    """
+
+    def __init__(self, app=None, mail=None, max_size=1000, batch_size=50, max_attempts=5,
+                 retry_delay=2.0, max_retry_delay=300.0, idle_timeout=30.0, autostart=True):
+        self.max_size = max_size
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.idle_timeout = idle_timeout
+        self.autostart = autostart
+        self.app = None
+        self.mail = None
+        self._queue = queue.Queue(maxsize=max_size)
+        self._retries = []
+        self._sequence = itertools.count()
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._worker = None
+        self._atexit_registered = False
+        self._connection = None
+        self._last_activity = time.monotonic()
+        self.sent = 0
+        self.retried = 0
+        self.dead_lettered = 0
+
+        if app is not None:
+            self.init_app(app, mail)
+
+    def init_app(self, app, mail):
+        """Deliver through the Flask-Mail extension of an app"""
+        self.app = app
+        self.mail = mail
+
+    def enqueue(self, message, kind='email'):
+        """Queue a message for delivery; returns False if the queue is full"""
+        item = {'message': message, 'kind': kind, 'attempts': 0, 'error': None}
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            logger.warning(f"Mail queue full, dropping {kind} to {message.recipients}")
+            return False
+
+        if self.autostart:
+            self.start()
+        return True
+
+    def start(self):
+        """Start the worker thread if it is not running"""
+        with self._lock:
+            if self._worker is not None and self._worker.is_alive():
+                return
+            self._stopping.clear()
+            self._worker = threading.Thread(target=self._run, name='mail-queue', daemon=True)
+            self._worker.start()
+
+            if not self._atexit_registered:
+                atexit.register(self.stop)
+                self._atexit_registered = True
+
+    def stop(self, timeout=10):
+        """Stop the worker after it has sent the messages already queued
+
+        Messages still waiting for a retry are recorded as dead letters.
+        """
+        self._stopping.set()
+        worker = self._worker
+        if worker is not None:
+            worker.join(timeout)
+
+    def process_pending(self):
+        """Send every message that is due on the calling thread; returns the number sent"""
+        sent_before = self.sent
+        with self.app.app_context():
+            try:
+                while True:
+                    batch = self._next_batch(wait=0)
+                    if not batch:
+                        break
+                    self._send_batch(batch)
+            finally:
+                self._close_connection()
+        return self.sent - sent_before
+
+    def _run(self):
+        with self.app.app_context():
+            try:
+                while True:
+                    wait = 0 if self._stopping.is_set() else min(POLL_INTERVAL, self._time_to_next_retry())
+                    batch = self._next_batch(wait)
+
+                    if batch:
+                        self._send_batch(batch)
+                    elif self._stopping.is_set():
+                        break
+                    elif time.monotonic() - self._last_activity >= self.idle_timeout:
+                        # Don't hold an SMTP connection open while there is nothing to send
+                        self._close_connection()
+            finally:
+                self._close_connection()
+                self._abandon_retries()
+
+    def _time_to_next_retry(self):
+        with self._lock:
+            if not self._retries:
+                return POLL_INTERVAL
+            return max(self._retries[0][0] - time.monotonic(), 0)
+
+    def _next_batch(self, wait):
+        """Collect up to batch_size messages that are due, waiting up to wait seconds for one"""
+        batch = []
+        now = time.monotonic()
+        with self._lock:
+            while self._retries and self._retries[0][0] <= now and len(batch) < self.batch_size:
+                batch.append(heapq.heappop(self._retries)[2])
+
+        try:
+            if not batch and wait > 0:
+                batch.append(self._queue.get(timeout=wait))
+            while len(batch) < self.batch_size:
+                batch.append(self._queue.get_nowait())
+        except queue.Empty:
+            pass
+
+        return batch
+
+    def _connect(self):
+        if self._connection is None:
+            self._connection = self.mail.connect().__enter__()
+        return self._connection
+
+    def _close_connection(self):
+        connection, self._connection = self._connection, None
+        if connection is None:
+            return
+        try:
+            connection.__exit__(None, None, None)
+        except Exception:
+            # The server may already have dropped the connection
+            if connection.host:
+                connection.host.close()
+
+    def _send_batch(self, batch):
+        for item in batch:
+            try:
+                self._connect().send(item['message'])
+            except Exception as e:
+                if not isinstance(e, (smtplib.SMTPResponseException, smtplib.SMTPRecipientsRefused)):
+                    # The connection may be broken, so open a new one for the next message
+                    self._close_connection()
+                self._failed(item, e)
+            else:
+                self.sent += 1
+        self._last_activity = time.monotonic()
+
+    def _failed(self, item, error):
+        item['attempts'] += 1
+        item['error'] = str(error)
+
+        if item['attempts'] >= self.max_attempts or _is_permanent(error):
+            self._dead_letter(item)
+            return
+
+        delay = min(self.retry_delay * 2 ** (item['attempts'] - 1), self.max_retry_delay)
+        logger.warning(f"Failed to send {item['kind']} (attempt {item['attempts']}), retrying in {delay}s: {error}")
+        with self._lock:
+            heapq.heappush(self._retries, (time.monotonic() + delay, next(self._sequence), item))
+            self.retried += 1
+
+    def _dead_letter(self, item):
+        message = item['message']
+        logger.error(f"Giving up on {item['kind']} to {message.recipients}: {item['error']}")
+        self.dead_lettered += 1
+
+        try:
+            MailModel.add_dead_letter({
+                'kind': item['kind'],
+                'recipients': list(message.recipients),
+                'subject': message.subject,
+                'html': message.html,
+                'body': message.body,
+                'attempts': item['attempts'],
+                'error': item['error']
+            })
+        except Exception as e:
+            logger.error(f"Failed to record undeliverable {item['kind']}: {e}")
+
+    def _abandon_retries(self):
+        """Dead-letter messages still waiting for a retry when the worker stops"""
+        with self._lock:
+            retries, self._retries = self._retries, []
+        for _, _, item in retries:
+            self._dead_letter(item)
+
+    def stats(self):
+        """Get delivery metrics"""
+        with self._lock:
+            retrying = len(self._retries)
+            worker_alive = self._worker is not None and self._worker.is_alive()
+        return {
+            'queued': self._queue.qsize(),
+            'retrying': retrying,
+            'sent': self.sent,
+            'retried': self.retried,
+            'dead_lettered': self.dead_lettered,
+            'worker_alive': worker_alive
+        }
+
+# Global mail queue instance, bound to the app's Flask-Mail extension in app.py
+mail_queue = MailQueue(
+    max_size=int(os.getenv('MAIL_QUEUE_SIZE', 1000)),
+    max_attempts=int(os.getenv('MAIL_MAX_ATTEMPTS', 5)),
+    retry_delay=float(os.getenv('MAIL_RETRY_DELAY', 2))
+)
@@ -1,19 +1,31 @@
 """
-Database models for users and forms
+Database models for users, forms, mail and uploads
 """
 from datetime import datetime
+import base64
 import hashlib
+import json
+import logging
 import os
+from analytics import LATE_SUBMISSION_WINDOW, analytics_cache, build_pipeline, merge, report, summarize
+from cache import form_cache, user_cache
+from events import event_broker
+from validation import number_answer, validator_cache
 
 # Make MongoDB imports optional for CI compatibility
 try:
-    from pymongo.errors import DuplicateKeyError
+    from pymongo import ReturnDocument, UpdateOne
+    from pymongo.errors import BulkWriteError, DuplicateKeyError
     from bson import ObjectId
     MONGODB_AVAILABLE = True
 except ImportError:
     # Fallback for testing environments without MongoDB
     class DuplicateKeyError(Exception):
         pass
+    class BulkWriteError(Exception):
+        pass
+    ReturnDocument = None
+    UpdateOne = None
     ObjectId = str
     MONGODB_AVAILABLE = False
 
@@ -26,6 +38,12 @@ if MONGODB_AVAILABLE and not os.getenv('CI'):
 else:
     db_manager = None
 
+logger = logging.getLogger(__name__)
+
+# Page size bounds for the submissions API
+DEFAULT_SUBMISSIONS_PAGE_SIZE = 50
+MAX_SUBMISSIONS_PAGE_SIZE = 500
+
 def serialize_doc(doc):
     """Convert MongoDB document to JSON-serializable format"""
     if doc is None:
@@ -49,6 +67,42 @@ def serialize_doc(doc):
     
     return doc
 
+def _encode_cursor(submission):
+    """Encode the keyset position after a submission as an opaque cursor"""
+    position = {'submitted_at': submission['submitted_at'].isoformat(), 'id': submission['id']}
+    return base64.urlsafe_b64encode(json.dumps(position).encode()).decode()
+
+def _decode_cursor(cursor):
+    """Decode a cursor into its (submitted_at, id) keyset position"""
+    try:
+        position = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return datetime.fromisoformat(position['submitted_at']), position['id']
+    except (ValueError, KeyError, TypeError):
+        raise ValueError("Invalid cursor")
+
+def _after_cursor(cursor, sort):
+    """Build the $or clause matching submissions past a cursor in the given sort order"""
+    submitted_at, submission_id = _decode_cursor(cursor)
+    op = '$lt' if sort == 'desc' else '$gt'
+    return [
+        {'submitted_at': {op: submitted_at}},
+        {'submitted_at': submitted_at, 'id': {op: submission_id}}
+    ]
+
+class DuplicateSubmissionError(ValueError):
+    """A submission reused the idempotency key of an earlier one"""
+    
+    def __init__(self, submission_id):
+        super().__init__("Submission already received")
+        self.submission_id = submission_id
+
+class SchemaConflictError(ValueError):
+    """A schema change was based on an outdated schema version"""
+    
+    def __init__(self, current_version):
+        super().__init__("Form was changed by someone else")
+        self.current_version = current_version
+
 def _check_db_available():
     """Check if database is available, raise error if not"""
     if db_manager is None:
@@ -73,7 +127,8 @@ class UserModel:
                 'role': 'user',  # Default role
                 'created_at': datetime.now(),
                 'last_login': datetime.now(),
-                'status': 'active'
+                'status': 'active',
+                'session_version': 0
             }
             
             result = db_manager.get_users_collection().insert_one(user_data)
@@ -83,20 +138,80 @@ class UserModel:
         except DuplicateKeyError:
             raise ValueError("User with this email already exists")
     
+    @staticmethod
+    def upsert_user(user_info):
+        """Create the user for an email or refresh its profile, in one atomic round-trip
+        
+        Profile fields the provider didn't send are left as they are on
+        existing users. Concurrent first logins can't create two users: the
+        loser of the insert race hits the unique email index and retries as
+        an update.
+        """
+        _check_db_available()
+        now = datetime.now()
+        profile = {field: user_info[field] for field in ('name', 'picture') if field in user_info}
+        
+        on_insert = {
+            'id': hashlib.md5(user_info['email'].encode()).hexdigest()[:8],
+            'role': 'user',  # Default role
+            'created_at': now,
+            'status': 'active',
+            'session_version': 0
+        }
+        on_insert.update({field: '' for field in ('name', 'picture') if field not in profile})
+        
+        for attempt in range(2):
+            try:
+                doc = db_manager.get_users_collection().find_one_and_update(
+                    {'email': user_info['email']},
+                    {
+                        '$set': {**profile, 'last_login': now},
+                        '$setOnInsert': on_insert
+                    },
+                    upsert=True,
+                    return_document=ReturnDocument.AFTER
+                )
+                break
+            except DuplicateKeyError:
+                if attempt:
+                    raise ValueError("User could not be saved")
+        
+        user_cache.invalidate(doc['id'])
+        return serialize_doc(doc)
+    
     @staticmethod
     def update_user(user_id, update_data):
-        """Update existing user"""
+        """Update existing user and return the updated user in the same round-trip
+        
+        Changing a user's status ends their sessions.
+        """
         update_data['last_login'] = datetime.now()
+        update = {'$set': update_data}
+        if 'status' in update_data:
+            update['$inc'] = {'session_version': 1}
         
-        result = db_manager.get_users_collection().update_one(
+        doc = db_manager.get_users_collection().find_one_and_update(
             {'id': user_id},
-            {'$set': update_data}
+            update,
+            return_document=ReturnDocument.AFTER
         )
         
-        if result.matched_count == 0:
+        if doc is None:
             raise ValueError("User not found")
         
-        return UserModel.get_user_by_id(user_id)
+        user_cache.invalidate(user_id)
+        return serialize_doc(doc)
+    
+    @staticmethod
+    def revoke_sessions(user_id):
+        """End every session of a user by bumping their session version"""
+        result = db_manager.get_users_collection().update_one(
+            {'id': user_id},
+            {'$inc': {'session_version': 1}}
+        )
+        if result.matched_count == 0:
+            raise ValueError("User not found")
+        user_cache.invalidate(user_id)
     
     @staticmethod
     def get_user_by_email(email):
@@ -104,12 +219,41 @@ class UserModel:
         doc = db_manager.get_users_collection().find_one({'email': email})
         return serialize_doc(doc)
     
+    @staticmethod
+    def get_users_by_emails(emails):
+        """Get users for many emails with one query, keyed by email"""
+        docs = db_manager.get_users_collection().find({'email': {'$in': list(emails)}})
+        return {doc['email']: serialize_doc(doc) for doc in docs}
+    
     @staticmethod
     def get_user_by_id(user_id):
         """Get user by ID"""
         doc = db_manager.get_users_collection().find_one({'id': user_id})
         return serialize_doc(doc)
     
+    @staticmethod
+    def get_users_by_ids(user_ids, fields=None):
+        """Get users for many IDs, keyed by ID
+        
+        Cached users are served from the user cache; the rest are read with one
+        $in query, fetching only the given fields (all fields if None).
+        """
+        users, missing = user_cache.get_many(set(user_ids), fields)
+        
+        if missing:
+            projection = None
+            if fields is not None:
+                projection = {field: 1 for field in fields}
+                projection['id'] = 1
+            
+            docs = serialize_doc(list(db_manager.get_users_collection().find(
+                {'id': {'$in': missing}}, projection
+            )))
+            user_cache.set_many(docs, fields)
+            users.update((doc['id'], doc) for doc in docs)
+        
+        return users
+    
     @staticmethod
     def get_all_users():
         """Get all users"""
@@ -120,17 +264,97 @@ class UserModel:
     def delete_user(user_id):
         """Delete user by ID"""
         result = db_manager.get_users_collection().delete_one({'id': user_id})
+        user_cache.invalidate(user_id)
         return result.deleted_count > 0
 
 class FormModel:
     """Form model for MongoDB operations"""
     
+    # Named field profiles for reads, so routes only fetch the fields they touch
+    FIELD_PROFILES = {
+        'meta': ['name', 'status', 'created_by', 'created_by_name', 'created_at', 'updated_at',
+                 'submission_count', 'last_submission_at'],
+        'schema': ['name', 'status', 'questions', 'settings', 'schema_version', 'rate_limits'],
+        'permissions': ['name', 'status', 'created_by', 'permissions', 'members'],
+        'dashboard': ['name', 'status', 'created_by', 'created_by_name', 'created_at', 'updated_at',
+                      'submission_count', 'last_submission_at', 'question_count'],
+        'full': None
+    }
+    
+    # Counters change on every submission, so reads that include them skip the form cache
+    VOLATILE_FIELDS = ('submission_count', 'last_submission_at', 'daily_submissions')
+    
+    # Collaborator roles, from most to least privileged
+    ROLES = ('admin', 'editor', 'viewer')
+    
+    # Operations accepted by patch_questions
+    QUESTION_OPS = ('add', 'update', 'move', 'delete')
+    
+    # Fields computed by MongoDB instead of being stored on the form
+    COMPUTED_FIELDS = {
+        'question_count': {'$size': {'$ifNull': ['$questions', []]}}
+    }
+    
+    @staticmethod
+    def _projection(profiles):
+        """Build a MongoDB projection from one or more field profiles"""
+        if not profiles or 'full' in profiles:
+            return None
+        
+        # updated_at is always read: it is the version stamp of cached forms
+        projection = {'updated_at': 1}
+        for profile in profiles:
+            if profile not in FormModel.FIELD_PROFILES:
+                raise ValueError(f"Unknown form field profile: {profile}")
+            for field in FormModel.FIELD_PROFILES[profile]:
+                projection[field] = FormModel.COMPUTED_FIELDS.get(field, 1)
+        return projection
+    
+    @staticmethod
+    def _find_forms(query, profiles):
+        """Find forms matching a query, limited to the fields of the given profiles"""
+        projection = FormModel._projection(profiles)
+        if projection is None:
+            docs = list(db_manager.get_forms_collection().find(query))
+        else:
+            # $project supports computed fields such as question_count
+            docs = list(db_manager.get_forms_collection().aggregate([
+                {'$match': query},
+                {'$project': projection}
+            ]))
+        return serialize_doc(docs)
+    
+    @staticmethod
+    def build_members(permissions):
+        """Map each collaborator's user ID to their role; users listed under several roles keep the highest"""
+        members = {}
+        for role in reversed(FormModel.ROLES):
+            for user_id in permissions.get(role, []):
+                members[user_id] = role
+        return members
+    
+    @staticmethod
+    def get_members(form):
+        """Get a form's user ID to role map
+        
+        Forms stored before the map existed get it built from their role lists,
+        once per form object.
+        """
+        members = form.get('members')
+        if members is None:
+            members = form['members'] = FormModel.build_members(form.get('permissions', {}))
+        return members
+    
     @staticmethod
     def create_form(form_data):
         """Create a new form"""
         try:
             form_data['created_at'] = datetime.now()
             form_data['updated_at'] = datetime.now()
+            form_data.setdefault('submission_count', 0)
+            form_data.setdefault('schema_version', 0)
+            form_data['members'] = FormModel.build_members(form_data.get('permissions', {}))
+            form_data['member_ids'] = list(form_data['members'])
             
             result = db_manager.get_forms_collection().insert_one(form_data)
             form_data['_id'] = str(result.inserted_id)
@@ -140,105 +364,975 @@ class FormModel:
             raise ValueError("Form with this name already exists")
     
     @staticmethod
-    def update_form(form_name, update_data):
-        """Update existing form"""
+    def update_form(form_name, update_data, *profiles, expected_version=None):
+        """Update existing form
+        
+        Returns the updated form limited to the fields of the given profiles,
+        read in the same round-trip, or None if no profiles are given.
+        Replacing the questions bumps the schema version. With an
+        expected_version, the update only applies to the form at that schema
+        version and raises SchemaConflictError otherwise.
+        """
         update_data['updated_at'] = datetime.now()
+        update = {'$set': update_data}
+        if 'questions' in update_data:
+            update['$inc'] = {'schema_version': 1}
         
-        result = db_manager.get_forms_collection().update_one(
-            {'name': form_name},
-            {'$set': update_data}
+        query = {'name': form_name}
+        if expected_version is not None:
+            query = FormModel._schema_version_query(form_name, expected_version)
+        
+        if profiles:
+            doc = db_manager.get_forms_collection().find_one_and_update(
+                query,
+                update,
+                projection=FormModel._projection(profiles),
+                return_document=ReturnDocument.AFTER
+            )
+            found = doc is not None
+        else:
+            doc = None
+            found = db_manager.get_forms_collection().update_one(
+                query,
+                update
+            ).matched_count > 0
+        
+        if not found:
+            if expected_version is not None:
+                current = db_manager.get_forms_collection().find_one({'name': form_name}, {'schema_version': 1})
+                if current is not None:
+                    raise SchemaConflictError(current.get('schema_version', 0))
+            raise ValueError("Form not found")
+        
+        form_cache.invalidate(form_name, update_data['updated_at'].isoformat())
+        if 'questions' in update_data:
+            validator_cache.invalidate(form_name)
+            # Whole-list saves aren't in the change log; live editors fetch the questions again
+            event_broker.publish(FormModel.channel(form_name), 'resync', {})
+        return serialize_doc(doc)
+    
+    @staticmethod
+    def _schema_version_query(form_name, version):
+        """Match a form at a schema version; forms saved before versioning are at version 0"""
+        if version == 0:
+            return {'name': form_name, 'schema_version': {'$in': [0, None]}}
+        return {'name': form_name, 'schema_version': version}
+    
+    @staticmethod
+    def _check_question_op(op):
+        """Validate the shape of a question patch operation"""
+        if not isinstance(op, dict) or op.get('op') not in FormModel.QUESTION_OPS:
+            raise ValueError(f"Operation must be one of: {', '.join(FormModel.QUESTION_OPS)}")
+        
+        if op['op'] == 'add':
+            question = op.get('question')
+            if not isinstance(question, dict) or not isinstance(question.get('id'), str) or not question['id']:
+                raise ValueError("Added questions need an id")
+        elif not isinstance(op.get('id'), str) or not op['id']:
+            raise ValueError("Operation needs a question id")
+        
+        index = op.get('index')
+        if op['op'] == 'move' and index is None:
+            raise ValueError("Move needs an index")
+        if index is not None and (not isinstance(index, int) or isinstance(index, bool) or index < 0):
+            raise ValueError("Index must be a non-negative integer")
+        
+        if op['op'] == 'update':
+            fields = op.get('fields', {})
+            removed = op.get('remove', [])
+            if not isinstance(fields, dict) or not isinstance(removed, list) or not (fields or removed):
+                raise ValueError("Update needs fields to set or remove")
+            for field in list(fields) + removed:
+                if not isinstance(field, str) or not field or field == 'id' or '.' in field or field.startswith('$'):
+                    raise ValueError(f"Invalid question field: {field}")
+    
+    @staticmethod
+    def _apply_question_op(questions, op):
+        """Apply a validated question operation to a list of questions in place"""
+        if op['op'] == 'add':
+            question = op['question']
+            if any(existing.get('id') == question['id'] for existing in questions):
+                raise ValueError(f"Question {question['id']} already exists")
+            index = op.get('index')
+            questions.insert(len(questions) if index is None else index, dict(question))
+            return
+        
+        position = next((i for i, existing in enumerate(questions) if existing.get('id') == op['id']), None)
+        if position is None:
+            raise ValueError(f"Question {op['id']} not found")
+        
+        if op['op'] == 'update':
+            questions[position] = dict(questions[position], **op.get('fields', {}))
+            for field in op.get('remove', []):
+                questions[position].pop(field, None)
+        elif op['op'] == 'delete':
+            del questions[position]
+        else:
+            questions.insert(op['index'], questions.pop(position))
+    
+    @staticmethod
+    def _targeted_question_update(ids, ops):
+        """Compile a batch of one kind of question operation into an update
+        
+        ids are the question IDs in order at the version the batch applies
+        to; the write is conditioned on that version, so positions are stable.
+        Updates set and unset fields by position, deletes pull by ID and a
+        single add is pushed at its index.
+        """
+        if ops[0]['op'] == 'add':
+            push = {'$each': [dict(ops[0]['question'])]}
+            if ops[0].get('index') is not None:
+                push['$position'] = ops[0]['index']
+            return {'$push': {'questions': push}}
+        if ops[0]['op'] == 'delete':
+            return {'$pull': {'questions': {'id': {'$in': [op['id'] for op in ops]}}}}
+        
+        sets, unsets = {}, {}
+        for op in ops:
+            path = f"questions.{ids.index(op['id'])}"
+            for field, value in op.get('fields', {}).items():
+                sets[f'{path}.{field}'] = value
+                unsets.pop(f'{path}.{field}', None)
+            for field in op.get('remove', []):
+                unsets[f'{path}.{field}'] = ''
+                sets.pop(f'{path}.{field}', None)
+        update = {'$set': sets}
+        if unsets:
+            update['$unset'] = unsets
+        return update
+    
+    @staticmethod
+    def patch_questions(form_name, version, ops, author=None):
+        """Apply question operations to a form as one write
+        
+        The operations are applied in order to the questions at the version
+        the caller read, and written only if the form is still at that
+        version, so a batch is stored whole or not at all and a form edited
+        since raises SchemaConflictError instead of being overwritten.
+        Operations:
+        
+            {'op': 'add', 'question': {...}, 'index': 2}   # index defaults to the end
+            {'op': 'update', 'id': 'q_1', 'fields': {...}, 'remove': [...]}
+            {'op': 'move', 'id': 'q_1', 'index': 0}
+            {'op': 'delete', 'id': 'q_1'}
+        
+        Batches of updates, of deletes, or a single add are checked against
+        the question IDs and written as targeted updates of the questions
+        they touch. Moves and mixed batches rewrite the questions array:
+        MongoDB can't pull from and push to one array in a single update,
+        and splitting the batch across writes would lose its all-or-nothing
+        guarantee without multi-document transactions.
+        
+        The batch is recorded in the form change log under its version, so
+        editors behind the current version can catch up with a delta, and
+        published to the form's live channel with its author.
+        Returns the new schema version.
+        """
+        for op in ops:
+            FormModel._check_question_op(op)
+        
+        forms_collection = db_manager.get_forms_collection()
+        
+        def current_version():
+            current = forms_collection.find_one({'name': form_name}, {'schema_version': 1})
+            if current is None:
+                raise ValueError("Form not found")
+            return current.get('schema_version', 0)
+        
+        kinds = {op['op'] for op in ops}
+        targeted = kinds in ({'update'}, {'delete'}) or (kinds == {'add'} and len(ops) == 1)
+        form = forms_collection.find_one(
+            FormModel._schema_version_query(form_name, version),
+            {'questions.id': 1} if targeted else {'questions': 1}
         )
+        if form is None:
+            raise SchemaConflictError(current_version())
+        
+        questions = list(form.get('questions', []))
+        ids = [question.get('id') for question in questions]
+        for op in ops:
+            FormModel._apply_question_op(questions, op)
+        
+        if targeted:
+            update = FormModel._targeted_question_update(ids, ops)
+        else:
+            update = {'$set': {'questions': questions}}
+        updated_at = datetime.now()
+        update.setdefault('$set', {}).update(schema_version=version + 1, updated_at=updated_at)
         
+        result = forms_collection.update_one(FormModel._schema_version_query(form_name, version), update)
         if result.matched_count == 0:
-            raise ValueError("Form not found")
+            # Saved by someone else between the read and the write
+            raise SchemaConflictError(current_version())
+        
+        form_cache.invalidate(form_name, updated_at.isoformat())
+        validator_cache.invalidate(form_name)
         
-        return FormModel.get_form_by_name(form_name)
+        version += 1
+        entry = {'version': version, 'ops': ops, 'author': author}
+        db_manager.get_form_changes_collection().insert_one(dict(entry, form_id=str(form['_id']), at=updated_at))
+        event_broker.publish(FormModel.channel(form_name), 'change', entry, event_id=version)
+        return version
     
     @staticmethod
-    def get_form_by_name(form_name):
-        """Get form by name"""
-        doc = db_manager.get_forms_collection().find_one({'name': form_name})
-        return serialize_doc(doc)
+    def channel(form_name):
+        """Name of the live event channel of a form's builder"""
+        return f"form:{form_name}"
     
     @staticmethod
-    def get_all_forms():
-        """Get all forms"""
-        docs = list(db_manager.get_forms_collection().find())
-        return serialize_doc(docs)
+    def get_schema_changes(form_name, since_version, entries=False):
+        """Get what changed in a form's questions after a schema version
+        
+        Returns {'version': current version, 'changes': [ops in order]} when
+        the change log covers every version since, otherwise
+        {'version': current version, 'questions': [current questions]}; full
+        saves and expired log entries leave gaps. None if the form is gone.
+        With entries, changes are the log entries: {'version', 'ops', 'author'}.
+        """
+        form = db_manager.get_forms_collection().find_one(
+            {'name': form_name}, {'questions': 1, 'schema_version': 1}
+        )
+        if form is None:
+            return None
+        
+        version = form.get('schema_version', 0)
+        if 0 <= since_version < version:
+            log = list(db_manager.get_form_changes_collection().find(
+                {'form_id': str(form['_id']), 'version': {'$gt': since_version, '$lte': version}},
+                {'_id': 0, 'version': 1, 'ops': 1, 'author': 1}
+            ).sort('version', 1))
+            if [entry['version'] for entry in log] == list(range(since_version + 1, version + 1)):
+                return {'version': version, 'changes': log if entries else [op for entry in log for op in entry['ops']]}
+        elif since_version == version:
+            return {'version': version, 'changes': []}
+        
+        return {'version': version, 'questions': form.get('questions', [])}
+    
+    @staticmethod
+    def get_form_by_name(form_name, *profiles):
+        """Get form by name, limited to the fields of the given profiles (full by default)"""
+        projection = FormModel._projection(profiles)
+        cacheable = projection is not None and not any(
+            field in projection for field in FormModel.VOLATILE_FIELDS
+        )
+        
+        if cacheable:
+            form = form_cache.get(form_name, profiles)
+            if form is not None:
+                return form
+            generation = form_cache.generation(form_name)
+        
+        doc = db_manager.get_forms_collection().find_one({'name': form_name}, projection)
+        form = serialize_doc(doc)
+        
+        if form is not None and 'permissions' in form:
+            FormModel.get_members(form)
+        
+        if cacheable and form is not None:
+            form_cache.set(form_name, profiles, form, generation)
+        return form
     
     @staticmethod
-    def get_user_forms(user_id):
-        """Get forms that user has access to"""
-        query = {
-            '$or': [
-                {'permissions.admin': user_id},
-                {'permissions.editor': user_id},
-                {'permissions.viewer': user_id}
-            ]
+    def build_public_schema(form):
+        """Build the public render schema of a form (what visitors need to fill it in)"""
+        return {
+            'id': form.get('_id'),
+            'name': form['name'],
+            'questions': form.get('questions', []),
+            'settings': form.get('settings', {})
         }
-        docs = list(db_manager.get_forms_collection().find(query))
-        return serialize_doc(docs)
+    
+    @staticmethod
+    def get_public_schema(form_name):
+        """Get the public render schema of a published form, served from the form cache"""
+        form = FormModel.get_form_by_name(form_name, 'schema')
+        if not form or form.get('status') != 'published':
+            return None
+        
+        return FormModel.build_public_schema(form)
+    
+    @staticmethod
+    def get_all_forms(*profiles):
+        """Get all forms, limited to the fields of the given profiles (full by default)"""
+        return FormModel._find_forms({}, profiles)
+    
+    @staticmethod
+    def get_user_forms(user_id, *profiles):
+        """Get forms that user has access to, limited to the fields of the given profiles"""
+        return FormModel._find_forms({'member_ids': user_id}, profiles)
     
     @staticmethod
     def delete_form(form_name):
-        """Delete form by name"""
+        """Delete form by name along with its submissions"""
+        form_id = FormModel._get_form_id(form_name)
         result = db_manager.get_forms_collection().delete_one({'name': form_name})
+        form_cache.invalidate(form_name)
+        validator_cache.invalidate(form_name)
+        
+        if form_id is not None:
+            db_manager.get_submissions_collection().delete_many({'form_id': form_id})
+            db_manager.get_form_changes_collection().delete_many({'form_id': form_id})
+        
         return result.deleted_count > 0
     
+    @staticmethod
+    def _get_form_id(form_name):
+        """Resolve a form name to the id its submissions are keyed by"""
+        doc = db_manager.get_forms_collection().find_one({'name': form_name}, {'_id': 1})
+        return str(doc['_id']) if doc else None
+    
+    @staticmethod
+    def _counter_update(submitted_at, delta):
+        """Build the $inc update of a form's submission counters"""
+        return {
+            'submission_count': delta,
+            f"daily_submissions.{submitted_at.strftime('%Y-%m-%d')}": delta
+        }
+    
     @staticmethod
     def add_submission(form_name, submission_data):
-        """Add submission to form"""
-        submission_data['submitted_at'] = datetime.now()
+        """Add submission to the submissions collection and bump the form's counters"""
+        submitted_at = datetime.now()
         
-        result = db_manager.get_forms_collection().update_one(
+        # Resolve the form and update its counters in one atomic round-trip
+        form = db_manager.get_forms_collection().find_one_and_update(
             {'name': form_name},
             {
-                '$push': {'submissions': submission_data},
-                '$set': {'updated_at': datetime.now()}
-            }
+                '$inc': FormModel._counter_update(submitted_at, 1),
+                '$max': {'last_submission_at': submitted_at}
+            },
+            projection={'_id': 1}
         )
+        if form is None:
+            return False
         
-        return result.matched_count > 0
+        submission_data['form_id'] = str(form['_id'])
+        submission_data['submitted_at'] = submitted_at
+        
+        try:
+            db_manager.get_submissions_collection().insert_one(submission_data)
+        except Exception as e:
+            db_manager.get_forms_collection().update_one(
+                {'_id': form['_id']},
+                {'$inc': FormModel._counter_update(submitted_at, -1)}
+            )
+            
+            if isinstance(e, DuplicateKeyError) and submission_data.get('idempotency_key'):
+                # A retry of a submission that was already stored
+                original_id = FormModel.get_submission_id_by_idempotency_key(
+                    submission_data['form_id'], submission_data['idempotency_key']
+                )
+                if original_id is not None:
+                    raise DuplicateSubmissionError(original_id)
+            raise
+        
+        FormModel.publish_submissions([submission_data])
+        return True
+    
+    @staticmethod
+    def submissions_channel(form_id):
+        """Name of the live event channel of a form's submissions"""
+        return f"submissions:{form_id}"
+    
+    @staticmethod
+    def submission_event(submission):
+        """Build the live event of a stored submission as (channel, type, data, id)
+        
+        The event ID is the submission's keyset cursor, so a feed can resume
+        after the last submission a client saw.
+        """
+        data = serialize_doc({key: value for key, value in submission.items() if key != '_id'})
+        return FormModel.submissions_channel(submission['form_id']), 'submission', data, _encode_cursor(submission)
+    
+    @staticmethod
+    def submission_change_event(change):
+        """Map a submissions change stream insert to its live event"""
+        if change.get('operationType') != 'insert':
+            return None
+        return FormModel.submission_event(change['fullDocument'])
+    
+    @staticmethod
+    def publish_submissions(submissions):
+        """Publish stored submissions to their forms' live feeds, unless a change stream already does"""
+        if event_broker.watches('submissions'):
+            return
+        for submission in submissions:
+            event_broker.publish(*FormModel.submission_event(submission))
+    
+    @staticmethod
+    def get_submission_id_by_idempotency_key(form_id, idempotency_key):
+        """Get the ID of the submission a form received with an idempotency key"""
+        doc = db_manager.get_submissions_collection().find_one(
+            {'form_id': form_id, 'idempotency_key': idempotency_key},
+            {'id': 1}
+        )
+        return doc['id'] if doc else None
+    
+    @staticmethod
+    def get_stored_submission_ids(submission_ids):
+        """Get which of the given submission IDs are stored"""
+        cursor = db_manager.get_submissions_collection().find(
+            {'id': {'$in': list(submission_ids)}},
+            {'id': 1}
+        )
+        return {doc['id'] for doc in cursor}
+    
+    @staticmethod
+    def insert_submissions(submissions):
+        """Insert a batch of submissions and bump their forms' counters
+        
+        Each submission must already have its form_id and submitted_at. Returns
+        whether each one was stored; a submission whose id exists is not.
+        """
+        if not submissions:
+            return []
+        
+        failed = set()
+        try:
+            db_manager.get_submissions_collection().insert_many(submissions, ordered=False)
+        except BulkWriteError as e:
+            failed = {error['index'] for error in e.details.get('writeErrors', [])}
+        stored = [index not in failed for index in range(len(submissions))]
+        
+        FormModel.record_submissions([submission for submission, was_stored in zip(submissions, stored) if was_stored])
+        return stored
+    
+    @staticmethod
+    def record_submissions(submissions):
+        """Bump the counters of stored submissions' forms and publish them to the live feeds"""
+        # One counter update per form, covering every day in the batch
+        increments = {}
+        latest = {}
+        for submission in submissions:
+            form_id = submission['form_id']
+            form_increments = increments.setdefault(form_id, {})
+            for field, delta in FormModel._counter_update(submission['submitted_at'], 1).items():
+                form_increments[field] = form_increments.get(field, 0) + delta
+            latest[form_id] = max(latest.get(form_id, submission['submitted_at']), submission['submitted_at'])
+        
+        if increments:
+            try:
+                db_manager.get_forms_collection().bulk_write([
+                    UpdateOne(
+                        {'_id': ObjectId(form_id)},
+                        {'$inc': form_increments, '$max': {'last_submission_at': latest[form_id]}}
+                    )
+                    for form_id, form_increments in increments.items()
+                ], ordered=False)
+            except Exception as e:
+                # The submissions are stored; drifted counters can be fixed with rebuild_submission_counters
+                logger.error(f"Failed to update submission counters: {e}")
+        
+        FormModel.publish_submissions(submissions)
+    
+    @staticmethod
+    def get_submissions(form_name):
+        """Get all submissions of a form, newest first"""
+        form_id = FormModel._get_form_id(form_name)
+        if form_id is None:
+            return []
+        
+        docs = list(db_manager.get_submissions_collection().find(
+            {'form_id': form_id}
+        ).sort('submitted_at', -1))
+        return serialize_doc(docs)
+    
+    @staticmethod
+    def get_submissions_page(form_name, limit=DEFAULT_SUBMISSIONS_PAGE_SIZE, cursor=None,
+                             sort='desc', fields=None, filters=None):
+        """Get one page of a form's submissions using keyset pagination on (submitted_at, id)
+        
+        filters maps question IDs to an answer, or to a list of answers any of
+        which matches. Returns the page and the cursor of the next page (None
+        on the last page).
+        """
+        if sort not in ('asc', 'desc'):
+            raise ValueError("Sort must be 'asc' or 'desc'")
+        
+        form_id = FormModel._get_form_id(form_name)
+        if form_id is None:
+            return [], None
+        
+        query = {'form_id': form_id}
+        for question_id, value in (filters or {}).items():
+            query[f'responses.{question_id}'] = {'$in': value} if isinstance(value, list) else value
+        
+        if cursor:
+            query['$or'] = _after_cursor(cursor, sort)
+        
+        projection = None
+        if fields is not None:
+            projection = {'_id': 0, 'id': 1, 'submitted_at': 1}
+            for question_id in fields:
+                projection[f'responses.{question_id}'] = 1
+        
+        limit = max(1, min(limit, MAX_SUBMISSIONS_PAGE_SIZE))
+        direction = -1 if sort == 'desc' else 1
+        
+        # Fetch one extra row to know whether another page follows
+        docs = list(db_manager.get_submissions_collection().find(query, projection)
+                    .sort([('submitted_at', direction), ('id', direction)])
+                    .limit(limit + 1))
+        
+        next_cursor = None
+        if len(docs) > limit:
+            docs = docs[:limit]
+            next_cursor = _encode_cursor(docs[-1])
+        
+        return serialize_doc(docs), next_cursor
+    
+    @staticmethod
+    def get_submission_events(form_name, cursor, limit=MAX_SUBMISSIONS_PAGE_SIZE):
+        """Get the live events of the submissions made after a cursor, oldest first
+        
+        Returns None when more than limit submissions were missed; the client
+        should reload the list instead of replaying them.
+        """
+        form_id = FormModel._get_form_id(form_name)
+        if form_id is None:
+            return []
+        
+        query = {'form_id': form_id, '$or': _after_cursor(cursor, 'asc')}
+        docs = list(db_manager.get_submissions_collection().find(query)
+                    .sort([('submitted_at', 1), ('id', 1)])
+                    .limit(limit + 1))
+        if len(docs) > limit:
+            return None
+        
+        events = []
+        for doc in docs:
+            _, event_type, data, event_id = FormModel.submission_event(doc)
+            events.append({'type': event_type, 'data': data, 'id': event_id})
+        return events
+    
+    @staticmethod
+    def iter_submissions(form_name, since=None, after=None, batch_size=1000):
+        """Stream a form's submissions oldest first, fetched from MongoDB in batches
+        
+        Only submissions made after `since`, or past the keyset cursor
+        `after`, are returned when given.
+        """
+        form_id = FormModel._get_form_id(form_name)
+        if form_id is None:
+            return
+        
+        query = {'form_id': form_id}
+        if since is not None:
+            query['submitted_at'] = {'$gt': since}
+        if after:
+            query['$or'] = _after_cursor(after, 'asc')
+        
+        cursor = db_manager.get_submissions_collection().find(query, {'_id': 0}) \
+            .sort([('submitted_at', 1), ('id', 1)]) \
+            .batch_size(batch_size)
+        
+        for doc in cursor:
+            yield doc
+    
+    @staticmethod
+    def get_export_cursor(form_name, after=None):
+        """Get the cursor the next incremental export of a form resumes from
+        
+        Submissions can be stored up to LATE_SUBMISSION_WINDOW after their
+        submitted_at, so this is the position of the newest submission made
+        before that window: the next export repeats the rows after it, which
+        readers drop by submission ID, instead of missing one stored late.
+        Never moves back past after; None when there's nothing to resume past.
+        """
+        form_id = FormModel._get_form_id(form_name)
+        if form_id is None:
+            return after
+        
+        query = {'form_id': form_id, 'submitted_at': {'$lt': datetime.now() - LATE_SUBMISSION_WINDOW}}
+        if after:
+            query['$or'] = _after_cursor(after, 'asc')
+        
+        doc = db_manager.get_submissions_collection().find_one(
+            query, {'submitted_at': 1, 'id': 1}, sort=[('submitted_at', -1), ('id', -1)]
+        )
+        return _encode_cursor(doc) if doc else after
+    
+    @staticmethod
+    def get_submission(form_name, submission_id):
+        """Get a single submission of a form"""
+        form_id = FormModel._get_form_id(form_name)
+        if form_id is None:
+            return None
+        
+        doc = db_manager.get_submissions_collection().find_one(
+            {'form_id': form_id, 'id': submission_id}
+        )
+        return serialize_doc(doc)
     
     @staticmethod
     def delete_submission(form_name, submission_id):
-        """Delete submission from form"""
-        result = db_manager.get_forms_collection().update_one(
-            {'name': form_name},
-            {
-                '$pull': {'submissions': {'id': submission_id}},
-                '$set': {'updated_at': datetime.now()}
-            }
+        """Delete submission from the submissions collection
+        
+        Deletions only happen here, so they are always published from here,
+        change stream or not.
+        """
+        form_id = FormModel._get_form_id(form_name)
+        if form_id is None:
+            return False
+        
+        doc = db_manager.get_submissions_collection().find_one_and_delete(
+            {'form_id': form_id, 'id': submission_id},
+            projection={'submitted_at': 1}
         )
+        if doc is not None:
+            db_manager.get_forms_collection().update_one(
+                {'name': form_name},
+                {'$inc': FormModel._counter_update(doc['submitted_at'], -1)}
+            )
+            event_broker.publish(FormModel.submissions_channel(form_id), 'deleted', {'id': submission_id})
+            analytics_cache.invalidate(form_id)
         
-        return result.matched_count > 0
+        return True
+    
+    @staticmethod
+    def _summarize_submissions(form_id, questions, recent_after, since=None, counted=()):
+        """Aggregate a form's submissions (from since on, except counted IDs) into a summary"""
+        docs = list(db_manager.get_submissions_collection().aggregate(
+            build_pipeline(form_id, questions, since, counted, recent_after)
+        ))
+        return summarize(docs[0] if docs else {}, questions)
+    
+    @staticmethod
+    def get_analytics(form_name):
+        """Get the analytics of a form's submissions per question
+        
+        The form's cached summary is refreshed with the submissions stored
+        since it was built; it is rebuilt when the questions changed or
+        submissions were deleted. None if the form doesn't exist.
+        """
+        form = db_manager.get_forms_collection().find_one(
+            {'name': form_name}, {'questions': 1, 'schema_version': 1, 'submission_count': 1}
+        )
+        if form is None:
+            return None
+        
+        form_id = str(form['_id'])
+        questions = form.get('questions', [])
+        schema_version = form.get('schema_version', 0)
+        # The next refresh starts here, so submissions stored late are still counted
+        watermark = datetime.now() - LATE_SUBMISSION_WINDOW
+        
+        summary = None
+        cached = analytics_cache.get(form_id, schema_version)
+        if cached is not None:
+            summary = merge(cached, FormModel._summarize_submissions(
+                form_id, questions, watermark, since=cached['watermark'], counted=cached['recent']
+            ))
+            # Counting more submissions than the form has means some were deleted by another process
+            if summary['count'] > form.get('submission_count', 0):
+                summary = None
+        
+        rebuilt = summary is None
+        if rebuilt:
+            summary = FormModel._summarize_submissions(form_id, questions, watermark)
+        
+        summary['watermark'] = watermark
+        summary['recent'] = {
+            submission_id: submitted_at for submission_id, submitted_at in summary['recent'].items()
+            if submitted_at >= watermark
+        }
+        analytics_cache.set(form_id, schema_version, summary, rebuilt)
+        return report(summary, questions)
+    
+    @staticmethod
+    def migrate_embedded_submissions():
+        """Move submissions embedded in form documents to the submissions collection"""
+        forms_collection = db_manager.get_forms_collection()
+        submissions_collection = db_manager.get_submissions_collection()
+        migrated = 0
+        
+        for doc in forms_collection.find({'submissions.0': {'$exists': True}},
+                                         {'_id': 1, 'submissions': 1}):
+            form_id = str(doc['_id'])
+            existing_ids = {
+                s['id'] for s in submissions_collection.find({'form_id': form_id}, {'id': 1})
+            }
+            
+            new_submissions = []
+            for submission in doc['submissions']:
+                if submission.get('id') in existing_ids:
+                    continue
+                submission['form_id'] = form_id
+                submission.setdefault('submitted_at', datetime.now())
+                new_submissions.append(submission)
+            
+            if new_submissions:
+                submissions_collection.insert_many(new_submissions)
+                migrated += len(new_submissions)
+            
+            forms_collection.update_one({'_id': doc['_id']}, {'$unset': {'submissions': ''}})
+        
+        FormModel.rebuild_submission_counters()
+        return migrated
+    
+    @staticmethod
+    def rebuild_submission_counters():
+        """Recompute every form's submission counters from the submissions collection"""
+        pipeline = [
+            {'$group': {
+                '_id': {
+                    'form_id': '$form_id',
+                    'day': {'$dateToString': {'format': '%Y-%m-%d', 'date': '$submitted_at'}}
+                },
+                'count': {'$sum': 1},
+                'last_submission_at': {'$max': '$submitted_at'}
+            }}
+        ]
+        
+        counters = {}
+        for result in db_manager.get_submissions_collection().aggregate(pipeline):
+            form_counters = counters.setdefault(result['_id']['form_id'], {
+                'submission_count': 0,
+                'last_submission_at': None,
+                'daily_submissions': {}
+            })
+            form_counters['submission_count'] += result['count']
+            form_counters['daily_submissions'][result['_id']['day']] = result['count']
+            if (form_counters['last_submission_at'] is None or
+                    result['last_submission_at'] > form_counters['last_submission_at']):
+                form_counters['last_submission_at'] = result['last_submission_at']
+        
+        forms_collection = db_manager.get_forms_collection()
+        for doc in forms_collection.find({}, {'_id': 1}):
+            form_counters = counters.get(str(doc['_id']), {
+                'submission_count': 0,
+                'last_submission_at': None,
+                'daily_submissions': {}
+            })
+            forms_collection.update_one({'_id': doc['_id']}, {'$set': form_counters})
+    
+    @staticmethod
+    def migrate_number_answers():
+        """Store number answers kept as text, from before they were parsed on submit, as numbers"""
+        submissions_collection = db_manager.get_submissions_collection()
+        migrated = 0
+        
+        for form in db_manager.get_forms_collection().find({'questions.type': 'number'}, {'questions': 1}):
+            form_id = str(form['_id'])
+            for question in form.get('questions', []):
+                if question.get('type') != 'number':
+                    continue
+                field = f"responses.{question['id']}"
+                for doc in submissions_collection.find({'form_id': form_id, field: {'$type': 'string'}},
+                                                       {field: 1}):
+                    number = number_answer(doc['responses'][question['id']])
+                    if number is None:
+                        continue
+                    submissions_collection.update_one({'_id': doc['_id']}, {'$set': {field: number}})
+                    migrated += 1
+            analytics_cache.invalidate(form_id)
+        
+        return migrated
+    
+    @staticmethod
+    def rebuild_members():
+        """Rebuild every form's members map and member_ids from its role lists"""
+        forms_collection = db_manager.get_forms_collection()
+        rebuilt = 0
+        for doc in forms_collection.find({}, {'name': 1, 'permissions': 1}):
+            members = FormModel.build_members(doc.get('permissions', {}))
+            forms_collection.update_one(
+                {'_id': doc['_id']},
+                {'$set': {'members': members, 'member_ids': list(members)}}
+            )
+            form_cache.invalidate(doc['name'])
+            rebuilt += 1
+        
+        return rebuilt
+    
+    @staticmethod
+    def backfill_members():
+        """Build the members map and member_ids of forms stored before they existed
+        
+        Runs at startup: dashboards only find forms by member_ids.
+        """
+        forms_collection = db_manager.get_forms_collection()
+        backfilled = 0
+        for doc in forms_collection.find({'members': {'$exists': False}}, {'name': 1, 'permissions': 1}):
+            members = FormModel.build_members(doc.get('permissions', {}))
+            # Skipped if a collaborator change built the map meanwhile
+            result = forms_collection.update_one(
+                {'_id': doc['_id'], 'members': {'$exists': False}, 'permissions': doc.get('permissions')},
+                {'$set': {'members': members, 'member_ids': list(members)}}
+            )
+            if result.modified_count:
+                form_cache.invalidate(doc['name'])
+                backfilled += 1
+        
+        return backfilled
+    
+    @staticmethod
+    def _update_collaborators(form_name, update, change_permissions, change_members):
+        """Apply a collaborator update to a form, building its members map first if it has none
+        
+        Forms with a members map get update as is. For forms stored before the
+        map existed, the new role lists and the full map are computed from the
+        stored role lists and written in one update conditioned on them, so the
+        map never holds only the changed collaborators.
+        """
+        forms_collection = db_manager.get_forms_collection()
+        updated_at = datetime.now()
+        update.setdefault('$set', {})['updated_at'] = updated_at
+        
+        while True:
+            result = forms_collection.update_one({'name': form_name, 'members': {'$exists': True}}, update)
+            if result.matched_count:
+                break
+            
+            doc = forms_collection.find_one({'name': form_name}, {'permissions': 1, 'members': 1})
+            if doc is None:
+                return False
+            if 'members' in doc:
+                continue
+            
+            stored_permissions = doc.get('permissions')
+            permissions = change_permissions({
+                role: list(user_ids) for role, user_ids in (stored_permissions or {}).items()
+            })
+            members = change_members(FormModel.build_members(stored_permissions or {}), permissions)
+            result = forms_collection.update_one(
+                {'_id': doc['_id'], 'members': {'$exists': False}, 'permissions': stored_permissions},
+                {'$set': {
+                    'permissions': permissions,
+                    'members': members,
+                    'member_ids': list(members),
+                    'updated_at': updated_at
+                }}
+            )
+            if result.matched_count:
+                break
+        
+        form_cache.invalidate(form_name, updated_at.isoformat())
+        return True
     
     @staticmethod
     def add_collaborator(form_name, user_id, role):
         """Add collaborator to form"""
-        result = db_manager.get_forms_collection().update_one(
-            {'name': form_name},
-            {
-                '$addToSet': {f'permissions.{role}': user_id},
-                '$set': {'updated_at': datetime.now()}
-            }
-        )
+        return FormModel.add_collaborators(form_name, {user_id: role})
+    
+    @staticmethod
+    def add_collaborators(form_name, roles_by_user):
+        """Add many collaborators to a form in one update; roles_by_user maps user ID to role"""
+        user_ids_by_role = {}
+        for user_id, role in roles_by_user.items():
+            user_ids_by_role.setdefault(role, []).append(user_id)
         
-        return result.matched_count > 0
+        def change_permissions(permissions):
+            for role, user_ids in user_ids_by_role.items():
+                listed = permissions.setdefault(role, [])
+                listed.extend(user_id for user_id in user_ids if user_id not in listed)
+            return permissions
+        
+        def change_members(members, permissions):
+            return {**members, **roles_by_user}
+        
+        return FormModel._update_collaborators(form_name, {
+            '$addToSet': {
+                **{
+                    f'permissions.{role}': {'$each': user_ids}
+                    for role, user_ids in user_ids_by_role.items()
+                },
+                'member_ids': {'$each': list(roles_by_user)}
+            },
+            '$set': {f'members.{user_id}': role for user_id, role in roles_by_user.items()}
+        }, change_permissions, change_members)
     
     @staticmethod
     def remove_collaborator(form_name, user_id):
         """Remove collaborator from form"""
-        result = db_manager.get_forms_collection().update_one(
-            {'name': form_name},
+        def change_permissions(permissions):
+            for role in FormModel.ROLES:
+                if role in permissions:
+                    permissions[role] = [listed for listed in permissions[role] if listed != user_id]
+            return permissions
+        
+        def change_members(members, permissions):
+            return FormModel.build_members(permissions)
+        
+        return FormModel._update_collaborators(form_name, {
+            '$pull': {
+                'permissions.admin': user_id,
+                'permissions.editor': user_id,
+                'permissions.viewer': user_id,
+                'member_ids': user_id
+            },
+            '$unset': {f'members.{user_id}': ''}
+        }, change_permissions, change_members)
+
+class MailModel:
+    """Mail model for MongoDB operations"""
+    
+    @staticmethod
+    def add_dead_letter(record):
+        """Record an email that could not be delivered"""
+        _check_db_available()
+        record.setdefault('failed_at', datetime.now())
+        result = db_manager.get_mail_dead_letters_collection().insert_one(record)
+        record['_id'] = str(result.inserted_id)
+        return record
+    
+    @staticmethod
+    def get_dead_letters(limit=100):
+        """Get the most recently failed emails"""
+        docs = db_manager.get_mail_dead_letters_collection().find().sort('failed_at', -1).limit(limit)
+        return serialize_doc(list(docs))
+
+class UploadModel:
+    """Upload model for MongoDB operations"""
+    
+    @staticmethod
+    def create_upload(upload):
+        """Record a new pending upload"""
+        _check_db_available()
+        upload.setdefault('created_at', datetime.now())
+        upload.setdefault('status', 'pending')
+        upload.setdefault('received', 0)
+        db_manager.get_uploads_collection().insert_one(upload)
+        upload.pop('_id', None)
+        return upload
+    
+    @staticmethod
+    def get_upload(upload_id):
+        """Get an upload by ID"""
+        _check_db_available()
+        return db_manager.get_uploads_collection().find_one({'id': upload_id}, {'_id': 0})
+    
+    @staticmethod
+    def get_uploads(upload_ids):
+        """Get uploads by ID, keyed by ID"""
+        _check_db_available()
+        docs = db_manager.get_uploads_collection().find({'id': {'$in': list(upload_ids)}}, {'_id': 0})
+        return {doc['id']: doc for doc in docs}
+    
+    @staticmethod
+    def advance_upload(upload_id, offset, received):
+        """Move a pending upload from offset to received bytes
+        
+        Returns False if the upload is no longer at offset, i.e. another
+        request stored the same chunk first.
+        """
+        _check_db_available()
+        result = db_manager.get_uploads_collection().update_one(
+            {'id': upload_id, 'status': 'pending', 'received': offset},
+            {'$set': {'received': received}}
+        )
+        return result.modified_count == 1
+    
+    @staticmethod
+    def complete_upload(upload_id, sha256):
+        """Mark an upload as stored under its content hash; completed uploads don't expire"""
+        _check_db_available()
+        return db_manager.get_uploads_collection().find_one_and_update(
+            {'id': upload_id},
             {
-                '$pull': {
-                    'permissions.admin': user_id,
-                    'permissions.editor': user_id,
-                    'permissions.viewer': user_id
-                },
-                '$set': {'updated_at': datetime.now()}
-            }
+                '$set': {'status': 'complete', 'sha256': sha256, 'completed_at': datetime.now()},
+                '$unset': {'expires_at': ''}
+            },
+            projection={'_id': 0},
+            return_document=ReturnDocument.AFTER
         )
-        
-        return result.matched_count > 0
\ No newline at end of file
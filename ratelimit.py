@@ -0,0 +1,252 @@
+"""
+Token-bucket rate limiting for the public form endpoints
+"""
+from collections import OrderedDict
+import logging
+import math
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Rate-limited endpoints and the buckets each request takes a token from
+RATE_LIMIT_SCOPES = ('render', 'submit', 'upload')
+RATE_LIMIT_BUCKETS = ('client', 'form')
+
+def parse_rate(value):
+    """Parse a "count/seconds" limit into (count, seconds); empty or 0 means unlimited"""
+    if value is None or str(value) in ('', '0'):
+        return None
+    try:
+        count, seconds = str(value).split('/')
+        count, seconds = int(count), float(seconds)
+    except ValueError:
+        raise ValueError(f"Invalid rate limit: {value} (expected count/seconds)")
+    if count < 1 or seconds <= 0:
+        raise ValueError(f"Invalid rate limit: {value} (expected count/seconds)")
+    return count, seconds
+
+class MemoryBucketStore:
+    """Token buckets kept in this process, evicting the least recently used beyond max_keys"""
+
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key, count, seconds):
+        """Take a token from a bucket of count tokens refilled over seconds
+
+        Returns 0 if a token was taken, otherwise the seconds until one is available.
+        """
+        return self.take_all([(key, count, seconds)])
+
+    def take_all(self, buckets):
+        """Take a token from each of several (key, count, seconds) buckets, or from none
+
+        Returns 0 if the tokens were taken, otherwise the seconds until every bucket has one.
+        """
+        now = time.monotonic()
+
+        with self._lock:
+            states = []
+            retry_after = 0
+            for key, count, seconds in buckets:
+                rate = count / seconds
+                tokens, last = self._buckets.get(key, (count, now))
+                tokens = min(count, tokens + (now - last) * rate)
+                if tokens < 1:
+                    retry_after = max(retry_after, (1 - tokens) / rate)
+                states.append((key, tokens))
+
+            for key, tokens in states:
+                self._buckets[key] = (tokens if retry_after else tokens - 1, now)
+                self._buckets.move_to_end(key)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+
+        return retry_after
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+
+class RedisBucketStore:
+    """Token buckets shared between processes in Redis
+
+    The refill and take happen in one Lua script, timed by the Redis server
+    clock, so concurrent processes can't both take the last token. Each key
+    has a count and a rate in ARGV; tokens are taken from all of them or none.
+    """
+
+    SCRIPT = """
+    local time = redis.call('TIME')
+    local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+
+    local tokens = {}
+    local retry_after = 0
+    for i, key in ipairs(KEYS) do
+        local count = tonumber(ARGV[2 * i - 1])
+        local rate = tonumber(ARGV[2 * i])
+        local state = redis.call('HMGET', key, 'tokens', 'ts')
+        local last = tonumber(state[2]) or now
+        tokens[i] = math.min(count, (tonumber(state[1]) or count) + math.max(0, now - last) * rate)
+        if tokens[i] < 1 then
+            retry_after = math.max(retry_after, (1 - tokens[i]) / rate)
+        end
+    end
+
+    for i, key in ipairs(KEYS) do
+        local count = tonumber(ARGV[2 * i - 1])
+        local rate = tonumber(ARGV[2 * i])
+        if retry_after == 0 then
+            tokens[i] = tokens[i] - 1
+        end
+        redis.call('HSET', key, 'tokens', tostring(tokens[i]), 'ts', tostring(now))
+        redis.call('EXPIRE', key, math.ceil(count / rate) + 1)
+    end
+    return tostring(retry_after)
+    """
+
+    def __init__(self, client, prefix='ratelimit:'):
+        self.client = client
+        self.prefix = prefix
+        self._script = client.register_script(self.SCRIPT)
+
+    def take(self, key, count, seconds):
+        """Take a token from a bucket of count tokens refilled over seconds"""
+        return self.take_all([(key, count, seconds)])
+
+    def take_all(self, buckets):
+        """Take a token from each of several (key, count, seconds) buckets, or from none"""
+        keys = [self.prefix + key for key, _, _ in buckets]
+        args = [value for _, count, seconds in buckets for value in (count, count / seconds)]
+        return float(self._script(keys=keys, args=args))
+
+class RateLimiter:
+    """Applies per-client and per-form token buckets to the public endpoints
+
+    Default limits come from the environment (RATE_LIMIT_<SCOPE>_<BUCKET>, e.g.
+    RATE_LIMIT_SUBMIT_CLIENT=30/60). A form can override them in its
+    rate_limits, e.g. {'submit': {'client': '5/60'}}, kept outside its settings
+    so they aren't part of the public schema. A request takes a token from
+    every bucket it falls in only if each of them has one.
+
+    Endpoints check the client bucket before reading the form, so a client
+    flooding a form is turned away without a database read, and the form
+    bucket once the form is known. Until then, the client bucket uses the
+    override the form had when this process last checked it.
+
+    If the store fails the request is let through: an outage of a shared store
+    must not take the public forms down with it.
+    """
+
+    def __init__(self, limits=None, store=None, max_forms=10000):
+        self.limits = limits or {}
+        self.store = store or MemoryBucketStore()
+        self.max_forms = max_forms
+        self._client_limits = OrderedDict()
+        self._lock = threading.Lock()
+        self.allowed = {scope: 0 for scope in RATE_LIMIT_SCOPES}
+        self.rejected = {scope: 0 for scope in RATE_LIMIT_SCOPES}
+        self.store_errors = 0
+
+    def limit_for(self, scope, bucket, form=None):
+        """Get the (count, seconds) limit of a bucket, or None if unlimited"""
+        overrides = (form or {}).get('rate_limits') or {}
+        override = (overrides.get(scope) or {}).get(bucket)
+        if override is not None:
+            try:
+                # An override of 0 lifts the default limit
+                return parse_rate(override)
+            except ValueError:
+                logger.warning(f"Ignoring invalid {scope}/{bucket} rate limit on form {form.get('name')}: {override}")
+        return self.limits.get(scope, {}).get(bucket)
+
+    def _client_limit(self, scope, form_name, form):
+        """Get the client bucket limit of a form, remembering it for checks made before the form is read"""
+        with self._lock:
+            if form is None:
+                if (scope, form_name) in self._client_limits:
+                    return self._client_limits[(scope, form_name)]
+                return self.limit_for(scope, 'client')
+
+        limit = self.limit_for(scope, 'client', form)
+        with self._lock:
+            self._client_limits[(scope, form_name)] = limit
+            self._client_limits.move_to_end((scope, form_name))
+            while len(self._client_limits) > self.max_forms:
+                self._client_limits.popitem(last=False)
+        return limit
+
+    def check(self, scope, form_name, client, form=None, buckets=RATE_LIMIT_BUCKETS):
+        """Take a token for a request from the given buckets; returns 0 if allowed, otherwise the seconds to wait
+
+        A request counts as allowed once it gets past the form bucket.
+        """
+        keys = {
+            'client': f"{scope}:{form_name}:client:{client}",
+            'form': f"{scope}:{form_name}"
+        }
+        limits = {
+            'client': self._client_limit(scope, form_name, form),
+            'form': self.limit_for(scope, 'form', form)
+        }
+        last = 'form' in buckets
+        buckets = [(keys[bucket], *limits[bucket]) for bucket in buckets if limits[bucket] is not None]
+
+        retry_after = 0
+        if buckets:
+            try:
+                # A request rejected by one bucket doesn't use up the others
+                retry_after = self.store.take_all(buckets)
+            except Exception as e:
+                logger.error(f"Rate limit store failed, allowing request: {e}")
+                with self._lock:
+                    self.store_errors += 1
+                retry_after = 0
+
+        with self._lock:
+            if retry_after:
+                self.rejected[scope] += 1
+            elif last:
+                self.allowed[scope] += 1
+
+        return math.ceil(retry_after) if retry_after else 0
+
+    def reset(self):
+        """Reset the in-process buckets and the metrics"""
+        if isinstance(self.store, MemoryBucketStore):
+            self.store.clear()
+        with self._lock:
+            self._client_limits.clear()
+            self.allowed = {scope: 0 for scope in RATE_LIMIT_SCOPES}
+            self.rejected = {scope: 0 for scope in RATE_LIMIT_SCOPES}
+            self.store_errors = 0
+
+    def stats(self):
+        """Get allowed/rejected counters per endpoint"""
+        with self._lock:
+            return {
+                'allowed': dict(self.allowed),
+                'rejected': dict(self.rejected),
+                'store_errors': self.store_errors,
+                'shared_store': not isinstance(self.store, MemoryBucketStore)
+            }
+
+# Global rate limiter instance
+rate_limiter = RateLimiter(limits={
+    'render': {
+        'client': parse_rate(os.getenv('RATE_LIMIT_RENDER_CLIENT', '120/60')),
+        'form': parse_rate(os.getenv('RATE_LIMIT_RENDER_FORM', '0'))
+    },
+    'submit': {
+        'client': parse_rate(os.getenv('RATE_LIMIT_SUBMIT_CLIENT', '30/60')),
+        'form': parse_rate(os.getenv('RATE_LIMIT_SUBMIT_FORM', '0'))
+    },
+    'upload': {
+        'client': parse_rate(os.getenv('RATE_LIMIT_UPLOAD_CLIENT', '60/60')),
+        'form': parse_rate(os.getenv('RATE_LIMIT_UPLOAD_FORM', '0'))
+    }
+})
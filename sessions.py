@@ -0,0 +1,91 @@
+"""
+Server-side session storage: the cookie carries a signed session ID, the data lives in Redis
+"""
+import secrets
+
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SessionInterface, SessionMixin
+from itsdangerous import BadSignature, Signer
+from werkzeug.datastructures import CallbackDict
+
+def _user_id(data):
+    """Get the ID of the user logged in to session data, if any"""
+    user = data.get('user') if data else None
+    return user.get('id') if isinstance(user, dict) else None
+
+class ServerSideSession(CallbackDict, SessionMixin):
+    """Session data loaded from the store, remembering who was logged in when it was opened"""
+
+    def __init__(self, initial=None, sid=None, new=False):
+        def on_update(session):
+            session.modified = True
+
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.new = new
+        self.modified = False
+        self.opened_user = _user_id(initial)
+
+class RedisSessionInterface(SessionInterface):
+    """Keeps sessions in Redis so cookies stay a fixed, small size
+
+    Sessions expire after PERMANENT_SESSION_LIFETIME without a write. The
+    session ID is replaced whenever the logged-in user changes, so an ID
+    handed out before login can't be used to ride the logged-in session.
+    """
+
+    serializer = TaggedJSONSerializer()
+
+    def __init__(self, client, prefix='session:'):
+        self.client = client
+        self.prefix = prefix
+
+    def _signer(self, app):
+        return Signer(app.secret_key, salt='server-side-session')
+
+    def open_session(self, app, request):
+        cookie = request.cookies.get(self.get_cookie_name(app))
+        if cookie:
+            try:
+                sid = self._signer(app).unsign(cookie).decode()
+                data = self.client.get(self.prefix + sid)
+                if data is not None:
+                    return ServerSideSession(self.serializer.loads(data), sid=sid)
+            except BadSignature:
+                pass
+        return ServerSideSession(sid=secrets.token_urlsafe(32), new=True)
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        if not session:
+            if session.modified and not session.new:
+                self.client.delete(self.prefix + session.sid)
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+
+        lifetime = int(app.permanent_session_lifetime.total_seconds())
+        if _user_id(session) != session.opened_user and not session.new:
+            # Logged in, out or as someone else: move the data to a fresh ID
+            self.client.delete(self.prefix + session.sid)
+            session.sid = secrets.token_urlsafe(32)
+            session.new = True
+
+        if session.modified or session.new:
+            self.client.setex(self.prefix + session.sid, lifetime, self.serializer.dumps(dict(session)))
+        elif self.should_set_cookie(app, session):
+            self.client.expire(self.prefix + session.sid, lifetime)
+
+        if session.new or self.should_set_cookie(app, session):
+            response.set_cookie(
+                name,
+                self._signer(app).sign(session.sid).decode(),
+                expires=self.get_expiration_time(app, session),
+                httponly=self.get_cookie_httponly(app),
+                domain=domain,
+                path=path,
+                secure=self.get_cookie_secure(app),
+                samesite=self.get_cookie_samesite(app)
+            )
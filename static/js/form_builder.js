@@ -3,6 +3,11 @@ let currentQuestionIndex = 0;
 let hasUnsavedChanges = false;
 let lastSavedState = null;
 
+// Live collaboration: this tab's ID (to recognise our own changes) and its event stream
+const clientId = (window.crypto && crypto.randomUUID) ? crypto.randomUUID() :
+    `${Date.now().toString(36)}${Math.random().toString(36).slice(2)}`;
+let eventSource = null;
+
 // Helper function to get question type display text
 function getQuestionTypeText(type) {
     const typeMap = {
@@ -40,6 +45,9 @@ document.addEventListener('DOMContentLoaded', function() {
     // Save initial state for unsaved changes detection
     lastSavedState = JSON.stringify(window.formData.questions);
     
+    // Follow other editors' changes as they are saved
+    connectEvents();
+    
     // Add beforeunload event listener
     window.addEventListener('beforeunload', function(e) {
         if (hasUnsavedChanges) {
@@ -168,8 +176,14 @@ document.getElementById('allowMultiple').addEventListener('change', function(e)
 // Question operations
 function addQuestion() {
     const questionNum = window.formData.questions.length + 1;
+    // Deleted questions leave gaps, so number past the highest existing ID
+    const takenIds = new Set(window.formData.questions.map(question => question.id));
+    let suffix = questionNum;
+    while (takenIds.has(`q_${suffix}`)) {
+        suffix++;
+    }
     const newQuestion = {
-        id: `q_${questionNum}`,
+        id: `q_${suffix}`,
         title: `Question ${questionNum}`,
         text: '',
         type: 'text',
@@ -504,19 +518,224 @@ function generateQuestionPreview(question, index) {
 
 // Form saving
 
-async function saveForm() {
-    try {
-        const response = await fetch(`/api/form/${window.formData.name}/save`, {
-            method: 'POST',
-            headers: {
-                'Content-Type': 'application/json',
-            },
-            body: JSON.stringify({
-                questions: window.formData.questions
-            })
+// Build the question operations that turn the saved questions into the current ones
+function diffQuestions(saved, current) {
+    const ops = [];
+    const savedById = new Map(saved.map(question => [question.id, question]));
+    const currentIds = new Set(current.map(question => question.id));
+    
+    // Deleted questions; order tracks the server's question order as the ops apply
+    const order = [];
+    saved.forEach(question => {
+        if (currentIds.has(question.id)) {
+            order.push(question.id);
+        } else {
+            ops.push({ op: 'delete', id: question.id });
+        }
+    });
+    
+    // Changed fields of kept questions
+    current.forEach(question => {
+        const before = savedById.get(question.id);
+        if (!before) {
+            return;
+        }
+        
+        const fields = {};
+        const remove = [];
+        Object.keys(question).forEach(key => {
+            if (key !== 'id' && question[key] !== undefined &&
+                JSON.stringify(question[key]) !== JSON.stringify(before[key])) {
+                fields[key] = question[key];
+            }
         });
+        Object.keys(before).forEach(key => {
+            if (question[key] === undefined) {
+                remove.push(key);
+            }
+        });
+        
+        if (Object.keys(fields).length > 0 || remove.length > 0) {
+            const op = { op: 'update', id: question.id };
+            if (Object.keys(fields).length > 0) {
+                op.fields = fields;
+            }
+            if (remove.length > 0) {
+                op.remove = remove;
+            }
+            ops.push(op);
+        }
+    });
+    
+    // Added and reordered questions, position by position
+    current.forEach((question, index) => {
+        if (!savedById.has(question.id)) {
+            ops.push({ op: 'add', question: question, index: index });
+            order.splice(index, 0, question.id);
+        } else if (order[index] !== question.id) {
+            ops.push({ op: 'move', id: question.id, index: index });
+            order.splice(order.indexOf(question.id), 1);
+            order.splice(index, 0, question.id);
+        }
+    });
+    
+    return ops;
+}
+
+// Apply question operations to a copy of a question list, as the server does
+function applyQuestionOps(questions, ops) {
+    const result = JSON.parse(JSON.stringify(questions));
+    
+    ops.forEach(op => {
+        const id = op.op === 'add' ? op.question.id : op.id;
+        const index = result.findIndex(question => question.id === id);
+        
+        if (op.op === 'add') {
+            if (index === -1) {
+                const position = op.index === undefined ? result.length : Math.min(op.index, result.length);
+                result.splice(position, 0, JSON.parse(JSON.stringify(op.question)));
+            }
+        } else if (index === -1) {
+            // The question was deleted in the meantime
+            return;
+        } else if (op.op === 'update') {
+            Object.assign(result[index], op.fields || {});
+            (op.remove || []).forEach(field => delete result[index][field]);
+        } else if (op.op === 'delete') {
+            result.splice(index, 1);
+        } else if (op.op === 'move') {
+            const [question] = result.splice(index, 1);
+            result.splice(Math.min(op.index, result.length), 0, question);
+        }
+    });
+    
+    return result;
+}
+
+// Replay unsaved edits on top of the server's questions after a conflicting save
+function rebaseQuestions(conflict) {
+    const saved = JSON.parse(lastSavedState);
+    const serverQuestions = conflict.changes ? applyQuestionOps(saved, conflict.changes) : conflict.questions;
+    if (!serverQuestions) {
+        return false;
+    }
+    
+    const localOps = diffQuestions(saved, window.formData.questions);
+    const selected = window.formData.questions[currentQuestionIndex];
+    
+    window.formData.questions = applyQuestionOps(serverQuestions, localOps);
+    window.formData.schema_version = conflict.version;
+    lastSavedState = JSON.stringify(serverQuestions);
+    
+    // Keep the same question selected if it still exists
+    const selectedIndex = selected ? window.formData.questions.findIndex(question => question.id === selected.id) : -1;
+    currentQuestionIndex = selectedIndex !== -1 ? selectedIndex : 0;
+    renderQuestions();
+    if (window.formData.questions.length > 0) {
+        selectQuestion(Math.min(currentQuestionIndex, window.formData.questions.length - 1));
+    }
+    return true;
+}
+
+// Stream other editors' changes and presence from the server (Server-Sent Events)
+function connectEvents() {
+    if (typeof EventSource === 'undefined') {
+        return;
+    }
+    if (eventSource) {
+        eventSource.close();
+    }
+    
+    // Resume from the version we have; the browser sends Last-Event-ID on its own reconnects
+    const since = window.formData.schema_version || 0;
+    eventSource = new EventSource(`/api/form/${window.formData.name}/events?since=${since}&client=${clientId}`);
+    
+    eventSource.addEventListener('change', event => {
+        const entry = JSON.parse(event.data);
+        const version = window.formData.schema_version || 0;
+        
+        if (entry.version <= version) {
+            // Already applied, e.g. our own save
+            return;
+        }
+        if (entry.version !== version + 1) {
+            // Missed a change: reconnect to have the gap replayed
+            connectEvents();
+            return;
+        }
+        rebaseQuestions({ version: entry.version, changes: entry.ops });
+        checkForUnsavedChanges();
+    });
+    
+    eventSource.addEventListener('snapshot', event => {
+        rebaseQuestions(JSON.parse(event.data));
+        checkForUnsavedChanges();
+    });
+    
+    eventSource.addEventListener('resync', () => connectEvents());
+    
+    eventSource.addEventListener('presence', event => {
+        renderEditors(JSON.parse(event.data).members);
+    });
+}
+
+// Show who else has this form open
+function renderEditors(members) {
+    let container = document.getElementById('activeEditors');
+    if (!container) {
+        const headerActions = document.querySelector('.form-builder-actions, .header-actions');
+        if (!headerActions) {
+            return;
+        }
+        container = document.createElement('div');
+        container.id = 'activeEditors';
+        container.className = 'active-editors';
+        headerActions.prepend(container);
+    }
+    
+    const others = new Map();
+    members.filter(member => member.client !== clientId).forEach(member => others.set(member.id, member));
+    
+    container.innerHTML = '';
+    others.forEach(member => {
+        const avatar = document.createElement(member.picture ? 'img' : 'span');
+        avatar.className = 'editor-avatar';
+        avatar.title = `${member.name} is editing`;
+        if (member.picture) {
+            avatar.src = member.picture;
+            avatar.alt = member.name;
+        } else {
+            avatar.textContent = (member.name || '?').charAt(0).toUpperCase();
+        }
+        container.appendChild(avatar);
+    });
+}
+
+async function saveForm(rebaseOnConflict = true) {
+    try {
+        // Only the edits since the last save are sent
+        const ops = diffQuestions(JSON.parse(lastSavedState), window.formData.questions);
+        let response = { ok: true };
+        
+        if (ops.length > 0) {
+            response = await fetch(`/api/form/${window.formData.name}/questions`, {
+                method: 'PATCH',
+                headers: {
+                    'Content-Type': 'application/json',
+                    'X-Client-Id': clientId,
+                },
+                body: JSON.stringify({
+                    version: window.formData.schema_version || 0,
+                    ops: ops
+                })
+            });
+        }
         
         if (response.ok) {
+            if (ops.length > 0) {
+                window.formData.schema_version = (await response.json()).version;
+            }
+            
             // Update saved state and reset unsaved changes flag
             lastSavedState = JSON.stringify(window.formData.questions);
             hasUnsavedChanges = false;
@@ -549,6 +768,13 @@ async function saveForm() {
             }
             
             return true;
+        } else if (response.status === 409) {
+            // Someone else saved first: take their changes, keep ours on top and save again
+            if (rebaseOnConflict && rebaseQuestions(await response.json())) {
+                return saveForm(false);
+            }
+            alert('This form was changed by someone else. Reload the page to get their changes, then save again.');
+            return false;
         } else {
             alert('Failed to save form. Please try again.');
             return false;
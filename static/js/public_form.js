@@ -6,6 +6,14 @@ document.addEventListener('DOMContentLoaded', function() {
         return;
     }
     
+    // One key per filled-in form, so resubmitting after a network error can't store it twice
+    const idempotencyKey = (window.crypto && crypto.randomUUID)
+        ? crypto.randomUUID()
+        : `${Date.now()}-${Math.random().toString(36).slice(2)}`;
+    
+    // Files already uploaded, so resubmitting after an error doesn't upload them again
+    const uploadedFiles = new WeakMap();
+    
     // Initialize interactive elements
     initializeRatingStars();
     initializeCharacterCounters();
@@ -72,6 +80,71 @@ document.addEventListener('DOMContentLoaded', function() {
         });
     }
     
+    function uploadError(message) {
+        const error = new Error(message);
+        error.isUploadError = true;
+        return error;
+    }
+    
+    // Upload a file in chunks; after a failed chunk, ask the server how much it has and resume from there
+    async function uploadFile(questionId, file) {
+        if (uploadedFiles.has(file)) {
+            return uploadedFiles.get(file);
+        }
+        
+        const uploadsUrl = `/api/form/${window.formData.name}/uploads`;
+        let response = await fetch(uploadsUrl, {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ question_id: questionId, name: file.name, size: file.size, type: file.type })
+        });
+        let upload = await response.json();
+        if (!response.ok) {
+            throw uploadError(`${file.name}: ${upload.error || 'upload failed'}`);
+        }
+        
+        let failures = 0;
+        while (!upload.complete) {
+            const chunk = file.slice(upload.offset, upload.offset + upload.chunk_size);
+            try {
+                response = await fetch(`${uploadsUrl}/${upload.upload_id}`, {
+                    method: 'PUT',
+                    headers: { 'Content-Type': 'application/octet-stream', 'Upload-Offset': String(upload.offset) },
+                    body: chunk
+                });
+            } catch (networkError) {
+                response = null;
+            }
+            
+            if (response && response.ok) {
+                upload = await response.json();
+                failures = 0;
+                continue;
+            }
+            if (response && response.status !== 409 && response.status < 500) {
+                const error = await response.json();
+                throw uploadError(`${file.name}: ${error.error || 'upload failed'}`);
+            }
+            if (++failures > 5) {
+                throw uploadError(`${file.name}: upload failed, please try again`);
+            }
+            
+            await new Promise(resolve => setTimeout(resolve, 1000 * failures));
+            try {
+                const statusResponse = await fetch(`${uploadsUrl}/${upload.upload_id}`);
+                if (statusResponse.ok) {
+                    upload = await statusResponse.json();
+                }
+            } catch (networkError) {
+                // Retry the same chunk
+            }
+        }
+        
+        const reference = { upload_id: upload.upload_id, name: file.name, size: file.size, type: file.type };
+        uploadedFiles.set(file, reference);
+        return reference;
+    }
+    
     form.addEventListener('submit', async function(e) {
         e.preventDefault();
         console.log('Form submitted, processing...');
@@ -87,6 +160,7 @@ document.addEventListener('DOMContentLoaded', function() {
             // Collect form data
             const formData = new FormData(form);
             const responses = {};
+            const fileUploads = [];
             
             // Process each question
             window.formData.questions.forEach(question => {
@@ -115,17 +189,12 @@ document.addEventListener('DOMContentLoaded', function() {
                         break;
                         
                     case 'file':
-                        // File handling - get file info
+                        // Files are uploaded first; the submission refers to the uploads
                         const fileInput = form.querySelector(`input[name="${question.id}"]`);
                         if (fileInput && fileInput.files.length > 0) {
-                            responses[question.id] = Array.from(fileInput.files).map(file => ({
-                                name: file.name,
-                                size: file.size,
-                                type: file.type
-                            }));
-                        } else {
-                            responses[question.id] = [];
+                            fileUploads.push({ questionId: question.id, files: Array.from(fileInput.files) });
                         }
+                        responses[question.id] = [];
                         break;
                         
                     case 'select':
@@ -158,11 +227,20 @@ document.addEventListener('DOMContentLoaded', function() {
                 }
             });
             
+            if (fileUploads.length > 0) {
+                submitBtn.textContent = 'Uploading files...';
+                for (const { questionId, files } of fileUploads) {
+                    responses[questionId] = await Promise.all(files.map(file => uploadFile(questionId, file)));
+                }
+                submitBtn.textContent = 'Submitting...';
+            }
+            
             // Submit to server
             const response = await fetch(`/api/form/${window.formData.name}/submit`, {
                 method: 'POST',
                 headers: {
                     'Content-Type': 'application/json',
+                    'Idempotency-Key': idempotencyKey
                 },
                 body: JSON.stringify({ responses })
             });
@@ -188,7 +266,16 @@ document.addEventListener('DOMContentLoaded', function() {
                 
             } else {
                 const error = await response.json();
-                alert('Error: ' + (error.error || 'Failed to submit form'));
+                
+                if (error.errors) {
+                    // List the answers the server rejected by question title
+                    const messages = window.formData.questions
+                        .filter(question => error.errors[question.id])
+                        .map(question => `${question.title}: ${error.errors[question.id]}`);
+                    alert('Please fix the following:\n' + messages.join('\n'));
+                } else {
+                    alert('Error: ' + (error.error || 'Failed to submit form'));
+                }
                 
                 // Reset button
                 submitBtn.disabled = false;
@@ -197,7 +284,7 @@ document.addEventListener('DOMContentLoaded', function() {
             
         } catch (error) {
             console.error('Error submitting form:', error);
-            alert('Failed to submit form. Please try again.');
+            alert(error.isUploadError ? error.message : 'Failed to submit form. Please try again.');
             
             // Reset button
             submitBtn.disabled = false;
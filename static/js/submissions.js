@@ -1,6 +1,186 @@
+// Submissions are fetched page by page from the API as the user scrolls
+const PAGE_SIZE = 50;
+const loadedSubmissions = {};
+let nextCursor = null;
+let sortOrder = 'desc';
+let isLoading = false;
+let hasMore = true;
+let submissionCount = window.formData.submission_count || 0;
+let submissionFeed = null;
+
+function escapeHtml(value) {
+    const div = document.createElement('div');
+    div.textContent = value;
+    return div.innerHTML;
+}
+
+function formatFile(file) {
+    // Uploaded files are kept as {upload_id, name, size, type}; link them to their download
+    const name = escapeHtml(file.name || 'file');
+    if (!file.upload_id) return name;
+    const url = `/api/form/${encodeURIComponent(window.formData.name)}/uploads/${encodeURIComponent(file.upload_id)}/file`;
+    return `<a href="${url}">${name}</a>`;
+}
+
+// Returns escaped HTML
+function formatAnswer(answer, emptyText) {
+    if (Array.isArray(answer)) {
+        if (answer.length === 0) return escapeHtml(emptyText);
+        return answer.map(item => (item && typeof item === 'object' ? formatFile(item) : escapeHtml(item))).join(', ');
+    }
+    return escapeHtml(answer === undefined || answer === null || answer === '' ? emptyText : answer);
+}
+
+function renderSubmissionRow(submission) {
+    const row = document.createElement('tr');
+    row.id = `submission-${submission.id}`;
+
+    let html = `
+        <td class="submission-date">
+            ${escapeHtml(submission.submitted_at.slice(0, 10))}<br>
+            <small>${escapeHtml(submission.submitted_at.slice(11, 19))}</small>
+        </td>
+    `;
+
+    window.formData.questions.forEach(question => {
+        const answer = (submission.responses || {})[question.id];
+        html += `<td class="submission-answer">${formatAnswer(answer, '-')}</td>`;
+    });
+
+    html += `
+        <td>
+            <div class="submission-actions">
+                <button class="view-btn" onclick="viewSubmission('${submission.id}')">View</button>
+                <button class="delete-btn" onclick="deleteSubmission('${submission.id}')">Delete</button>
+            </div>
+        </td>
+    `;
+
+    row.innerHTML = html;
+    return row;
+}
+
+async function loadMoreSubmissions() {
+    if (isLoading || !hasMore) return;
+    isLoading = true;
+
+    const sentinel = document.getElementById('submissionsSentinel');
+    const params = new URLSearchParams({ limit: PAGE_SIZE, sort: sortOrder });
+    if (nextCursor) {
+        params.set('cursor', nextCursor);
+    }
+
+    try {
+        const response = await fetch(`/api/form/${encodeURIComponent(window.formData.name)}/submissions?${params}`);
+        const data = await response.json();
+
+        if (!response.ok) {
+            throw new Error(data.error || 'Failed to load submissions');
+        }
+
+        const tbody = document.getElementById('submissionsBody');
+        data.submissions.forEach(submission => {
+            // Submissions that arrived live are already shown, and a page may include them again
+            if (loadedSubmissions[submission.id]) return;
+            loadedSubmissions[submission.id] = submission;
+            tbody.appendChild(renderSubmissionRow(submission));
+        });
+
+        nextCursor = data.next_cursor;
+        hasMore = Boolean(nextCursor);
+        sentinel.textContent = hasMore ? 'Loading submissions...' : '';
+    } catch (error) {
+        console.error('Error loading submissions:', error);
+        sentinel.textContent = 'Failed to load submissions. Scroll to retry.';
+        isLoading = false;
+        return;
+    }
+
+    isLoading = false;
+
+    // Keep filling the page while the sentinel is still visible
+    if (hasMore && sentinel.getBoundingClientRect().top < window.innerHeight) {
+        loadMoreSubmissions();
+    }
+}
+
+function reloadSubmissions() {
+    // Start over from the first page
+    document.getElementById('submissionsBody').innerHTML = '';
+    Object.keys(loadedSubmissions).forEach(id => delete loadedSubmissions[id]);
+    nextCursor = null;
+    hasMore = true;
+    loadMoreSubmissions();
+}
+
+function toggleSort() {
+    sortOrder = sortOrder === 'desc' ? 'asc' : 'desc';
+    document.getElementById('sortIndicator').textContent = sortOrder === 'desc' ? '↓' : '↑';
+    reloadSubmissions();
+}
+
+function updateSubmissionCount(delta) {
+    submissionCount = Math.max(0, submissionCount + delta);
+    const counter = document.querySelector('.submissions-count');
+    if (counter) {
+        counter.textContent = `${submissionCount} submission${submissionCount !== 1 ? 's' : ''}`;
+    }
+}
+
+// Show submissions as they arrive (Server-Sent Events); the browser resumes after the last one on reconnect
+function connectSubmissionFeed() {
+    if (typeof EventSource === 'undefined') {
+        return;
+    }
+    if (submissionFeed) {
+        submissionFeed.close();
+    }
+    submissionFeed = new EventSource(`/api/form/${encodeURIComponent(window.formData.name)}/submissions/events`);
+
+    submissionFeed.addEventListener('submission', event => {
+        const submission = JSON.parse(event.data);
+        if (loadedSubmissions[submission.id]) {
+            return;
+        }
+
+        const tbody = document.getElementById('submissionsBody');
+        if (!tbody) {
+            // First submission: the page only renders the table once there are some
+            window.location.reload();
+            return;
+        }
+
+        updateSubmissionCount(1);
+        if (sortOrder === 'desc') {
+            loadedSubmissions[submission.id] = submission;
+            tbody.prepend(renderSubmissionRow(submission));
+        } else if (!hasMore) {
+            // Oldest first: only add it if the last page is already loaded
+            loadedSubmissions[submission.id] = submission;
+            tbody.appendChild(renderSubmissionRow(submission));
+        }
+    });
+
+    submissionFeed.addEventListener('deleted', event => {
+        const { id } = JSON.parse(event.data);
+        const row = document.getElementById(`submission-${id}`);
+        if (row) row.remove();
+        delete loadedSubmissions[id];
+        updateSubmissionCount(-1);
+    });
+
+    submissionFeed.addEventListener('resync', () => {
+        // Missed too much to catch up: reload the list and follow it afresh
+        if (document.getElementById('submissionsBody')) {
+            reloadSubmissions();
+        }
+        connectSubmissionFeed();
+    });
+}
+
 function copyShareLink() {
     const shareUrl = `${window.location.origin}/submit/${window.formData.name}`;
-    
+
     // Create temporary input to copy text
     const tempInput = document.createElement('input');
     tempInput.value = shareUrl;
@@ -8,13 +188,13 @@ function copyShareLink() {
     tempInput.select();
     document.execCommand('copy');
     document.body.removeChild(tempInput);
-    
+
     // Show feedback
     const btn = event.target;
     const originalText = btn.textContent;
     btn.textContent = 'Copied!';
     btn.style.background = '#34c759';
-    
+
     setTimeout(() => {
         btn.textContent = originalText;
         btn.style.background = '';
@@ -22,43 +202,39 @@ function copyShareLink() {
 }
 
 function viewSubmission(submissionId) {
-    const submission = window.formData.submissions.find(s => s.id === submissionId);
+    const submission = loadedSubmissions[submissionId];
     if (!submission) return;
-    
+
     const modal = document.getElementById('submissionModal');
     const detailsContainer = document.getElementById('submissionDetails');
-    
+
     // Format submission date
     const date = new Date(submission.submitted_at);
     const formattedDate = date.toLocaleDateString() + ' at ' + date.toLocaleTimeString();
-    
+
     let html = `
         <div class="submission-meta">
-            <h3>Submission ID: ${submission.id}</h3>
+            <h3>Submission ID: ${escapeHtml(submission.id)}</h3>
             <p>Submitted on ${formattedDate}</p>
         </div>
     `;
-    
+
     // Add each question and answer
     window.formData.questions.forEach(question => {
-        const answer = submission.responses[question.id];
-        let displayAnswer = '';
-        
-        if (Array.isArray(answer)) {
-            displayAnswer = answer.length > 0 ? answer.join(', ') : 'No selection';
-        } else {
-            displayAnswer = answer || 'No answer';
-        }
-        
+        const answer = (submission.responses || {})[question.id];
+        const displayAnswer = Array.isArray(answer) && answer.length === 0
+            ? 'No selection'
+            : formatAnswer(answer, 'No answer');
+
         html += `
             <div class="submission-detail-item">
-                <h4>${question.title}</h4>
+                <h4>${escapeHtml(question.title)}</h4>
                 <p>${displayAnswer}</p>
             </div>
         `;
     });
-    
-    
+
+
     detailsContainer.innerHTML = html;
     modal.className = 'modal show';
 }
@@ -80,7 +256,7 @@ async function deleteSubmission(submissionId) {
     if (!confirm('Are you sure you want to delete this submission? This action cannot be undone.')) {
         return;
     }
-    
+
     try {
         const response = await fetch(`/api/form/${window.formData.name}/submission/${submissionId}/delete`, {
             method: 'DELETE',
@@ -88,10 +264,12 @@ async function deleteSubmission(submissionId) {
                 'Content-Type': 'application/json',
             }
         });
-        
+
         if (response.ok) {
-            // Reload the page to refresh the submissions list
-            window.location.reload();
+            // Drop the row instead of reloading every page
+            const row = document.getElementById(`submission-${submissionId}`);
+            if (row) row.remove();
+            delete loadedSubmissions[submissionId];
         } else {
             const error = await response.json();
             alert('Error: ' + (error.error || 'Failed to delete submission'));
@@ -102,10 +280,24 @@ async function deleteSubmission(submissionId) {
     }
 }
 
-// Initialize share link if present
+// Initialize share link and lazy loading
 document.addEventListener('DOMContentLoaded', function() {
     const shareLink = document.getElementById('shareLink');
     if (shareLink) {
         shareLink.value = `${window.location.origin}/submit/${window.formData.name}`;
     }
-});
\ No newline at end of file
+
+    const sentinel = document.getElementById('submissionsSentinel');
+    if (sentinel) {
+        // Load the next page whenever the bottom of the table scrolls into view
+        const observer = new IntersectionObserver(entries => {
+            if (entries.some(entry => entry.isIntersecting)) {
+                loadMoreSubmissions();
+            }
+        }, { rootMargin: '200px' });
+        observer.observe(sentinel);
+    }
+
+    // Follow new submissions before the first page loads; duplicates are skipped by ID
+    connectSubmissionFeed();
+});
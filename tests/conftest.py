@@ -6,7 +6,12 @@ import mongomock
 from unittest.mock import patch, MagicMock
 import os
 import tempfile
+import socketserver
+import threading
+import json
 from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
 
 # Import application modules
 import sys
@@ -19,9 +24,15 @@ if project_root not in sys.path:
 
 try:
     from app import app as flask_app
+    from cache import form_cache, user_cache, idempotency_cache
     from database import db_manager
     from models import UserModel, FormModel
     from auth import auth_manager
+    from validation import validator_cache
+    from ratelimit import rate_limiter
+    from http_client import oauth_http
+    from events import event_broker
+    from analytics import analytics_cache
     import factory
 except ImportError as e:
     print(f"Import error: {e}")
@@ -32,13 +43,17 @@ except ImportError as e:
 
 
 @pytest.fixture
-def app():
-    """Create Flask app for testing"""
-    flask_app.config['TESTING'] = True
-    flask_app.config['WTF_CSRF_ENABLED'] = False
-    flask_app.config['SECRET_KEY'] = 'test_secret_key'
+def mongo_db():
+    """Per-test mongomock database shared by the app and mock_mongo fixtures"""
+    # Cached state must not leak between tests
+    form_cache.clear()
+    user_cache.clear()
+    idempotency_cache.clear()
+    validator_cache.clear()
+    analytics_cache.clear()
+    rate_limiter.reset()
+    event_broker.reset()
     
-    # Mock MongoDB for testing
     with patch('database.MongoClient') as mock_client:
         mock_db = mongomock.MongoClient().aform_test
         mock_client.return_value = MagicMock()
@@ -49,8 +64,22 @@ def app():
         db_manager.db = mock_db
         db_manager.users_collection = mock_db.users
         db_manager.forms_collection = mock_db.forms
+        db_manager.submissions_collection = mock_db.submissions
+        db_manager.mail_dead_letters_collection = mock_db.mail_dead_letters
+        db_manager.uploads_collection = mock_db.uploads
+        db_manager.form_changes_collection = mock_db.form_changes
         
-        yield flask_app
+        yield mock_db
+
+
+@pytest.fixture
+def app(mongo_db):
+    """Create Flask app for testing"""
+    flask_app.config['TESTING'] = True
+    flask_app.config['WTF_CSRF_ENABLED'] = False
+    flask_app.config['SECRET_KEY'] = 'test_secret_key'
+    
+    yield flask_app
 
 
 @pytest.fixture
@@ -60,20 +89,9 @@ def client(app):
 
 
 @pytest.fixture
-def mock_mongo():
+def mock_mongo(mongo_db):
     """Mock MongoDB client for testing"""
-    with patch('database.MongoClient') as mock_client:
-        mock_db = mongomock.MongoClient().aform_test
-        mock_client.return_value = MagicMock()
-        mock_client.return_value.__getitem__.return_value = mock_db
-        
-        # Setup database manager
-        db_manager.client = mock_client.return_value
-        db_manager.db = mock_db
-        db_manager.users_collection = mock_db.users
-        db_manager.forms_collection = mock_db.forms
-        
-        yield mock_db
+    yield mongo_db
 
 
 @pytest.fixture
@@ -94,6 +112,154 @@ def mock_mail():
         yield mock_mail
 
 
+class FakeSMTPServer(socketserver.ThreadingTCPServer):
+    """Minimal local SMTP server that records the messages it receives"""
+    allow_reuse_address = True
+    daemon_threads = True
+    
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), FakeSMTPHandler)
+        self.port = self.server_address[1]
+        self.messages = []
+        self.connections = 0
+        # Number of upcoming messages to reject with the given SMTP reply
+        self.reject_next = 0
+        self.reject_reply = '451 Try again later'
+
+
+class FakeSMTPHandler(socketserver.StreamRequestHandler):
+    """Speaks just enough SMTP for smtplib.sendmail"""
+    
+    def reply(self, line):
+        self.wfile.write(f"{line}\r\n".encode())
+    
+    def handle(self):
+        self.server.connections += 1
+        self.reply('220 localhost fake SMTP')
+        envelope = {}
+        
+        for raw in self.rfile:
+            command = raw.decode().strip()
+            verb = command[:4].upper()
+            
+            if verb in ('EHLO', 'HELO'):
+                self.reply('250 localhost')
+            elif verb == 'MAIL':
+                if self.server.reject_next:
+                    self.server.reject_next -= 1
+                    self.reply(self.server.reject_reply)
+                    continue
+                envelope = {'from': command[10:].strip('<>'), 'to': []}
+                self.reply('250 OK')
+            elif verb == 'RCPT':
+                envelope['to'].append(command[8:].strip('<>'))
+                self.reply('250 OK')
+            elif verb == 'DATA':
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+                lines = []
+                for data_line in self.rfile:
+                    if data_line in (b'.\r\n', b'.\n'):
+                        break
+                    lines.append(data_line.decode())
+                envelope['data'] = ''.join(lines)
+                self.server.messages.append(envelope)
+                self.reply('250 OK')
+            elif verb == 'QUIT':
+                self.reply('221 Bye')
+                return
+            else:
+                # RSET, NOOP
+                self.reply('250 OK')
+
+
+@pytest.fixture
+def fake_smtp():
+    """Run a local fake SMTP server for the duration of a test"""
+    server = FakeSMTPServer()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+class FakeOAuthServer(ThreadingHTTPServer):
+    """Minimal local OAuth provider with token and userinfo endpoints"""
+    daemon_threads = True
+    
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), FakeOAuthHandler)
+        self.base_url = f"http://127.0.0.1:{self.server_address[1]}"
+        self.user_info = {'email': 'oauth@example.com', 'name': 'OAuth User', 'picture': ''}
+        self.requests = []
+        self.connections = 0
+        # Statuses to answer the next userinfo requests with before succeeding
+        self.userinfo_failures = []
+
+
+class FakeOAuthHandler(BaseHTTPRequestHandler):
+    """Answers token exchanges for any code and userinfo requests for the issued tokens"""
+    protocol_version = 'HTTP/1.1'
+    
+    def setup(self):
+        super().setup()
+        self.server.connections += 1
+    
+    def log_message(self, format, *args):
+        pass
+    
+    def reply(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+    
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        form = {key: values[0] for key, values in parse_qs(self.rfile.read(length).decode()).items()}
+        self.server.requests.append(('POST', self.path, form))
+        
+        if self.path != '/token' or form.get('grant_type') != 'authorization_code' or not form.get('code'):
+            return self.reply(400, {'error': 'invalid_request'})
+        self.reply(200, {'access_token': f"token-{form['code']}", 'token_type': 'Bearer', 'expires_in': 3600})
+    
+    def do_GET(self):
+        self.server.requests.append(('GET', self.path, self.headers.get('Authorization')))
+        
+        if self.path != '/userinfo':
+            return self.reply(404, {'error': 'not_found'})
+        if self.server.userinfo_failures:
+            return self.reply(self.server.userinfo_failures.pop(0), {'error': 'unavailable'})
+        if not (self.headers.get('Authorization') or '').startswith('Bearer token-'):
+            return self.reply(401, {'error': 'invalid_token'})
+        self.reply(200, self.server.user_info)
+
+
+@pytest.fixture
+def fake_oauth():
+    """Run a local fake OAuth provider and point the Google client at it"""
+    server = FakeOAuthServer()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    
+    previous = (auth_manager.oauth, auth_manager.google, auth_manager.userinfo_url)
+    auth_manager.register_google(
+        'test_client_id', 'test_client_secret',
+        authorize_url=f"{server.base_url}/authorize",
+        token_url=f"{server.base_url}/token",
+        userinfo_url=f"{server.base_url}/userinfo"
+    )
+    oauth_http.reset()
+    
+    yield server
+    
+    auth_manager.oauth, auth_manager.google, auth_manager.userinfo_url = previous
+    server.shutdown()
+    server.server_close()
+
+
 class UserFactory(factory.Factory):
     """Factory for creating test users"""
     class Meta:
@@ -125,8 +291,9 @@ class FormFactory(factory.Factory):
         'editor': [],
         'viewer': []
     }
+    members = factory.LazyAttribute(lambda form: FormModel.build_members(form.permissions))
+    member_ids = factory.LazyAttribute(lambda form: list(form.members))
     invites = []
-    submissions = []
     questions = [
         {
             'id': 'q_1',
@@ -159,17 +326,13 @@ def admin_user():
 @pytest.fixture
 def authenticated_session(client, sample_user):
     """Create authenticated session for testing"""
-    with client.session_transaction() as sess:
-        sess['user'] = sample_user
-    return sample_user
+    return log_in(client, sample_user)
 
 
 @pytest.fixture
 def admin_session(client, admin_user):
     """Create admin authenticated session for testing"""
-    with client.session_transaction() as sess:
-        sess['user'] = admin_user
-    return admin_user
+    return log_in(client, admin_user)
 
 
 @pytest.fixture
@@ -191,6 +354,7 @@ def cleanup_db(mock_mongo):
     # Clear all collections
     mock_mongo.users.delete_many({})
     mock_mongo.forms.delete_many({})
+    mock_mongo.submissions.delete_many({})
 
 
 # Test utilities
@@ -212,8 +376,30 @@ def create_test_form(mock_mongo, form_data=None):
     return form_data
 
 
+def create_test_submission(mock_mongo, form_data, submission_data):
+    """Helper to create a test submission for a form in database"""
+    submission_data['form_id'] = str(form_data['_id'])
+    submission_data.setdefault('submitted_at', datetime.now())
+    
+    mock_mongo.submissions.insert_one(submission_data)
+    return submission_data
+
+
+def log_in(client, user_data):
+    """Helper to store a user and give the test client a session for them"""
+    users = db_manager.get_users_collection()
+    if not users.find_one({'id': user_data['id']}):
+        users.insert_one(dict(user_data))
+    
+    with client.session_transaction() as sess:
+        sess['user'] = {
+            'id': user_data['id'],
+            'role': user_data.get('role', 'user'),
+            'v': user_data.get('session_version', 0)
+        }
+    return user_data
+
+
 def authenticate_user(client, user_data):
     """Helper to authenticate a user in test client"""
-    with client.session_transaction() as sess:
-        sess['user'] = user_data
-    return user_data
\ No newline at end of file
+    return log_in(client, user_data)
\ No newline at end of file
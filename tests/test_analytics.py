@@ -0,0 +1,192 @@
+"""
+Submission analytics tests for aForm application
+"""
+import pytest
+from datetime import datetime, timedelta
+
+from analytics import analytics_cache
+from models import FormModel
+from tests.conftest import UserFactory, FormFactory, create_test_form, create_test_submission, log_in
+
+
+QUESTIONS = [
+    {'id': 'q_color', 'title': 'Color', 'type': 'radio', 'options': ['Red', 'Green', 'Blue'], 'required': True},
+    {'id': 'q_tags', 'title': 'Tags', 'type': 'checkbox', 'options': ['a', 'b']},
+    {'id': 'q_score', 'title': 'Score', 'type': 'rating', 'ratingScale': 5},
+    {'id': 'q_age', 'title': 'Age', 'type': 'number'},
+    {'id': 'q_name', 'title': 'Name', 'type': 'text', 'required': True}
+]
+
+
+def submit(mock_mongo, form, submission_id, responses, submitted_at):
+    """Store a submission and count it on the form like add_submission does"""
+    create_test_submission(mock_mongo, form, {'id': submission_id, 'responses': responses, 'submitted_at': submitted_at})
+    mock_mongo.forms.update_one({'_id': form['_id']}, {'$inc': {'submission_count': 1}})
+
+
+@pytest.mark.api
+class TestFormAnalytics:
+    """Test per-question aggregation and incremental refreshes"""
+
+    @pytest.fixture
+    def form(self, mock_mongo, authenticated_session):
+        form = create_test_form(mock_mongo, FormFactory(
+            name='test_form',
+            permissions={'admin': [authenticated_session['id']], 'editor': [], 'viewer': []},
+            questions=QUESTIONS,
+            submission_count=0,
+            schema_version=0
+        ))
+        submit(mock_mongo, form, 'sub_1', {
+            'q_color': 'Red', 'q_tags': ['a', 'b'], 'q_score': '4', 'q_age': 30, 'q_name': 'Ann'
+        }, datetime(2024, 1, 1, 9, 15))
+        submit(mock_mongo, form, 'sub_2', {
+            'q_color': 'Red', 'q_tags': ['b'], 'q_score': 5, 'q_age': 'n/a', 'q_name': ''
+        }, datetime(2024, 1, 1, 9, 45))
+        submit(mock_mongo, form, 'sub_3', {
+            'q_color': 'Purple', 'q_tags': [], 'q_score': '', 'q_age': 41.5
+        }, datetime(2024, 1, 2, 17, 0))
+        return form
+
+    def get_analytics(self, client):
+        response = client.get('/api/form/test_form/analytics')
+        assert response.status_code == 200
+        return response.get_json()
+
+    def test_aggregates_per_question_type(self, client, mock_mongo, form):
+        """Test histograms, means, hours and completion rates"""
+        analytics = self.get_analytics(client)
+        questions = {question['id']: question for question in analytics['questions']}
+
+        assert analytics['submission_count'] == 3
+        assert analytics['last_submission_at'] == '2024-01-02T17:00:00'
+        assert analytics['submissions_by_hour'][9] == 2
+        assert analytics['submissions_by_hour'][17] == 1
+        assert sum(analytics['submissions_by_hour']) == 3
+
+        assert questions['q_color']['options'] == [
+            {'value': 'Red', 'count': 2}, {'value': 'Green', 'count': 0},
+            {'value': 'Blue', 'count': 0}, {'value': 'Purple', 'count': 1}
+        ]
+        assert questions['q_color']['completion_rate'] == 1.0
+        assert questions['q_tags']['options'] == [{'value': 'a', 'count': 1}, {'value': 'b', 'count': 2}]
+        assert questions['q_tags']['answered'] == 2
+        assert 'completion_rate' not in questions['q_tags']
+
+        assert questions['q_score']['count'] == 2
+        assert questions['q_score']['mean'] == 4.5
+        assert questions['q_score']['distribution'] == [{'value': 4, 'count': 1}, {'value': 5, 'count': 1}]
+        assert questions['q_age']['mean'] == pytest.approx(35.75)
+        assert (questions['q_age']['min'], questions['q_age']['max']) == (30, 41.5)
+        assert questions['q_age']['histogram'] == [{'from': 20, 'to': 50, 'count': 2}]
+
+        assert questions['q_name']['completion_rate'] == pytest.approx(1 / 3)
+
+    def test_refresh_counts_only_new_submissions(self, client, mock_mongo, form):
+        """Test cached summaries are refreshed with new submissions instead of rebuilt"""
+        self.get_analytics(client)
+        submit(mock_mongo, form, 'sub_4', {'q_color': 'Green', 'q_score': '1'}, datetime.now())
+
+        analytics = self.get_analytics(client)
+        # Asking again counts nothing twice
+        assert self.get_analytics(client) == analytics
+
+        assert analytics['submission_count'] == 4
+        questions = {question['id']: question for question in analytics['questions']}
+        assert questions['q_color']['options'][1] == {'value': 'Green', 'count': 1}
+        assert questions['q_score']['count'] == 3
+        assert analytics_cache.stats()['rebuilds'] == 1
+        assert analytics_cache.stats()['refreshes'] == 2
+
+    def test_number_histogram_bins_are_fixed(self, client, mock_mongo, form):
+        """Test number answers are counted in a bounded set of bins however many values they take"""
+        for index in range(200):
+            submit(mock_mongo, form, f'sub_n{index}', {'q_age': 1000 + index * 7.25}, datetime(2024, 1, 3))
+        submit(mock_mongo, form, 'sub_neg', {'q_age': -3}, datetime(2024, 1, 3))
+        submit(mock_mongo, form, 'sub_huge', {'q_age': 1e15}, datetime(2024, 1, 3))
+
+        question = self.get_analytics(client)['questions'][3]
+
+        assert question['count'] == 204
+        assert (question['min'], question['max']) == (-3, 1e15)
+        assert question['histogram'] == [
+            {'from': -5, 'to': -2, 'count': 1},
+            {'from': 20, 'to': 50, 'count': 2},
+            {'from': 1000, 'to': 2000, 'count': 138},
+            {'from': 2000, 'to': 5000, 'count': 62},
+            {'from': 10 ** 12, 'to': None, 'count': 1}
+        ]
+
+    def test_migrate_number_answers(self, client, mock_mongo, form):
+        """Test number answers stored as text are converted and then counted"""
+        submit(mock_mongo, form, 'sub_4', {'q_age': '12'}, datetime(2024, 1, 3))
+
+        assert self.get_analytics(client)['questions'][3]['count'] == 2
+        assert FormModel.migrate_number_answers() == 1
+
+        assert mock_mongo.submissions.find_one({'id': 'sub_4'})['responses']['q_age'] == 12
+        assert mock_mongo.submissions.find_one({'id': 'sub_2'})['responses']['q_age'] == 'n/a'
+        assert self.get_analytics(client)['questions'][3]['count'] == 3
+
+    def test_late_submission_counted_once(self, client, mock_mongo, form):
+        """Test submissions stored after a refresh but dated before it are still counted"""
+        submit(mock_mongo, form, 'sub_4', {'q_color': 'Green'}, datetime.now() - timedelta(seconds=30))
+        self.get_analytics(client)
+
+        # Stored late, e.g. by the ingestion queue
+        submit(mock_mongo, form, 'sub_5', {'q_color': 'Blue'}, datetime.now() - timedelta(seconds=20))
+        analytics = self.get_analytics(client)
+
+        assert analytics['submission_count'] == 5
+        options = {option['value']: option['count'] for option in analytics['questions'][0]['options']}
+        assert (options['Green'], options['Blue']) == (1, 1)
+
+    def test_deleted_submission_rebuilds(self, client, mock_mongo, form):
+        """Test deletions drop the cached summary"""
+        self.get_analytics(client)
+
+        assert client.delete('/api/form/test_form/submission/sub_3/delete').status_code == 200
+        analytics = self.get_analytics(client)
+
+        assert analytics['submission_count'] == 2
+        assert analytics['questions'][0]['options'][-1] == {'value': 'Blue', 'count': 0}
+        assert analytics_cache.stats()['rebuilds'] == 2
+
+    def test_deletion_elsewhere_rebuilds(self, client, mock_mongo, form):
+        """Test summaries counting more submissions than the form has are rebuilt"""
+        self.get_analytics(client)
+        # Deleted through another process, whose cache invalidation doesn't reach this one
+        mock_mongo.submissions.delete_one({'id': 'sub_1'})
+        mock_mongo.forms.update_one({'_id': form['_id']}, {'$inc': {'submission_count': -1}})
+
+        analytics = self.get_analytics(client)
+
+        assert analytics['submission_count'] == 2
+        assert analytics_cache.stats()['rebuilds'] == 2
+
+    def test_question_change_rebuilds(self, client, mock_mongo, form):
+        """Test summaries are rebuilt for a new schema version"""
+        self.get_analytics(client)
+        FormModel.patch_questions('test_form', 0, [{'op': 'delete', 'id': 'q_tags'}])
+
+        analytics = self.get_analytics(client)
+
+        assert [question['id'] for question in analytics['questions']] == ['q_color', 'q_score', 'q_age', 'q_name']
+        assert analytics_cache.stats()['rebuilds'] == 2
+
+    def test_viewers_allowed(self, client, mock_mongo):
+        """Test form viewers can read analytics but other users can't"""
+        user = log_in(client, UserFactory())
+        create_test_form(mock_mongo, FormFactory(
+            name='test_form',
+            permissions={'admin': [], 'editor': [], 'viewer': [user['id']]},
+            questions=QUESTIONS
+        ))
+        create_test_form(mock_mongo, FormFactory(
+            name='other_form',
+            permissions={'admin': [], 'editor': [], 'viewer': []}
+        ))
+
+        assert self.get_analytics(client)['submission_count'] == 0
+        assert client.get('/api/form/other_form/analytics').status_code == 403
+        assert client.get('/api/form/missing/analytics').status_code == 404
@@ -4,8 +4,10 @@ Authentication tests for aForm application
 import pytest
 from unittest.mock import patch, MagicMock
 from datetime import datetime
+from urllib.parse import parse_qs, urlparse
 
 from auth import auth_manager, login_required, role_required, permission_required
+from http_client import oauth_http
 from models import UserModel
 from tests.conftest import UserFactory, create_test_user
 
@@ -37,6 +39,20 @@ class TestAuthManager:
         
         assert auth_manager.google is None
     
+    def test_register_google_again_applies_new_settings(self, app):
+        """Test re-registering the Google client replaces the one registered before"""
+        previous = (auth_manager.oauth, auth_manager.google, auth_manager.userinfo_url)
+        try:
+            auth_manager.register_google('first_client_id', 'secret')
+            google = auth_manager.register_google('second_client_id', 'secret',
+                                                  userinfo_url='https://example.com/userinfo')
+            
+            assert google.client_id == 'second_client_id'
+            assert auth_manager.oauth.create_client('google') is google
+            assert auth_manager.userinfo_url == 'https://example.com/userinfo'
+        finally:
+            auth_manager.oauth, auth_manager.google, auth_manager.userinfo_url = previous
+    
     def test_load_users(self, mock_mongo):
         """Test loading users from database"""
         # Create test users
@@ -72,13 +88,13 @@ class TestAuthManager:
             'picture': 'http://example.com/pic.jpg'
         }
         
-        with patch('models.UserModel.create_user') as mock_create:
-            mock_create.return_value = UserFactory(**user_info)
-            
-            user = auth_manager.create_or_update_user(user_info)
-            
-            mock_create.assert_called_once_with(user_info)
-            assert user['email'] == 'new@example.com'
+        user = auth_manager.create_or_update_user(user_info)
+        
+        assert user['email'] == 'new@example.com'
+        assert user['name'] == 'New User'
+        assert user['role'] == 'user'
+        assert user['status'] == 'active'
+        assert mock_mongo.users.count_documents({}) == 1
     
     def test_create_or_update_user_existing_user(self, mock_mongo):
         """Test updating existing user"""
@@ -90,13 +106,12 @@ class TestAuthManager:
             'picture': 'http://example.com/new_pic.jpg'
         }
         
-        with patch('models.UserModel.update_user') as mock_update:
-            mock_update.return_value = {**existing_user, 'name': 'Updated Name'}
-            
-            user = auth_manager.create_or_update_user(user_info)
-            
-            mock_update.assert_called_once()
-            assert user['name'] == 'Updated Name'
+        user = auth_manager.create_or_update_user(user_info)
+        
+        assert user['id'] == existing_user['id']
+        assert user['name'] == 'Updated Name'
+        assert user['picture'] == 'http://example.com/new_pic.jpg'
+        assert mock_mongo.users.count_documents({}) == 1
     
     def test_get_current_user_authenticated(self, client, sample_user):
         """Test getting current user when authenticated"""
@@ -396,19 +411,14 @@ class TestAuthRoutes:
     
     def test_auth_callback_success(self, client, mock_google_oauth):
         """Test successful OAuth callback"""
-        mock_response = MagicMock()
-        mock_response.json.return_value = {'access_token': 'test_token'}
-        
-        mock_userinfo = MagicMock()
-        mock_userinfo.json.return_value = {
+        mock_google_oauth.authorize_access_token.return_value = {'access_token': 'test_token'}
+        mock_google_oauth.get.return_value.json.return_value = {
             'email': 'test@example.com',
             'name': 'Test User',
             'picture': 'http://example.com/pic.jpg'
         }
         
-        with patch('requests.post', return_value=mock_response), \
-             patch('requests.get', return_value=mock_userinfo), \
-             patch('auth.auth_manager.create_or_update_user') as mock_create:
+        with patch('auth.auth_manager.create_or_update_user') as mock_create:
             
             mock_create.return_value = UserFactory(email='test@example.com')
             
@@ -429,4 +439,57 @@ class TestAuthRoutes:
         response = client.get('/test-callback')
         
         assert response.status_code == 200
-        assert b'Callback Test' in response.data
\ No newline at end of file
+        assert b'Callback Test' in response.data
+
+@pytest.mark.auth
+class TestOAuthProvider:
+    """Test the OAuth callback against a local stub provider"""
+    
+    def login(self, client, code='test_code'):
+        """Start the login redirect and return the provider's callback"""
+        response = client.get('/login')
+        state = parse_qs(urlparse(response.location).query)['state'][0]
+        return client.get(f'/auth/callback?code={code}&state={state}')
+    
+    def test_callback_logs_user_in(self, client, mock_mongo, fake_oauth):
+        """Test the code is exchanged for a token and the user's profile over the pool"""
+        response = self.login(client)
+        
+        assert response.status_code == 302
+        with client.session_transaction() as sess:
+            assert sess['user']['id'] == mock_mongo.users.find_one({'email': 'oauth@example.com'})['id']
+        assert fake_oauth.requests[0][:2] == ('POST', '/token')
+        assert fake_oauth.requests[1] == ('GET', '/userinfo', 'Bearer token-test_code')
+        
+        stats = oauth_http.stats()
+        assert stats[f"{fake_oauth.base_url[7:]}/token"]['calls'] == 1
+        assert stats[f"{fake_oauth.base_url[7:]}/userinfo"]['calls'] == 1
+    
+    def test_connections_reused(self, client, mock_mongo, fake_oauth):
+        """Test repeated logins reuse pooled connections"""
+        for _ in range(3):
+            client.get('/logout')
+            assert self.login(client).status_code == 302
+        
+        assert len(fake_oauth.requests) == 6
+        assert fake_oauth.connections == 1
+    
+    def test_userinfo_retried(self, client, mock_mongo, fake_oauth):
+        """Test a transient provider error on userinfo is retried"""
+        fake_oauth.userinfo_failures = [503]
+        
+        response = self.login(client)
+        
+        assert response.status_code == 302
+        assert [r[1] for r in fake_oauth.requests] == ['/token', '/userinfo', '/userinfo']
+    
+    def test_state_mismatch_rejected(self, client, mock_mongo, fake_oauth):
+        """Test a callback without the state issued by /login is rejected"""
+        client.get('/login')
+        
+        response = client.get('/auth/callback?code=test_code&state=forged')
+        
+        assert b'Callback Error' in response.data
+        assert fake_oauth.requests == []
+        with client.session_transaction() as sess:
+            assert 'user' not in sess
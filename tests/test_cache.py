@@ -0,0 +1,249 @@
+"""
+Form cache tests for aForm application
+"""
+import pytest
+import json
+import time
+from datetime import datetime
+from unittest.mock import patch
+
+from cache import FormCache, UserCache, form_cache
+from models import FormModel
+from tests.conftest import UserFactory, FormFactory, create_test_form
+
+
+class FakeSharedBackend:
+    """In-memory stand-in for a shared cache such as Redis"""
+
+    def __init__(self):
+        self.data = {}
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def set(self, key, value, ex=None):
+        self.data[key] = value
+
+    def delete(self, key):
+        self.data.pop(key, None)
+
+
+@pytest.mark.unit
+class TestFormCache:
+    """Test FormCache class"""
+
+    def test_hit_and_miss_metrics(self):
+        """Test hits and misses are counted"""
+        cache = FormCache()
+
+        assert cache.get('form', ('name',)) is None
+        cache.set('form', ('name',), {'name': 'form', 'updated_at': 'v1'})
+        assert cache.get('form', ('name',))['name'] == 'form'
+
+        stats = cache.stats()
+        assert stats['hits'] == 1
+        assert stats['misses'] == 1
+        assert stats['hit_rate'] == 0.5
+
+    def test_returns_copies(self):
+        """Test callers cannot modify cached forms"""
+        cache = FormCache()
+        cache.set('form', (), {'questions': [], 'updated_at': 'v1'})
+
+        cache.get('form', ())['questions'].append({'id': 'q_1'})
+
+        assert cache.get('form', ())['questions'] == []
+
+    def test_lru_eviction(self):
+        """Test least recently used forms are evicted first"""
+        cache = FormCache(max_entries=2)
+        cache.set('a', (), {'updated_at': 'v1'})
+        cache.set('b', (), {'updated_at': 'v1'})
+        cache.get('a', ())
+        cache.set('c', (), {'updated_at': 'v1'})
+
+        assert cache.get('a', ()) is not None
+        assert cache.get('b', ()) is None
+        assert cache.get('c', ()) is not None
+
+    def test_ttl_expiry(self):
+        """Test entries expire after the TTL"""
+        cache = FormCache(ttl=10)
+        cache.set('form', (), {'updated_at': 'v1'})
+
+        with patch('cache.time.monotonic', return_value=time.monotonic() + 11):
+            assert cache.get('form', ()) is None
+
+    def test_invalidate_drops_all_profiles(self):
+        """Test invalidation drops every cached profile of a form"""
+        cache = FormCache()
+        cache.set('form', ('name',), {'updated_at': 'v1'})
+        cache.set('form', ('name', 'questions'), {'updated_at': 'v1'})
+
+        cache.invalidate('form', 'v2')
+
+        assert cache.get('form', ('name',)) is None
+        assert cache.get('form', ('name', 'questions')) is None
+        assert cache.stats()['invalidations'] == 1
+
+    def test_set_skipped_after_concurrent_invalidation(self):
+        """Test a form read before an invalidation is not cached"""
+        cache = FormCache()
+        generation = cache.generation('form')
+        cache.invalidate('form', 'v2')
+
+        cache.set('form', (), {'updated_at': 'v1'}, generation)
+
+        assert cache.get('form', ()) is None
+
+    def test_unversioned_forms_not_cached(self):
+        """Test forms without updated_at are never cached"""
+        cache = FormCache()
+        cache.set('form', (), {'name': 'form'})
+
+        assert cache.get('form', ()) is None
+
+    def test_shared_backend_version_check(self):
+        """Test a write in another process makes local entries stale"""
+        backend = FakeSharedBackend()
+        cache = FormCache(backend=backend)
+        other_process = FormCache(backend=backend)
+        cache.set('form', (), {'updated_at': 'v1'})
+
+        other_process.invalidate('form', 'v2')
+
+        assert cache.get('form', ()) is None
+
+    def test_local_entries_expire_after_local_ttl(self):
+        """Test entries without a shared backend are only served for local_ttl seconds"""
+        cache = FormCache(ttl=30, local_ttl=5)
+        cache.set('form', (), {'updated_at': 'v1'})
+
+        assert cache.get('form', ()) is not None
+
+        with patch('cache.time.monotonic', return_value=time.monotonic() + 6):
+            assert cache.get('form', ()) is None
+        assert cache.stats()['hits'] == 1
+        assert cache.stats()['misses'] == 1
+
+    def test_shared_backend_fills_local_cache(self):
+        """Test forms cached by another process are served"""
+        backend = FakeSharedBackend()
+        FormCache(backend=backend).set('form', (), {'name': 'form', 'updated_at': 'v1'})
+        cache = FormCache(backend=backend)
+
+        assert cache.get('form', ())['name'] == 'form'
+
+
+@pytest.mark.unit
+class TestUserCache:
+    """Test UserCache class"""
+
+    def test_get_many(self):
+        """Test cached users are found and the rest reported missing"""
+        cache = UserCache()
+        cache.set_many([{'id': 'user_1', 'name': 'User 1'}], ['name'])
+
+        found, missing = cache.get_many(['user_1', 'user_2'], ['name'])
+
+        assert found == {'user_1': {'id': 'user_1', 'name': 'User 1'}}
+        assert missing == ['user_2']
+
+    def test_wider_fields_miss(self):
+        """Test a lookup needing fields that were not cached is a miss"""
+        cache = UserCache()
+        cache.set_many([{'id': 'user_1', 'name': 'User 1'}], ['name'])
+
+        assert cache.get_many(['user_1'], ['name', 'email'])[1] == ['user_1']
+        assert cache.get_many(['user_1'], None)[1] == ['user_1']
+
+    def test_invalidate_and_expiry(self):
+        """Test users drop out on invalidation and after the TTL"""
+        cache = UserCache(ttl=10)
+        cache.set_many([{'id': 'user_1'}, {'id': 'user_2'}])
+
+        cache.invalidate('user_1')
+        assert cache.get_many(['user_1'])[1] == ['user_1']
+
+        with patch('cache.time.monotonic', return_value=time.monotonic() + 11):
+            assert cache.get_many(['user_2'])[1] == ['user_2']
+
+    def test_lru_eviction(self):
+        """Test the cache stays within max_entries"""
+        cache = UserCache(max_entries=2)
+        cache.set_many([{'id': 'user_1'}, {'id': 'user_2'}, {'id': 'user_3'}])
+
+        assert cache.get_many(['user_1', 'user_2', 'user_3'])[1] == ['user_1']
+
+
+@pytest.mark.database
+class TestFormModelCaching:
+    """Test FormModel reads through the form cache"""
+
+    def test_get_form_by_name_cached(self, mock_mongo):
+        """Test profile reads are served from the cache"""
+        create_test_form(mock_mongo, FormFactory(name='test_form'))
+
+        FormModel.get_form_by_name('test_form', 'schema')
+        mock_mongo.forms.update_one({'name': 'test_form'}, {'$set': {'questions': []}})
+        form = FormModel.get_form_by_name('test_form', 'schema')
+
+        assert len(form['questions']) == 1
+        assert form_cache.stats()['hits'] == 1
+
+    def test_write_by_other_process_not_served(self, mock_mongo):
+        """Test forms changed without this process's invalidation are read again after the local TTL"""
+        create_test_form(mock_mongo, FormFactory(
+            name='test_form',
+            permissions={'admin': ['user_1'], 'editor': ['user_2'], 'viewer': []}
+        ))
+        FormModel.get_form_by_name('test_form', 'permissions')
+        
+        # Another worker revokes the editor
+        mock_mongo.forms.update_one({'name': 'test_form'}, {
+            '$set': {'permissions.editor': [], 'members': {'user_1': 'admin'}, 'updated_at': datetime(2030, 1, 1)}
+        })
+        
+        with patch('cache.time.monotonic', return_value=time.monotonic() + form_cache.local_ttl + 1):
+            form = FormModel.get_form_by_name('test_form', 'permissions')
+        assert form['permissions']['editor'] == []
+        assert FormModel.get_members(form) == {'user_1': 'admin'}
+    
+    def test_update_form_invalidates(self, mock_mongo):
+        """Test updates are visible on the next read"""
+        create_test_form(mock_mongo, FormFactory(name='test_form'))
+        FormModel.get_form_by_name('test_form', 'schema')
+
+        FormModel.update_form('test_form', {'questions': []})
+
+        assert FormModel.get_form_by_name('test_form', 'schema')['questions'] == []
+
+    def test_collaborator_changes_invalidate(self, mock_mongo):
+        """Test collaborator changes are visible on the next read"""
+        create_test_form(mock_mongo, FormFactory(
+            name='test_form',
+            permissions={'admin': ['user_1'], 'editor': [], 'viewer': []}
+        ))
+        FormModel.get_form_by_name('test_form', 'permissions')
+
+        FormModel.add_collaborator('test_form', 'user_2', 'editor')
+        assert FormModel.get_form_by_name('test_form', 'permissions')['permissions']['editor'] == ['user_2']
+
+        FormModel.remove_collaborator('test_form', 'user_2')
+        assert FormModel.get_form_by_name('test_form', 'permissions')['permissions']['editor'] == []
+
+    def test_counters_not_cached(self, mock_mongo):
+        """Test reads including submission counters skip the cache"""
+        create_test_form(mock_mongo, FormFactory(name='test_form'))
+        FormModel.get_form_by_name('test_form', 'meta')
+
+        FormModel.add_submission('test_form', {'id': 'sub_1', 'responses': {}})
+
+        assert FormModel.get_form_by_name('test_form', 'meta')['submission_count'] == 1
+
+    def test_metrics_endpoint(self, client, admin_session, mock_mongo):
+        """Test cache metrics are exposed to global admins"""
+        response = client.get('/api/metrics')
+
+        assert response.status_code == 200
+        assert 'hits' in json.loads(response.data)['form_cache']
@@ -199,35 +199,109 @@ class TestUserInvitation:
             
             assert response.status_code == 200
             response_data = json.loads(response.data)
-            assert '(email sent)' in response_data['message']
+            assert '(email queued)' in response_data['message']
             mock_send_email.assert_called_once()
 
 
+@pytest.mark.collaboration
+class TestBulkInvitation:
+    """Test bulk invitation functionality"""
+    
+    def test_bulk_invite(self, client, authenticated_session, mock_mongo):
+        """Test many users are invited with per-address results"""
+        create_test_form(mock_mongo, FormFactory(
+            name='test_form',
+            permissions={'admin': [authenticated_session['id']], 'editor': ['member_1'], 'viewer': []}
+        ))
+        create_test_user(mock_mongo, UserFactory(id='editor_1', email='editor@example.com'))
+        create_test_user(mock_mongo, UserFactory(id='viewer_1', email='viewer@example.com'))
+        create_test_user(mock_mongo, UserFactory(id='member_1', email='member@example.com'))
+        
+        invitation_data = {
+            'role': 'viewer',
+            'invites': [
+                {'email': 'Editor@example.com', 'role': 'editor'},
+                'viewer@example.com',
+                {'email': 'member@example.com'},
+                {'email': 'unknown@example.com'},
+                {'email': 'viewer@example.com', 'role': 'editor'},
+                {'email': 'bad-role@example.com', 'role': 'owner'}
+            ]
+        }
+        
+        with patch('app.send_invitation_email', return_value=True) as mock_send:
+            response = client.post('/api/form/test_form/invite/bulk',
+                                 data=json.dumps(invitation_data),
+                                 content_type='application/json')
+        
+        assert response.status_code == 200
+        response_data = json.loads(response.data)
+        assert response_data['invited'] == 2
+        assert [r['status'] for r in response_data['results']] == [
+            'invited', 'invited', 'already_member', 'not_found', 'duplicate', 'invalid'
+        ]
+        assert response_data['results'][0]['email_queued'] is True
+        assert mock_send.call_count == 2
+        
+        permissions = mock_mongo.forms.find_one({'name': 'test_form'})['permissions']
+        assert permissions['editor'] == ['member_1', 'editor_1']
+        assert permissions['viewer'] == ['viewer_1']
+    
+    def test_bulk_invite_non_admin(self, client, authenticated_session, mock_mongo):
+        """Test only form admins can bulk invite"""
+        create_test_form(mock_mongo, FormFactory(
+            name='test_form',
+            permissions={'admin': ['other_user'], 'editor': [authenticated_session['id']], 'viewer': []}
+        ))
+        
+        response = client.post('/api/form/test_form/invite/bulk',
+                             data=json.dumps({'invites': ['viewer@example.com']}),
+                             content_type='application/json')
+        
+        assert response.status_code == 403
+    
+    def test_bulk_invite_requires_invites(self, client, authenticated_session, mock_mongo):
+        """Test an empty or oversized invite list is rejected"""
+        create_test_form(mock_mongo, FormFactory(
+            name='test_form',
+            permissions={'admin': [authenticated_session['id']], 'editor': [], 'viewer': []}
+        ))
+        
+        response = client.post('/api/form/test_form/invite/bulk',
+                             data=json.dumps({'invites': []}),
+                             content_type='application/json')
+        assert response.status_code == 400
+        
+        with patch('app.MAX_BULK_INVITES', 1):
+            response = client.post('/api/form/test_form/invite/bulk',
+                                 data=json.dumps({'invites': ['a@example.com', 'b@example.com']}),
+                                 content_type='application/json')
+        assert response.status_code == 400
+
+
 @pytest.mark.collaboration
 class TestCollaboratorManagement:
     """Test collaborator management functionality"""
     
-    def test_get_collaborators_success(self, client, authenticated_session):
+    def test_get_collaborators_success(self, client, authenticated_session, mock_mongo):
         """Test successful collaborator retrieval"""
-        # Create users
-        admin_user = UserFactory(id='admin_123', name='Admin User', email='admin@example.com')
-        editor_user = UserFactory(id='editor_123', name='Editor User', email='editor@example.com')
-        viewer_user = UserFactory(id='viewer_123', name='Viewer User', email='viewer@example.com')
+        # Create users; the logged-in user is the form admin
+        admin_id = authenticated_session['id']
+        create_test_user(mock_mongo, dict(authenticated_session, name='Admin User', email='admin@example.com'))
+        create_test_user(mock_mongo, UserFactory(id='editor_123', name='Editor User', email='editor@example.com'))
+        create_test_user(mock_mongo, UserFactory(id='viewer_123', name='Viewer User', email='viewer@example.com'))
         
         form = FormFactory(
             name='test_form',
-            created_by='admin_123',
+            created_by=admin_id,
             permissions={
-                'admin': ['admin_123'], 
+                'admin': [admin_id], 
                 'editor': ['editor_123'], 
                 'viewer': ['viewer_123']
             }
         )
         
-        all_users = [admin_user, editor_user, viewer_user]
-        
-        with patch('models.FormModel.get_form_by_name', return_value=form), \
-             patch('models.UserModel.get_all_users', return_value=all_users):
+        with patch('models.FormModel.get_form_by_name', return_value=form):
             
             response = client.get('/api/form/test_form/collaborators')
             
@@ -252,6 +326,26 @@ class TestCollaboratorManagement:
             assert viewer_collab['name'] == 'Viewer User'
             assert viewer_collab['is_creator'] is False
     
+    def test_get_collaborators_looks_up_only_collaborators(self, client, authenticated_session, mock_mongo):
+        """Test collaborators are fetched by ID instead of loading every user"""
+        create_test_user(mock_mongo, authenticated_session)
+        create_test_user(mock_mongo, UserFactory(id='editor_123', name='Editor User'))
+        create_test_user(mock_mongo, UserFactory(id='unrelated_user'))
+        create_test_form(mock_mongo, FormFactory(
+            name='test_form',
+            created_by=authenticated_session['id'],
+            permissions={'admin': [authenticated_session['id']], 'editor': ['editor_123'], 'viewer': []}
+        ))
+        
+        with patch('models.UserModel.get_all_users') as mock_get_all_users:
+            response = client.get('/api/form/test_form/collaborators')
+        
+        assert response.status_code == 200
+        collaborators = json.loads(response.data)['collaborators']
+        assert [c['id'] for c in collaborators] == [authenticated_session['id'], 'editor_123']
+        assert collaborators[1]['name'] == 'Editor User'
+        mock_get_all_users.assert_not_called()
+    
     def test_get_collaborators_form_not_found(self, client, authenticated_session):
         """Test getting collaborators for non-existent form"""
         with patch('models.FormModel.get_form_by_name', return_value=None):
@@ -282,9 +376,7 @@ class TestCollaboratorManagement:
             permissions={'admin': ['other_user'], 'editor': [authenticated_session['id']], 'viewer': []}
         )
         
-        with patch('models.FormModel.get_form_by_name', return_value=form), \
-             patch('models.UserModel.get_all_users', return_value=[]):
-            
+        with patch('models.FormModel.get_form_by_name', return_value=form):
             response = client.get('/api/form/test_form/collaborators')
             
             assert response.status_code == 200
@@ -410,9 +502,8 @@ class TestPermissionLevels:
             assert response.status_code == 200
             
             # Admin can get collaborators
-            with patch('models.UserModel.get_all_users', return_value=[]):
-                response = client.get('/api/form/test_form/collaborators')
-                assert response.status_code == 200
+            response = client.get('/api/form/test_form/collaborators')
+            assert response.status_code == 200
     
     def test_editor_permissions(self, client, authenticated_session):
         """Test editor permissions for form management"""
@@ -431,9 +522,8 @@ class TestPermissionLevels:
             assert response.status_code == 200
             
             # Editor can get collaborators
-            with patch('models.UserModel.get_all_users', return_value=[]):
-                response = client.get('/api/form/test_form/collaborators')
-                assert response.status_code == 200
+            response = client.get('/api/form/test_form/collaborators')
+            assert response.status_code == 200
             
             # Editor cannot invite users (admin only)
             invitation_data = {'email': 'user@example.com', 'role': 'viewer'}
@@ -515,6 +605,34 @@ class TestEmailInvitations:
                 form_url='http://localhost/form/test_form'
             )
     
+    def test_email_invitation_queued(self, client, app, authenticated_session):
+        """Test the invitation email is queued instead of sent in the request"""
+        form = FormFactory(
+            name='test_form',
+            permissions={'admin': [authenticated_session['id']], 'editor': [], 'viewer': []}
+        )
+        
+        invited_user = UserFactory(id='invited_user', email='invited@example.com')
+        
+        with patch('models.FormModel.get_form_by_name', return_value=form), \
+             patch('models.UserModel.get_user_by_email', return_value=invited_user), \
+             patch('models.FormModel.add_collaborator', return_value=True), \
+             patch.dict(app.config, {'MAIL_USERNAME': 'sender@example.com'}), \
+             patch('app.mail_queue') as mock_queue:
+            
+            mock_queue.enqueue.return_value = True
+            
+            invitation_data = {'email': 'invited@example.com', 'role': 'editor'}
+            response = client.post('/api/form/test_form/invite',
+                                 data=json.dumps(invitation_data),
+                                 content_type='application/json')
+            
+            assert response.status_code == 200
+            assert '(email queued)' in json.loads(response.data)['message']
+            message = mock_queue.enqueue.call_args[0][0]
+            assert message.recipients == ['invited@example.com']
+            assert mock_queue.enqueue.call_args[1] == {'kind': 'invitation'}
+    
     def test_email_invitation_failed(self, client, authenticated_session):
         """Test email invitation when sending fails"""
         form = FormFactory(
@@ -0,0 +1,425 @@
+"""
+Live event tests for aForm application
+"""
+import pytest
+import json
+import threading
+from datetime import datetime
+from unittest.mock import patch, MagicMock
+
+from events import ChangeStreamListener, EventBroker, event_broker, format_sse
+from models import FormModel
+from tests.conftest import UserFactory, FormFactory, create_test_form, create_test_submission, log_in
+
+
+def read_events(iterator, count):
+    """Read the next count events from an event stream, skipping comments and the retry hint"""
+    events = []
+    while len(events) < count:
+        chunk = next(iterator)
+        if isinstance(chunk, bytes):
+            chunk = chunk.decode()
+        fields = dict(line.split(': ', 1) for line in chunk.strip().split('\n') if not line.startswith(':'))
+        if 'event' in fields:
+            events.append({
+                'type': fields['event'],
+                'id': fields.get('id'),
+                'data': json.loads(fields['data'])
+            })
+    return events
+
+
+@pytest.mark.unit
+class TestEventBroker:
+    """Test fan-out, buffering and presence of the event broker"""
+
+    def test_publish_reaches_channel_subscribers(self):
+        """Test events are delivered to every subscriber of their channel only"""
+        broker = EventBroker()
+        first = broker.subscribe('form:a')
+        second = broker.subscribe('form:a')
+        other = broker.subscribe('form:b')
+
+        broker.publish('form:a', 'change', {'version': 1}, event_id=1)
+
+        assert first.get(timeout=0) == {'type': 'change', 'data': {'version': 1}, 'id': 1}
+        assert second.get(timeout=0)['id'] == 1
+        assert other.get(timeout=0) is None
+        assert broker.stats()['delivered'] == 2
+
+    def test_slow_subscriber_overflows(self):
+        """Test a full buffer marks the subscriber overflowed instead of blocking"""
+        broker = EventBroker(buffer_size=2)
+        subscription = broker.subscribe('form:a')
+
+        for version in range(3):
+            broker.publish('form:a', 'change', {}, event_id=version)
+
+        assert subscription.overflowed
+        assert broker.stats()['overflows'] == 1
+
+    def test_unsubscribe_drops_empty_channel(self):
+        """Test channels without subscribers are forgotten"""
+        broker = EventBroker()
+        subscription = broker.subscribe('form:a')
+
+        broker.unsubscribe(subscription)
+
+        assert broker.stats()['channels'] == 0
+
+    def test_presence_joins_and_leaves(self):
+        """Test heartbeats only notify subscribers when someone joins or leaves"""
+        broker = EventBroker()
+        subscription = broker.subscribe('form:a')
+        member = {'id': 'user_1', 'name': 'Ann'}
+
+        broker.heartbeat('form:a', 'tab_1', member)
+        broker.heartbeat('form:a', 'tab_1', member)
+
+        assert broker.presence('form:a') == [{'id': 'user_1', 'name': 'Ann', 'client': 'tab_1'}]
+        assert subscription.get(timeout=0)['data']['state'] == 'here'
+        assert subscription.get(timeout=0) is None
+
+        broker.leave('form:a', 'tab_1')
+
+        assert broker.presence('form:a') == []
+        assert subscription.get(timeout=0)['data']['state'] == 'left'
+
+    def test_presence_expires_without_heartbeat(self):
+        """Test members whose heartbeats stop are dropped"""
+        broker = EventBroker(presence_ttl=0)
+
+        broker.heartbeat('form:a', 'tab_1', {'id': 'user_1', 'name': 'Ann'})
+
+        assert broker.presence('form:a') == []
+
+    def test_relay_failure_delivers_locally(self):
+        """Test events are still delivered in-process when the relay fails"""
+        broker = EventBroker()
+        relay = MagicMock()
+        relay.publish.side_effect = ConnectionError('redis down')
+        broker.use_relay(relay)
+        subscription = broker.subscribe('form:a')
+
+        broker.publish('form:a', 'resync', {})
+
+        relay.start.assert_called_once_with(broker)
+        assert subscription.get(timeout=0)['type'] == 'resync'
+        assert broker.stats()['relay_errors'] == 1
+
+    def test_format_sse(self):
+        """Test events are encoded in the text/event-stream format"""
+        assert format_sse('change', {'version': 2}, 2) == 'id: 2\nevent: change\ndata: {"version": 2}\n\n'
+
+
+@pytest.mark.api
+class TestFormBuilderEvents:
+    """Test the form builder's live event stream"""
+
+    @pytest.fixture
+    def editable_form(self, mock_mongo, authenticated_session):
+        return create_test_form(mock_mongo, FormFactory(
+            name='test_form',
+            permissions={'admin': [authenticated_session['id']], 'editor': [], 'viewer': []},
+            questions=[{'id': 'q_1', 'title': 'Question 1', 'type': 'text'}]
+        ))
+
+    def open_stream(self, client, url='/api/form/test_form/events', **kwargs):
+        response = client.get(url, buffered=False, **kwargs)
+        assert response.status_code == 200
+        assert response.mimetype == 'text/event-stream'
+        return response, iter(response.response)
+
+    def test_requires_edit_permission(self, client, mock_mongo):
+        """Test viewers can't follow the form builder"""
+        user = log_in(client, UserFactory())
+        create_test_form(mock_mongo, FormFactory(
+            name='test_form',
+            permissions={'admin': [], 'editor': [], 'viewer': [user['id']]}
+        ))
+
+        assert client.get('/api/form/test_form/events').status_code == 403
+        assert client.get('/api/form/missing/events').status_code == 404
+
+    def test_replays_changes_since_version(self, client, mock_mongo, editable_form, authenticated_session):
+        """Test reconnecting clients get the changes they missed, then presence"""
+        FormModel.patch_questions('test_form', 0, [
+            {'op': 'update', 'id': 'q_1', 'fields': {'title': 'Name'}},
+            {'op': 'delete', 'id': 'q_1'}
+        ], {'id': 'user_2', 'name': 'Bob', 'client': 'tab_2'})
+        FormModel.patch_questions('test_form', 1, [{'op': 'add', 'question': {'id': 'q_2', 'title': 'Email'}}])
+
+        response, stream = self.open_stream(client, '/api/form/test_form/events?since=0')
+        events = read_events(stream, 3)
+        response.close()
+
+        assert [(event['type'], event['id']) for event in events] == [('change', '1'), ('change', '2'), ('presence', None)]
+        assert events[0]['data']['ops'] == [
+            {'op': 'update', 'id': 'q_1', 'fields': {'title': 'Name'}},
+            {'op': 'delete', 'id': 'q_1'}
+        ]
+        assert events[0]['data']['author']['name'] == 'Bob'
+        assert events[2]['data']['members'][0]['id'] == authenticated_session['id']
+
+    def test_last_event_id_resumes_stream(self, client, mock_mongo, editable_form):
+        """Test the browser's Last-Event-ID takes precedence over ?since"""
+        FormModel.patch_questions('test_form', 0, [{'op': 'update', 'id': 'q_1', 'fields': {'title': 'Name'}}])
+        FormModel.patch_questions('test_form', 1, [{'op': 'delete', 'id': 'q_1'}])
+
+        response, stream = self.open_stream(client, '/api/form/test_form/events?since=0',
+                                            headers={'Last-Event-ID': '1'})
+        events = read_events(stream, 2)
+        response.close()
+
+        assert [(event['type'], event['id']) for event in events] == [('change', '2'), ('presence', None)]
+
+    def test_snapshot_after_full_save(self, client, mock_mongo, editable_form):
+        """Test a snapshot is sent when the change log can't cover the gap"""
+        FormModel.update_form('test_form', {'questions': [{'id': 'q_9', 'title': 'Replaced', 'type': 'text'}]})
+
+        response, stream = self.open_stream(client, '/api/form/test_form/events?since=0')
+        events = read_events(stream, 1)
+        response.close()
+
+        assert events[0]['type'] == 'snapshot'
+        assert events[0]['data']['version'] == 1
+        assert events[0]['data']['questions'][0]['id'] == 'q_9'
+
+    def test_streams_live_changes(self, client, mock_mongo, editable_form):
+        """Test saves by other editors are pushed with their author"""
+        response, stream = self.open_stream(client, '/api/form/test_form/events?client=tab_1')
+        assert read_events(stream, 1)[0]['type'] == 'presence'
+
+        FormModel.patch_questions('test_form', 0, [{'op': 'delete', 'id': 'q_1'}],
+                                  {'id': 'user_2', 'name': 'Bob', 'client': 'tab_2'})
+        # Our own join is echoed first
+        events = read_events(stream, 2)
+        response.close()
+
+        assert [event['type'] for event in events] == ['presence', 'change']
+        assert events[1]['id'] == '1'
+        assert events[1]['data'] == {
+            'version': 1,
+            'ops': [{'op': 'delete', 'id': 'q_1'}],
+            'author': {'id': 'user_2', 'name': 'Bob', 'client': 'tab_2'}
+        }
+
+    def test_patch_records_client_id(self, client, mock_mongo, editable_form, authenticated_session):
+        """Test builder saves are attributed to the saving user and tab"""
+        response = client.patch('/api/form/test_form/questions',
+                                data=json.dumps({'version': 0, 'ops': [{'op': 'delete', 'id': 'q_1'}]}),
+                                content_type='application/json',
+                                headers={'X-Client-Id': 'tab_1'})
+
+        assert response.status_code == 200
+        entry = mock_mongo.form_changes.find_one({'version': 1})
+        assert entry['author'] == {'id': authenticated_session['id'], 'name': authenticated_session['name'], 'client': 'tab_1'}
+
+    def test_closing_stream_leaves_channel(self, client, mock_mongo, editable_form):
+        """Test disconnected editors are unsubscribed and no longer present"""
+        response, stream = self.open_stream(client, '/api/form/test_form/events?client=tab_1')
+        read_events(stream, 1)
+        assert event_broker.stats()['subscribers'] == 1
+
+        response.close()
+
+        assert event_broker.stats()['subscribers'] == 0
+        assert event_broker.presence(FormModel.channel('test_form')) == []
+
+    def test_overflow_asks_client_to_resync(self, client, mock_mongo, editable_form):
+        """Test clients that fall too far behind are told to resync"""
+        response, stream = self.open_stream(client, '/api/form/test_form/events?client=tab_1')
+        read_events(stream, 1)
+
+        channel = FormModel.channel('test_form')
+        for version in range(event_broker.buffer_size + 1):
+            event_broker.publish(channel, 'change', {'version': version}, event_id=version)
+
+        events = read_events(stream, 1)
+        remaining = list(stream)
+        response.close()
+
+        assert events[0]['type'] == 'resync'
+        assert remaining == []
+
+
+class FakeChangeStream:
+    """Change stream yielding prepared changes, then failing like a dropped connection"""
+
+    def __init__(self, changes):
+        self.changes = changes
+        self.resume_token = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def __iter__(self):
+        for index, change in enumerate(self.changes):
+            self.resume_token = {'_data': str(index)}
+            yield change
+        raise ConnectionError('stream dropped')
+
+
+@pytest.mark.unit
+class TestChangeStreamListener:
+    """Test change streams are turned into local events"""
+
+    def test_changes_dispatched_and_stream_resumed(self):
+        """Test changes reach subscribers and an interrupted stream resumes after the last one"""
+        reopened = threading.Event()
+        streams = [FakeChangeStream([{'operationType': 'insert', 'n': 1}, {'operationType': 'update'}])]
+
+        def watch(pipeline, resume_after=None):
+            if not streams:
+                listener.stop()
+                reopened.set()
+                return FakeChangeStream([])
+            return streams.pop()
+
+        collection = MagicMock()
+        collection.watch.side_effect = watch
+
+        def to_event(change):
+            if change['operationType'] != 'insert':
+                return None
+            return 'form:a', 'submission', {'n': change['n']}, 'cursor_1'
+
+        broker = EventBroker()
+        subscription = broker.subscribe('form:a')
+        listener = ChangeStreamListener(collection, to_event, retry_delay=0)
+        broker.watch('submissions', listener)
+
+        assert subscription.get(timeout=5) == {'type': 'submission', 'data': {'n': 1}, 'id': 'cursor_1'}
+        assert reopened.wait(timeout=5)
+
+        assert broker.watches('submissions')
+        assert collection.watch.call_args_list[1][1]['resume_after'] == {'_data': '1'}
+        assert subscription.get(timeout=0) is None
+
+
+@pytest.mark.api
+class TestSubmissionFeed:
+    """Test the submissions dashboard's live feed"""
+
+    @pytest.fixture
+    def published_form(self, mock_mongo, authenticated_session):
+        return create_test_form(mock_mongo, FormFactory(
+            name='test_form',
+            status='published',
+            permissions={'admin': [authenticated_session['id']], 'editor': [], 'viewer': []},
+            questions=[{'id': 'q_1', 'title': 'Name', 'type': 'text', 'required': False}]
+        ))
+
+    def open_feed(self, client, url='/api/form/test_form/submissions/events', **kwargs):
+        response = client.get(url, buffered=False, **kwargs)
+        assert response.status_code == 200
+        assert response.mimetype == 'text/event-stream'
+        stream = iter(response.response)
+        assert next(stream).startswith(b'retry:')
+        return response, stream
+
+    def test_requires_view_permission(self, client, mock_mongo):
+        """Test only collaborators can follow the feed"""
+        log_in(client, UserFactory())
+        create_test_form(mock_mongo, FormFactory(
+            name='test_form',
+            permissions={'admin': [], 'editor': [], 'viewer': []}
+        ))
+
+        assert client.get('/api/form/test_form/submissions/events').status_code == 403
+        assert client.get('/api/form/missing/submissions/events').status_code == 404
+
+    def test_new_submission_streamed(self, client, mock_mongo, published_form):
+        """Test submissions are pushed as they are stored"""
+        response, stream = self.open_feed(client)
+
+        submitted = client.post('/api/form/test_form/submit',
+                                data=json.dumps({'responses': {'q_1': 'Ann'}}),
+                                content_type='application/json')
+        assert submitted.status_code == 200
+        events = read_events(stream, 1)
+        response.close()
+
+        assert events[0]['type'] == 'submission'
+        assert events[0]['data']['id'] == submitted.get_json()['submission_id']
+        assert events[0]['data']['responses'] == {'q_1': 'Ann'}
+        assert events[0]['id']
+
+    def test_batched_submissions_streamed(self, client, mock_mongo, published_form):
+        """Test submissions stored in batches by the ingestion queue are pushed too"""
+        response, stream = self.open_feed(client)
+
+        submissions = [
+            {'id': f'sub_{index}', 'form_id': str(published_form['_id']), 'submitted_at': datetime(2024, 1, 1, 12, index),
+             'responses': {'q_1': str(index)}}
+            for index in range(2)
+        ]
+        FormModel.insert_submissions(submissions)
+        events = read_events(stream, 2)
+        response.close()
+
+        assert [event['data']['id'] for event in events] == ['sub_0', 'sub_1']
+        assert event_broker.stats()['published'] == 2
+
+    def test_deletion_streamed(self, client, mock_mongo, published_form):
+        """Test deleted submissions are pushed so dashboards drop them"""
+        create_test_submission(mock_mongo, published_form, {'id': 'sub_1', 'responses': {}})
+        response, stream = self.open_feed(client)
+
+        assert client.delete('/api/form/test_form/submission/sub_1/delete').status_code == 200
+        events = read_events(stream, 1)
+        response.close()
+
+        assert events[0] == {'type': 'deleted', 'id': None, 'data': {'id': 'sub_1'}}
+
+    def test_resumes_after_last_event(self, client, mock_mongo, published_form):
+        """Test reconnecting dashboards get the submissions they missed"""
+        for index in range(3):
+            create_test_submission(mock_mongo, published_form, {
+                'id': f'sub_{index}', 'submitted_at': datetime(2024, 1, 1, 12, index), 'responses': {}
+            })
+        _, _, _, last_seen = FormModel.submission_event(mock_mongo.submissions.find_one({'id': 'sub_0'}))
+
+        response, stream = self.open_feed(client, headers={'Last-Event-ID': last_seen})
+        events = read_events(stream, 2)
+        response.close()
+
+        assert [event['data']['id'] for event in events] == ['sub_1', 'sub_2']
+        assert events[1]['id'] == FormModel.submission_event(mock_mongo.submissions.find_one({'id': 'sub_2'}))[3]
+
+    def test_resync_when_too_many_missed(self, client, mock_mongo, published_form):
+        """Test dashboards that missed more than a page are told to reload"""
+        for index in range(3):
+            create_test_submission(mock_mongo, published_form, {
+                'id': f'sub_{index}', 'submitted_at': datetime(2024, 1, 1, 12, index), 'responses': {}
+            })
+        _, _, _, last_seen = FormModel.submission_event(mock_mongo.submissions.find_one({'id': 'sub_0'}))
+
+        with patch.object(FormModel.get_submission_events, '__defaults__', (1,)):
+            response, stream = self.open_feed(client, f'/api/form/test_form/submissions/events?after={last_seen}')
+            events = read_events(stream, 1)
+        response.close()
+
+        assert events[0]['type'] == 'resync'
+
+    def test_invalid_cursor_rejected(self, client, mock_mongo, published_form):
+        """Test malformed resume positions are rejected"""
+        response = client.get('/api/form/test_form/submissions/events?after=not-a-cursor')
+
+        assert response.status_code == 400
+
+    def test_change_stream_replaces_publishing(self, client, mock_mongo, published_form):
+        """Test writers leave new submissions to the change stream when one is followed"""
+        with patch.object(event_broker, 'sources', {'submissions'}):
+            assert FormModel.add_submission('test_form', {'id': 'sub_1', 'responses': {}})
+
+        assert event_broker.stats()['published'] == 0
+
+        doc = mock_mongo.submissions.find_one({'id': 'sub_1'})
+        channel, event_type, data, _ = FormModel.submission_change_event({'operationType': 'insert', 'fullDocument': doc})
+        assert channel == FormModel.submissions_channel(str(published_form['_id']))
+        assert (event_type, data['id']) == ('submission', 'sub_1')
+        assert FormModel.submission_change_event({'operationType': 'delete', 'documentKey': {'_id': doc['_id']}}) is None
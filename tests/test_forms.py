@@ -4,9 +4,9 @@ Form management tests for aForm application
 import pytest
 import json
 from unittest.mock import patch, MagicMock
-from datetime import datetime
+from datetime import datetime, timezone
 
-from tests.conftest import UserFactory, FormFactory, create_test_user, create_test_form, authenticate_user
+from tests.conftest import UserFactory, FormFactory, create_test_user, create_test_form, create_test_submission, authenticate_user
 
 
 @pytest.mark.forms
@@ -201,7 +201,7 @@ class TestQuestionManagement:
         )
         
         with patch('models.FormModel.get_form_by_name', return_value=form), \
-             patch('models.FormModel.update_form') as mock_update:
+             patch('models.FormModel.patch_questions', return_value=1) as mock_patch:
             
             response = client.post('/api/form/test_form/question')
             
@@ -210,7 +210,25 @@ class TestQuestionManagement:
             assert 'question' in response_data
             assert response_data['question']['id'] == 'q_2'
             assert response_data['question']['title'] == 'Question 2'
-            mock_update.assert_called_once()
+            assert response_data['version'] == 1
+            mock_patch.assert_called_once_with('test_form', 0, [{'op': 'add', 'question': response_data['question']}],
+                                               {'id': authenticated_session['id'], 'name': authenticated_session['name'], 'client': None})
+    
+    def test_add_question_skips_taken_ids(self, client, mock_mongo, authenticated_session):
+        """Test new question IDs don't collide with questions left after a delete"""
+        create_test_form(mock_mongo, FormFactory(
+            name='test_form',
+            permissions={'admin': [authenticated_session['id']], 'editor': [], 'viewer': []},
+            questions=[{'id': 'q_2', 'title': 'Question 2', 'type': 'text'}]
+        ))
+        
+        response = client.post('/api/form/test_form/question')
+        
+        assert response.status_code == 200
+        assert response.get_json()['question']['id'] == 'q_3'
+        stored = mock_mongo.forms.find_one({'name': 'test_form'})
+        assert [q['id'] for q in stored['questions']] == ['q_2', 'q_3']
+        assert stored['schema_version'] == 1
     
     def test_add_question_not_found(self, client, authenticated_session):
         """Test adding question to non-existent form"""
@@ -232,6 +250,102 @@ class TestQuestionManagement:
             assert response.status_code == 403
 
 
+@pytest.mark.forms
+class TestQuestionPatching:
+    """Test incremental saves of question edits"""
+    
+    @pytest.fixture
+    def editable_form(self, mock_mongo, authenticated_session):
+        return create_test_form(mock_mongo, FormFactory(
+            name='test_form',
+            permissions={'admin': [authenticated_session['id']], 'editor': [], 'viewer': []},
+            questions=[
+                {'id': 'q_1', 'title': 'Question 1', 'type': 'text', 'required': False},
+                {'id': 'q_2', 'title': 'Question 2', 'type': 'radio', 'options': ['A', 'B']}
+            ]
+        ))
+    
+    def patch_questions(self, client, version, ops):
+        return client.patch('/api/form/test_form/questions',
+                          data=json.dumps({'version': version, 'ops': ops}),
+                          content_type='application/json')
+    
+    def test_patch_applies_operations(self, client, mock_mongo, editable_form):
+        """Test add, update, move and delete operations are applied in order"""
+        response = self.patch_questions(client, 0, [
+            {'op': 'update', 'id': 'q_1', 'fields': {'title': 'Name', 'required': True}},
+            {'op': 'update', 'id': 'q_2', 'remove': ['options']},
+            {'op': 'add', 'question': {'id': 'q_3', 'title': 'Email', 'type': 'email'}, 'index': 0},
+            {'op': 'move', 'id': 'q_2', 'index': 0},
+            {'op': 'delete', 'id': 'q_1'}
+        ])
+        
+        assert response.status_code == 200
+        version = response.get_json()['version']
+        stored = mock_mongo.forms.find_one({'name': 'test_form'})
+        assert stored['schema_version'] == version
+        assert stored['questions'] == [
+            {'id': 'q_2', 'title': 'Question 2', 'type': 'radio'},
+            {'id': 'q_3', 'title': 'Email', 'type': 'email'}
+        ]
+    
+    def test_stale_version_conflicts(self, client, mock_mongo, editable_form):
+        """Test edits based on an outdated version are rejected with 409"""
+        assert self.patch_questions(client, 0, [{'op': 'delete', 'id': 'q_2'}]).status_code == 200
+        
+        response = self.patch_questions(client, 0, [{'op': 'update', 'id': 'q_1', 'fields': {'title': 'Stale'}}])
+        
+        assert response.status_code == 409
+        assert response.get_json()['version'] == 1
+        assert response.get_json()['changes'] == [{'op': 'delete', 'id': 'q_2'}]
+        assert mock_mongo.forms.find_one({'name': 'test_form'})['questions'][0]['title'] == 'Question 1'
+    
+    def test_full_save_with_version(self, client, mock_mongo, editable_form):
+        """Test full saves naming their version don't overwrite newer changes"""
+        questions = [{'id': 'q_1', 'title': 'Only question', 'type': 'text'}]
+        
+        response = client.post('/api/form/test_form/save',
+                             data=json.dumps({'questions': questions, 'version': 0}),
+                             content_type='application/json')
+        assert response.status_code == 200
+        assert response.get_json()['version'] == 1
+        
+        response = client.post('/api/form/test_form/save',
+                             data=json.dumps({'questions': [], 'version': 0}),
+                             content_type='application/json')
+        assert response.status_code == 409
+        # Full saves aren't in the change log, so the current questions are sent instead
+        assert response.get_json()['version'] == 1
+        assert response.get_json()['questions'] == questions
+        assert mock_mongo.forms.find_one({'name': 'test_form'})['questions'] == questions
+    
+    @pytest.mark.parametrize('ops', [
+        [],
+        [{'op': 'replace', 'id': 'q_1'}],
+        [{'op': 'update', 'id': 'q_1', 'fields': {'id': 'q_9'}}],
+        [{'op': 'update', 'id': 'q_1', 'fields': {'a.b': 1}}],
+        [{'op': 'move', 'id': 'q_1'}],
+        [{'op': 'add', 'question': {'id': 'q_1'}}],
+        [{'op': 'delete', 'id': 'q_404'}]
+    ])
+    def test_invalid_operations_rejected(self, client, mock_mongo, editable_form, ops):
+        """Test malformed, duplicate and dangling operations are rejected"""
+        response = self.patch_questions(client, 0, ops)
+        
+        assert response.status_code == 400
+        assert mock_mongo.forms.find_one({'name': 'test_form'}).get('schema_version', 0) == 0
+    
+    def test_patch_no_permission(self, client, mock_mongo, authenticated_session):
+        """Test users who can't edit the form can't patch it"""
+        create_test_form(mock_mongo, FormFactory(
+            name='test_form', permissions={'admin': ['other_user'], 'editor': [], 'viewer': [authenticated_session['id']]}
+        ))
+        
+        response = self.patch_questions(client, 0, [{'op': 'delete', 'id': 'q_1'}])
+        
+        assert response.status_code == 403
+
+
 @pytest.mark.forms
 class TestFormPublishing:
     """Test form publishing functionality"""
@@ -406,20 +520,15 @@ class TestSubmissionViewing:
         form = FormFactory(
             name='test_form',
             permissions={'admin': [authenticated_session['id']], 'editor': [], 'viewer': []},
-            submissions=[
-                {
-                    'id': 'sub_1',
-                    'submitted_at': datetime.now(),
-                    'responses': {'q_1': 'Response 1'}
-                }
-            ]
+            submission_count=1
         )
         
         with patch('models.FormModel.get_form_by_name', return_value=form):
             response = client.get('/form/test_form/submissions')
             
             assert response.status_code == 200
-            assert b'submissions' in response.data.lower()
+            assert b'1 submission' in response.data
+            assert b'submissionsSentinel' in response.data
     
     def test_view_submissions_not_found(self, client, authenticated_session):
         """Test viewing submissions for non-existent form"""
@@ -453,23 +562,252 @@ class TestSubmissionViewing:
             assert response.status_code == 200
 
 
+@pytest.mark.forms
+class TestSubmissionsAPI:
+    """Test paginated submissions API"""
+    
+    def _create_form_with_submissions(self, mock_mongo, user_id, count):
+        form = create_test_form(mock_mongo, FormFactory(
+            name='test_form',
+            permissions={'admin': [user_id], 'editor': [], 'viewer': []},
+            questions=[{'id': 'q_1', 'title': 'Color', 'type': 'radio', 'required': False}]
+        ))
+        for i in range(count):
+            create_test_submission(mock_mongo, form, {
+                'id': f'sub_{i}',
+                'submitted_at': datetime(2024, 1, 1, 12, 0, i),
+                'responses': {'q_1': 'Red' if i % 2 == 0 else 'Blue'}
+            })
+        return form
+    
+    def test_get_submissions_paginated(self, client, authenticated_session, mock_mongo):
+        """Test walking through all pages with the cursor"""
+        self._create_form_with_submissions(mock_mongo, authenticated_session['id'], 5)
+        
+        response = client.get('/api/form/test_form/submissions?limit=2')
+        data = json.loads(response.data)
+        
+        assert response.status_code == 200
+        assert [s['id'] for s in data['submissions']] == ['sub_4', 'sub_3']
+        
+        seen = [s['id'] for s in data['submissions']]
+        while data['next_cursor']:
+            response = client.get(f"/api/form/test_form/submissions?limit=2&cursor={data['next_cursor']}")
+            data = json.loads(response.data)
+            seen.extend(s['id'] for s in data['submissions'])
+        
+        assert seen == ['sub_4', 'sub_3', 'sub_2', 'sub_1', 'sub_0']
+    
+    def test_get_submissions_sort_and_filter(self, client, authenticated_session, mock_mongo):
+        """Test ascending sort with a per-question filter"""
+        self._create_form_with_submissions(mock_mongo, authenticated_session['id'], 5)
+        
+        response = client.get('/api/form/test_form/submissions?sort=asc&filter.q_1=Red&fields=q_1')
+        data = json.loads(response.data)
+        
+        assert response.status_code == 200
+        assert [s['id'] for s in data['submissions']] == ['sub_0', 'sub_2', 'sub_4']
+        assert data['submissions'][0]['responses'] == {'q_1': 'Red'}
+        assert data['next_cursor'] is None
+    
+    def test_get_submissions_filter_number(self, client, authenticated_session, mock_mongo):
+        """Test number filters match answers stored as numbers and as text"""
+        form = create_test_form(mock_mongo, FormFactory(
+            name='test_form',
+            status='published',
+            permissions={'admin': [authenticated_session['id']], 'editor': [], 'viewer': []},
+            questions=[{'id': 'q_1', 'title': 'Age', 'type': 'number', 'required': False}]
+        ))
+        create_test_submission(mock_mongo, form, {'id': 'sub_text', 'responses': {'q_1': '30'}})
+        assert client.post('/api/form/test_form/submit', data=json.dumps({'responses': {'q_1': '30'}}),
+                           content_type='application/json').status_code == 200
+        create_test_submission(mock_mongo, form, {'id': 'sub_other', 'responses': {'q_1': 31}})
+        
+        response = client.get('/api/form/test_form/submissions?filter.q_1=30')
+        data = json.loads(response.data)
+        
+        assert response.status_code == 200
+        assert len(data['submissions']) == 2
+        assert 'sub_text' in [s['id'] for s in data['submissions']]
+        assert all(s['id'] != 'sub_other' for s in data['submissions'])
+
+    def test_get_submissions_unknown_question(self, client, authenticated_session, mock_mongo):
+        """Test filtering on a question the form does not have"""
+        self._create_form_with_submissions(mock_mongo, authenticated_session['id'], 1)
+        
+        response = client.get('/api/form/test_form/submissions?filter.q_9=Red')
+        
+        assert response.status_code == 400
+    
+    def test_get_submissions_invalid_cursor(self, client, authenticated_session, mock_mongo):
+        """Test paginating with a malformed cursor"""
+        self._create_form_with_submissions(mock_mongo, authenticated_session['id'], 1)
+        
+        response = client.get('/api/form/test_form/submissions?cursor=not-a-cursor')
+        
+        assert response.status_code == 400
+    
+    def test_get_submissions_no_permission(self, client, authenticated_session, mock_mongo):
+        """Test submissions API without permission"""
+        self._create_form_with_submissions(mock_mongo, 'other_user', 1)
+        
+        response = client.get('/api/form/test_form/submissions')
+        
+        assert response.status_code == 403
+
+
+@pytest.mark.forms
+class TestSubmissionExport:
+    """Test streaming submission export"""
+    
+    def _create_form_with_submissions(self, mock_mongo, user_id):
+        form = create_test_form(mock_mongo, FormFactory(
+            name='test_form',
+            permissions={'admin': [user_id], 'editor': [], 'viewer': []},
+            questions=[
+                {'id': 'q_1', 'title': 'Colors', 'type': 'checkbox', 'required': False},
+                {'id': 'q_2', 'title': 'Score', 'type': 'rating', 'required': False},
+                {'id': 'q_3', 'title': 'Upload', 'type': 'file', 'required': False}
+            ]
+        ))
+        create_test_submission(mock_mongo, form, {
+            'id': 'sub_1',
+            'submitted_at': datetime(2024, 1, 1, 9, 0),
+            'responses': {
+                'q_1': ['Red', 'Blue'],
+                'q_2': '4',
+                'q_3': [{'name': 'cv.pdf', 'size': 1024, 'type': 'application/pdf'}]
+            }
+        })
+        create_test_submission(mock_mongo, form, {
+            'id': 'sub_2',
+            'submitted_at': datetime(2024, 1, 2, 9, 0),
+            'responses': {'q_1': [], 'q_2': '', 'q_3': []}
+        })
+        return form
+    
+    def test_export_csv(self, client, authenticated_session, mock_mongo):
+        """Test CSV export flattens answers per question type"""
+        self._create_form_with_submissions(mock_mongo, authenticated_session['id'])
+        
+        response = client.get('/api/form/test_form/export?format=csv')
+        
+        assert response.status_code == 200
+        assert response.mimetype == 'text/csv'
+        assert 'attachment' in response.headers['Content-Disposition']
+        lines = response.data.decode().splitlines()
+        assert lines[0] == 'Submission ID,Submitted At,Colors,Score,Upload'
+        assert lines[1] == 'sub_1,2024-01-01T09:00:00,Red; Blue,4,cv.pdf (1024 bytes)'
+        assert len(lines) == 3
+    
+    def test_export_escapes_formulas(self, client, authenticated_session, mock_mongo):
+        """Test answers that spreadsheets would run as formulas are exported as text"""
+        form = self._create_form_with_submissions(mock_mongo, authenticated_session['id'])
+        create_test_submission(mock_mongo, form, {
+            'id': 'sub_3',
+            'submitted_at': datetime(2024, 1, 3, 9, 0),
+            'responses': {'q_1': ['=HYPERLINK("http://evil.example")'], 'q_2': '-2+3', 'q_3': []}
+        })
+        
+        response = client.get('/api/form/test_form/export?format=csv')
+        
+        lines = response.data.decode().splitlines()
+        assert lines[3] == 'sub_3,2024-01-03T09:00:00,"\'=HYPERLINK(""http://evil.example"")",\'-2+3,'
+    
+    def test_export_ndjson_since(self, client, authenticated_session, mock_mongo):
+        """Test NDJSON export only includes rows after since"""
+        self._create_form_with_submissions(mock_mongo, authenticated_session['id'])
+        
+        response = client.get('/api/form/test_form/export?format=ndjson&since=2024-01-01T09:00:00')
+        
+        assert response.status_code == 200
+        rows = [json.loads(line) for line in response.data.decode().splitlines()]
+        assert [row['id'] for row in rows] == ['sub_2']
+    
+    def test_export_resumes_from_cursor(self, client, authenticated_session, mock_mongo):
+        """Test exports return a cursor the next export resumes from, short of recent rows"""
+        form = self._create_form_with_submissions(mock_mongo, authenticated_session['id'])
+        
+        first = client.get('/api/form/test_form/export?format=ndjson')
+        cursor = first.headers['X-Export-Cursor']
+        create_test_submission(mock_mongo, form, {
+            'id': 'sub_3', 'submitted_at': datetime(2024, 1, 2, 9, 0), 'responses': {}
+        })
+        create_test_submission(mock_mongo, form, {
+            'id': 'sub_4', 'submitted_at': datetime.now(), 'responses': {}
+        })
+        second = client.get(f'/api/form/test_form/export?format=ndjson&after={cursor}')
+        
+        rows = [json.loads(line) for line in second.data.decode().splitlines()]
+        assert [row['id'] for row in rows] == ['sub_3', 'sub_4']
+        # sub_4 could still be joined by submissions stored late, so the next export repeats it
+        third = client.get(f"/api/form/test_form/export?format=ndjson&after={second.headers['X-Export-Cursor']}")
+        assert [json.loads(line)['id'] for line in third.data.decode().splitlines()] == ['sub_4']
+    
+    def test_export_since_with_offset(self, client, authenticated_session, mock_mongo):
+        """Test since timestamps with an offset are compared in local time"""
+        self._create_form_with_submissions(mock_mongo, authenticated_session['id'])
+        since = datetime(2024, 1, 1, 9, 0).astimezone().astimezone(timezone.utc)
+        
+        response = client.get(f"/api/form/test_form/export?format=ndjson&since={since.strftime('%Y-%m-%dT%H:%M:%SZ')}")
+        
+        assert response.status_code == 200
+        assert [json.loads(line)['id'] for line in response.data.decode().splitlines()] == ['sub_2']
+    
+    def test_export_invalid_cursor(self, client, authenticated_session, mock_mongo):
+        """Test export with a malformed cursor"""
+        self._create_form_with_submissions(mock_mongo, authenticated_session['id'])
+        
+        response = client.get('/api/form/test_form/export?after=garbage')
+        
+        assert response.status_code == 400
+    
+    def test_export_xlsx(self, client, authenticated_session, mock_mongo):
+        """Test XLSX export produces a workbook"""
+        pytest.importorskip('openpyxl')
+        self._create_form_with_submissions(mock_mongo, authenticated_session['id'])
+        
+        response = client.get('/api/form/test_form/export?format=xlsx')
+        
+        assert response.status_code == 200
+        assert response.data[:2] == b'PK'  # XLSX files are zip archives
+    
+    def test_export_invalid_format(self, client, authenticated_session, mock_mongo):
+        """Test export with an unsupported format"""
+        self._create_form_with_submissions(mock_mongo, authenticated_session['id'])
+        
+        response = client.get('/api/form/test_form/export?format=pdf')
+        
+        assert response.status_code == 400
+    
+    def test_export_invalid_since(self, client, authenticated_session, mock_mongo):
+        """Test export with a malformed since timestamp"""
+        self._create_form_with_submissions(mock_mongo, authenticated_session['id'])
+        
+        response = client.get('/api/form/test_form/export?since=yesterday')
+        
+        assert response.status_code == 400
+    
+    def test_export_no_permission(self, client, authenticated_session, mock_mongo):
+        """Test export without form permission"""
+        self._create_form_with_submissions(mock_mongo, 'other_user')
+        
+        response = client.get('/api/form/test_form/export')
+        
+        assert response.status_code == 403
+
+
 @pytest.mark.forms
 class TestSubmissionDeletion:
     """Test submission deletion functionality"""
     
     def test_delete_submission_success(self, client):
         """Test successful submission deletion"""
-        form = FormFactory(
-            name='test_form',
-            submissions=[
-                {
-                    'id': 'sub_1',
-                    'responses': {'q_1': 'Response 1'}
-                }
-            ]
-        )
+        form = FormFactory(name='test_form')
+        submission = {'id': 'sub_1', 'responses': {'q_1': 'Response 1'}}
         
         with patch('models.FormModel.get_form_by_name', return_value=form), \
+             patch('models.FormModel.get_submission', return_value=submission), \
              patch('models.FormModel.delete_submission', return_value=True) as mock_delete:
             
             response = client.delete('/api/form/test_form/submission/sub_1/delete')
@@ -488,21 +826,21 @@ class TestSubmissionDeletion:
     
     def test_delete_submission_not_found(self, client):
         """Test deleting non-existent submission"""
-        form = FormFactory(name='test_form', submissions=[])
+        form = FormFactory(name='test_form')
         
-        with patch('models.FormModel.get_form_by_name', return_value=form):
+        with patch('models.FormModel.get_form_by_name', return_value=form), \
+             patch('models.FormModel.get_submission', return_value=None):
             response = client.delete('/api/form/test_form/submission/nonexistent_sub/delete')
             
             assert response.status_code == 404
     
     def test_delete_submission_failure(self, client):
         """Test submission deletion failure"""
-        form = FormFactory(
-            name='test_form',
-            submissions=[{'id': 'sub_1', 'responses': {}}]
-        )
+        form = FormFactory(name='test_form')
+        submission = {'id': 'sub_1', 'responses': {}}
         
         with patch('models.FormModel.get_form_by_name', return_value=form), \
+             patch('models.FormModel.get_submission', return_value=submission), \
              patch('models.FormModel.delete_submission', return_value=False):
             
             response = client.delete('/api/form/test_form/submission/sub_1/delete')
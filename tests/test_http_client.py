@@ -0,0 +1,61 @@
+"""
+Pooled HTTP client tests for aForm application
+"""
+import pytest
+import socket
+from unittest.mock import patch
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from http_client import HTTPClientPool
+
+
+def unused_port():
+    """Get a local port nothing listens on"""
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+@pytest.mark.unit
+class TestHTTPClientPool:
+    """Test timeouts, retries and metrics of the shared pool"""
+
+    def test_default_timeout_applied(self, fake_oauth):
+        """Test calls without a timeout get the pool's timeout and are timed"""
+        pool = HTTPClientPool(connect_timeout=1, read_timeout=2)
+
+        with patch('requests.adapters.HTTPAdapter.send', side_effect=HTTPAdapter.send, autospec=True) as mock_send:
+            response = pool.session().get(f'{fake_oauth.base_url}/userinfo')
+
+        assert response.status_code == 401
+        assert mock_send.call_args[1]['timeout'] == (1, 2)
+        stats = pool.stats()[f'{fake_oauth.base_url[7:]}/userinfo']
+        assert stats['calls'] == 1
+        assert stats['errors'] == 0
+
+    def test_connection_failure_retried_and_recorded(self):
+        """Test connection failures are retried, then counted as errors"""
+        pool = HTTPClientPool(retries=2, backoff=0)
+        url = f'http://127.0.0.1:{unused_port()}/token'
+
+        with patch.object(Retry, 'increment', side_effect=Retry.increment, autospec=True) as mock_increment:
+            with pytest.raises(requests.ConnectionError):
+                pool.session().post(url, data={'code': 'x'})
+
+        assert mock_increment.call_count == 3
+        stats = pool.stats()
+        assert list(stats.values())[0]['errors'] == 1
+
+    def test_session_close_keeps_pool(self):
+        """Test closing a session doesn't close the shared adapter"""
+        pool = HTTPClientPool()
+        session = pool.session()
+
+        with patch('requests.adapters.HTTPAdapter.close') as mock_close:
+            session.close()
+            mock_close.assert_not_called()
+            pool.close()
+            mock_close.assert_called_once()
@@ -0,0 +1,263 @@
+"""
+Submission ingestion and idempotency tests for aForm application
+"""
+import pytest
+import json
+from datetime import datetime
+from unittest.mock import patch
+
+from cache import idempotency_cache
+from ingest import IngestBackpressure, SubmissionIngestor
+from models import DuplicateSubmissionError, FormModel
+from tests.conftest import FormFactory, create_test_form
+
+
+@pytest.mark.database
+class TestInsertSubmissions:
+    """Test FormModel.insert_submissions batch writes"""
+
+    def test_batch_insert_updates_counters(self, mock_mongo):
+        """Test a batch is inserted and each form's counters bumped once"""
+        form_a = create_test_form(mock_mongo, FormFactory(name='form_a'))
+        form_b = create_test_form(mock_mongo, FormFactory(name='form_b'))
+        submitted_at = datetime(2024, 5, 1, 12, 0)
+        submissions = [
+            {'id': 'sub_1', 'form_id': str(form_a['_id']), 'submitted_at': submitted_at, 'responses': {}},
+            {'id': 'sub_2', 'form_id': str(form_a['_id']), 'submitted_at': submitted_at, 'responses': {}},
+            {'id': 'sub_3', 'form_id': str(form_b['_id']), 'submitted_at': submitted_at, 'responses': {}}
+        ]
+
+        assert FormModel.insert_submissions(submissions) == [True, True, True]
+
+        assert mock_mongo.submissions.count_documents({}) == 3
+        stored_a = mock_mongo.forms.find_one({'name': 'form_a'})
+        assert stored_a['submission_count'] == 2
+        assert stored_a['daily_submissions'] == {'2024-05-01': 2}
+        assert stored_a['last_submission_at'] == submitted_at
+        assert mock_mongo.forms.find_one({'name': 'form_b'})['submission_count'] == 1
+
+    def test_duplicates_not_counted(self, mock_mongo):
+        """Test submissions rejected by the unique id index are reported and not counted"""
+        mock_mongo.submissions.create_index('id', unique=True)
+        form = create_test_form(mock_mongo, FormFactory(name='form_a', submission_count=0))
+        form_id = str(form['_id'])
+        mock_mongo.submissions.insert_one({'id': 'sub_1', 'form_id': form_id})
+
+        stored = FormModel.insert_submissions([
+            {'id': 'sub_1', 'form_id': form_id, 'submitted_at': datetime.now(), 'responses': {}},
+            {'id': 'sub_2', 'form_id': form_id, 'submitted_at': datetime.now(), 'responses': {}}
+        ])
+
+        assert stored == [False, True]
+        assert mock_mongo.forms.find_one({'name': 'form_a'})['submission_count'] == 1
+
+
+@pytest.mark.database
+class TestSubmissionIngestor:
+    """Test SubmissionIngestor queueing and flushing"""
+
+    def test_enqueue_durability(self, mock_mongo):
+        """Test submissions are acknowledged on enqueue and written on flush"""
+        form = create_test_form(mock_mongo, FormFactory(name='form_a'))
+        ingestor = SubmissionIngestor(mode='queued', durability='enqueue')
+
+        with patch.object(ingestor, 'start'):
+            ingestor.submit(str(form['_id']), {'id': 'sub_1', 'responses': {}})
+            ingestor.submit(str(form['_id']), {'id': 'sub_2', 'responses': {}})
+
+        assert mock_mongo.submissions.count_documents({}) == 0
+        assert ingestor.flush() == 2
+        assert mock_mongo.submissions.count_documents({}) == 2
+        assert ingestor.stats()['batches'] == 1
+
+    def test_commit_durability(self, mock_mongo):
+        """Test submit waits for the writer to store the submission"""
+        form = create_test_form(mock_mongo, FormFactory(name='form_a'))
+        ingestor = SubmissionIngestor(mode='queued', durability='commit', flush_interval=0)
+
+        ingestor.submit(str(form['_id']), {'id': 'sub_1', 'responses': {}})
+        ingestor.stop()
+
+        assert mock_mongo.submissions.find_one({'id': 'sub_1'}) is not None
+
+    def test_full_queue_rejected(self, mock_mongo):
+        """Test a full queue pushes back with 429"""
+        ingestor = SubmissionIngestor(mode='queued', durability='enqueue', max_size=1)
+
+        with patch.object(ingestor, 'start'):
+            ingestor.submit('form_id', {'id': 'sub_1', 'responses': {}})
+            with pytest.raises(IngestBackpressure) as exc_info:
+                ingestor.submit('form_id', {'id': 'sub_2', 'responses': {}})
+
+        assert exc_info.value.status == 429
+        assert ingestor.stats()['rejected'] == 1
+
+    def test_failed_write_rejected(self, mock_mongo):
+        """Test a write that keeps failing is reported with 503"""
+        ingestor = SubmissionIngestor(mode='queued', durability='commit', max_attempts=2, retry_delay=0)
+
+        with patch('models.FormModel.insert_submissions', side_effect=Exception('write failed')):
+            with pytest.raises(IngestBackpressure) as exc_info:
+                ingestor.submit('form_id', {'id': 'sub_1', 'responses': {}})
+            ingestor.stop()
+
+        assert exc_info.value.status == 503
+        assert ingestor.stats()['failed'] == 1
+
+    def test_partial_write_resolved_from_stored(self, mock_mongo):
+        """Test rows stored before a write failed are reported as stored and not written again"""
+        form = create_test_form(mock_mongo, FormFactory(name='form_a', submission_count=0))
+        form_id = str(form['_id'])
+        ingestor = SubmissionIngestor(mode='queued', durability='enqueue', max_attempts=2, retry_delay=0)
+        insert_submissions = FormModel.insert_submissions
+        calls = []
+
+        def fail_after_first(submissions):
+            calls.append([submission['id'] for submission in submissions])
+            if len(calls) == 1:
+                mock_mongo.submissions.insert_one(dict(submissions[0]))
+                raise Exception('connection reset')
+            return insert_submissions(submissions)
+
+        with patch.object(ingestor, 'start'):
+            ingestor.submit(form_id, {'id': 'sub_1', 'responses': {}})
+            ingestor.submit(form_id, {'id': 'sub_2', 'responses': {}})
+        with patch('models.FormModel.insert_submissions', side_effect=fail_after_first):
+            assert ingestor.flush() == 2
+
+        assert calls == [['sub_1', 'sub_2'], ['sub_2']]
+        assert mock_mongo.submissions.count_documents({}) == 2
+        assert mock_mongo.forms.find_one({'name': 'form_a'})['submission_count'] == 2
+        assert ingestor.stats()['failed'] == 0
+
+    def test_commit_timeout_returns_key(self, mock_mongo):
+        """Test a submission that times out carries a server key its retry is deduplicated by"""
+        mock_mongo.submissions.create_index(
+            [('form_id', 1), ('idempotency_key', 1)],
+            unique=True,
+            partialFilterExpression={'idempotency_key': {'$exists': True}}
+        )
+        form = create_test_form(mock_mongo, FormFactory(name='form_a'))
+        form_id = str(form['_id'])
+        ingestor = SubmissionIngestor(mode='queued', durability='commit', commit_timeout=0)
+
+        with patch.object(ingestor, 'start'):
+            with pytest.raises(IngestBackpressure) as exc_info:
+                ingestor.submit(form_id, {'id': 'sub_1', 'responses': {}})
+        key = exc_info.value.idempotency_key
+        assert exc_info.value.status == 503
+        assert key
+
+        ingestor.flush()
+        ingestor.commit_timeout = 5
+        with pytest.raises(DuplicateSubmissionError) as duplicate:
+            ingestor.submit(form_id, {'id': 'sub_2', 'responses': {}, 'idempotency_key': key})
+        ingestor.stop()
+
+        assert duplicate.value.submission_id == 'sub_1'
+        assert mock_mongo.submissions.count_documents({}) == 1
+
+    def test_invalid_settings(self):
+        """Test unknown modes and durability levels are rejected"""
+        with pytest.raises(ValueError):
+            SubmissionIngestor(mode='bulk')
+        with pytest.raises(ValueError):
+            SubmissionIngestor(durability='fsync')
+
+
+@pytest.mark.api
+class TestQueuedSubmitEndpoint:
+    """Test submit_form in queued ingestion mode"""
+
+    def test_backpressure_response(self, client, mock_mongo):
+        """Test the submit endpoint returns 429 with Retry-After when the queue is full"""
+        create_test_form(mock_mongo, FormFactory(name='test_form', status='published'))
+        ingestor = SubmissionIngestor(mode='queued', durability='enqueue', max_size=1)
+
+        with patch('app.submission_ingestor', ingestor), patch.object(ingestor, 'start'):
+            first = client.post('/api/form/test_form/submit',
+                              data=json.dumps({'responses': {'q_1': 'a'}}),
+                              content_type='application/json')
+            second = client.post('/api/form/test_form/submit',
+                               data=json.dumps({'responses': {'q_1': 'b'}}),
+                               content_type='application/json')
+
+        assert first.status_code == 200
+        assert second.status_code == 429
+        assert second.headers['Retry-After'] == '1'
+
+        ingestor.flush()
+        assert mock_mongo.submissions.find_one()['responses'] == {'q_1': 'a'}
+
+
+@pytest.mark.api
+class TestIdempotentSubmissions:
+    """Test idempotency keys on submit_form"""
+
+    def submit(self, client, key=None, body_key=None):
+        data = {'responses': {'q_1': 'answer'}}
+        if body_key:
+            data['idempotency_key'] = body_key
+        headers = {'Idempotency-Key': key} if key else {}
+        return client.post('/api/form/test_form/submit', data=json.dumps(data),
+                           content_type='application/json', headers=headers)
+
+    def test_retry_returns_original(self, client, mock_mongo):
+        """Test a retry with the same key returns the first submission without storing another"""
+        create_test_form(mock_mongo, FormFactory(name='test_form', status='published'))
+
+        first = self.submit(client, key='key-1')
+        retry = self.submit(client, key='key-1')
+        other = self.submit(client, key='key-2')
+
+        first_id = json.loads(first.data)['submission_id']
+        assert json.loads(retry.data)['submission_id'] == first_id
+        assert retry.headers['Idempotent-Replayed'] == 'true'
+        assert json.loads(other.data)['submission_id'] != first_id
+        assert mock_mongo.submissions.count_documents({}) == 2
+        assert mock_mongo.forms.find_one({'name': 'test_form'})['submission_count'] == 2
+
+    def test_retry_on_other_process(self, client, mock_mongo):
+        """Test the unique index catches retries the local cache hasn't seen"""
+        mock_mongo.submissions.create_index(
+            [('form_id', 1), ('idempotency_key', 1)],
+            unique=True,
+            partialFilterExpression={'idempotency_key': {'$exists': True}}
+        )
+        create_test_form(mock_mongo, FormFactory(name='test_form', status='published'))
+
+        first = self.submit(client, body_key='key-1')
+        idempotency_cache.clear()
+        retry = self.submit(client, body_key='key-1')
+
+        assert retry.status_code == 200
+        assert json.loads(retry.data)['submission_id'] == json.loads(first.data)['submission_id']
+        assert mock_mongo.submissions.count_documents({}) == 1
+        assert mock_mongo.forms.find_one({'name': 'test_form'})['submission_count'] == 1
+
+    def test_queued_retry_returns_original(self, client, mock_mongo):
+        """Test queued ingestion resolves duplicate keys to the original submission"""
+        mock_mongo.submissions.create_index(
+            [('form_id', 1), ('idempotency_key', 1)],
+            unique=True,
+            partialFilterExpression={'idempotency_key': {'$exists': True}}
+        )
+        create_test_form(mock_mongo, FormFactory(name='test_form', status='published'))
+        ingestor = SubmissionIngestor(mode='queued', durability='commit', flush_interval=0)
+
+        with patch('app.submission_ingestor', ingestor):
+            first = self.submit(client, key='key-1')
+            idempotency_cache.clear()
+            retry = self.submit(client, key='key-1')
+        ingestor.stop()
+
+        assert json.loads(retry.data)['submission_id'] == json.loads(first.data)['submission_id']
+        assert ingestor.stats()['duplicates'] == 1
+
+    def test_invalid_key(self, client, mock_mongo):
+        """Test overlong keys are rejected"""
+        create_test_form(mock_mongo, FormFactory(name='test_form', status='published'))
+
+        response = self.submit(client, key='k' * 300)
+
+        assert response.status_code == 400
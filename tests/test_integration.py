@@ -7,7 +7,7 @@ import json
 from unittest.mock import patch, MagicMock
 from datetime import datetime
 
-from tests.conftest import UserFactory, FormFactory, create_test_user, create_test_form, authenticate_user
+from tests.conftest import UserFactory, FormFactory, create_test_user, create_test_form, authenticate_user, log_in
 
 
 @pytest.mark.integration
@@ -76,16 +76,7 @@ class TestCompleteFormWorkflow:
             mock_add_sub.assert_called_once()
         
         # 5. View submissions
-        form_with_submissions = {
-            **published_form,
-            'submissions': [
-                {
-                    'id': 'sub_1',
-                    'submitted_at': datetime.now(),
-                    'responses': {'q_1': 'John Doe', 'q_2': 'john@example.com'}
-                }
-            ]
-        }
+        form_with_submissions = {**published_form, 'submission_count': 1}
         
         with patch('models.FormModel.get_form_by_name', return_value=form_with_submissions):
             response = client.get('/form/Integration Test Form/submissions')
@@ -146,7 +137,7 @@ class TestCompleteFormWorkflow:
         )
         
         with patch('models.FormModel.get_form_by_name', return_value=form_with_collabs), \
-             patch('models.UserModel.get_all_users', return_value=[authenticated_session, editor_user, viewer_user]):
+             patch('models.UserModel.get_users_by_ids', return_value={u['id']: u for u in [authenticated_session, editor_user, viewer_user]}):
             
             response = client.get('/api/form/Collaboration Form/collaborators')
             assert response.status_code == 200
@@ -183,27 +174,20 @@ class TestUserJourney:
             'picture': 'http://example.com/pic.jpg'
         }
         
-        mock_response = MagicMock()
-        mock_response.json.return_value = {'access_token': 'test_token'}
-        
-        mock_userinfo = MagicMock()
-        mock_userinfo.json.return_value = user_info
+        mock_google_oauth.authorize_access_token.return_value = {'access_token': 'test_token'}
+        mock_google_oauth.get.return_value.json.return_value = user_info
         
-        with patch('requests.post', return_value=mock_response), \
-             patch('requests.get', return_value=mock_userinfo), \
-             patch('models.UserModel.get_user_by_email', return_value=None), \
-             patch('models.UserModel.create_user') as mock_create:
+        with patch('models.UserModel.upsert_user') as mock_upsert:
             
             new_user = UserFactory(**user_info)
-            mock_create.return_value = new_user
+            mock_upsert.return_value = new_user
             
             response = client.get('/auth/callback?code=test_code')
             assert response.status_code == 302  # Redirect to dashboard
-            mock_create.assert_called_once()
+            mock_upsert.assert_called_once_with(user_info)
         
         # 4. User can now access dashboard
-        with client.session_transaction() as sess:
-            sess['user'] = new_user
+        log_in(client, new_user)
         
         with patch('auth.auth_manager.get_user_forms', return_value=[]):
             response = client.get('/')
@@ -292,25 +276,22 @@ class TestUserJourney:
         
         # 6. Form owner views submissions
         # Re-authenticate as form owner
-        with client.session_transaction() as sess:
-            sess['user'] = authenticated_session
-        
-        form_with_submissions = {
-            **published_form,
-            'submissions': [
-                {
-                    'id': 'sub_1',
-                    'submitted_at': datetime.now(),
-                    'responses': {
-                        'q_1': 'Very Satisfied',
-                        'q_2': 'Great service, keep it up!'
-                    }
+        log_in(client, authenticated_session)
+        
+        submissions = [
+            {
+                'id': 'sub_1',
+                'submitted_at': datetime.now().isoformat(),
+                'responses': {
+                    'q_1': 'Very Satisfied',
+                    'q_2': 'Great service, keep it up!'
                 }
-            ]
-        }
+            }
+        ]
         
-        with patch('models.FormModel.get_form_by_name', return_value=form_with_submissions):
-            response = client.get('/form/Public Survey/submissions')
+        with patch('models.FormModel.get_form_by_name', return_value=published_form), \
+             patch('models.FormModel.get_submissions_page', return_value=(submissions, None)):
+            response = client.get('/api/form/Public Survey/submissions')
             assert response.status_code == 200
             assert b'Very Satisfied' in response.data
 
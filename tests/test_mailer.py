@@ -0,0 +1,119 @@
+"""
+Mail queue tests for aForm application
+"""
+import pytest
+import time
+from flask import Flask
+from flask_mail import Mail, Message
+
+from mailer import MailQueue
+
+
+@pytest.fixture
+def mail_app(fake_smtp):
+    """Flask app whose Flask-Mail extension delivers to the fake SMTP server"""
+    app = Flask(__name__)
+    app.config.update(
+        MAIL_SERVER='127.0.0.1',
+        MAIL_PORT=fake_smtp.port,
+        MAIL_USE_TLS=False,
+        MAIL_SUPPRESS_SEND=False,
+        MAIL_DEFAULT_SENDER='noreply@example.com'
+    )
+    return app
+
+
+def make_queue(mail_app, **kwargs):
+    kwargs.setdefault('autostart', False)
+    kwargs.setdefault('retry_delay', 0)
+    return MailQueue(mail_app, Mail(mail_app), **kwargs)
+
+
+def make_message(mail_app, to='invited@example.com'):
+    with mail_app.app_context():
+        return Message(subject='Invitation', recipients=[to], html='<p>Hi</p>')
+
+
+@pytest.mark.unit
+class TestMailQueue:
+    """Test MailQueue delivery"""
+
+    def test_batch_sent_over_one_connection(self, mail_app, fake_smtp, mock_mongo):
+        """Test queued messages share one SMTP connection"""
+        mail_queue = make_queue(mail_app)
+        for n in range(3):
+            assert mail_queue.enqueue(make_message(mail_app, f'user{n}@example.com'))
+
+        assert mail_queue.process_pending() == 3
+        assert [m['to'] for m in fake_smtp.messages] == [
+            ['user0@example.com'], ['user1@example.com'], ['user2@example.com']
+        ]
+        assert fake_smtp.connections == 1
+
+    def test_transient_failure_retried(self, mail_app, fake_smtp, mock_mongo):
+        """Test temporary rejections are retried"""
+        fake_smtp.reject_next = 1
+        mail_queue = make_queue(mail_app)
+        mail_queue.enqueue(make_message(mail_app))
+
+        mail_queue.process_pending()
+
+        assert len(fake_smtp.messages) == 1
+        assert mail_queue.stats()['retried'] == 1
+        assert mock_mongo.mail_dead_letters.count_documents({}) == 0
+
+    def test_retry_backoff(self, mail_app, fake_smtp, mock_mongo):
+        """Test retries wait before being sent again"""
+        fake_smtp.reject_next = 1
+        mail_queue = make_queue(mail_app, retry_delay=60)
+        mail_queue.enqueue(make_message(mail_app))
+
+        assert mail_queue.process_pending() == 0
+        assert mail_queue.stats()['retrying'] == 1
+
+    def test_dead_letter_after_max_attempts(self, mail_app, fake_smtp, mock_mongo):
+        """Test messages are dead-lettered once retries run out"""
+        fake_smtp.reject_next = 10
+        mail_queue = make_queue(mail_app, max_attempts=3)
+        mail_queue.enqueue(make_message(mail_app), kind='invitation')
+
+        mail_queue.process_pending()
+
+        assert fake_smtp.messages == []
+        dead_letter = mock_mongo.mail_dead_letters.find_one()
+        assert dead_letter['kind'] == 'invitation'
+        assert dead_letter['recipients'] == ['invited@example.com']
+        assert dead_letter['attempts'] == 3
+        assert '451' in dead_letter['error']
+
+    def test_permanent_failure_not_retried(self, mail_app, fake_smtp, mock_mongo):
+        """Test permanent rejections are dead-lettered immediately"""
+        fake_smtp.reject_next = 1
+        fake_smtp.reject_reply = '550 Mailbox unavailable'
+        mail_queue = make_queue(mail_app)
+        mail_queue.enqueue(make_message(mail_app))
+
+        mail_queue.process_pending()
+
+        assert mock_mongo.mail_dead_letters.find_one()['attempts'] == 1
+        assert mail_queue.stats()['retried'] == 0
+
+    def test_queue_full(self, mail_app, mock_mongo):
+        """Test enqueue reports a full queue"""
+        mail_queue = make_queue(mail_app, max_size=1)
+
+        assert mail_queue.enqueue(make_message(mail_app))
+        assert not mail_queue.enqueue(make_message(mail_app))
+
+    def test_background_worker(self, mail_app, fake_smtp, mock_mongo):
+        """Test the worker thread delivers queued messages"""
+        mail_queue = make_queue(mail_app, autostart=True)
+        mail_queue.enqueue(make_message(mail_app))
+
+        deadline = time.monotonic() + 5
+        while not fake_smtp.messages and time.monotonic() < deadline:
+            time.sleep(0.05)
+        mail_queue.stop()
+
+        assert len(fake_smtp.messages) == 1
+        assert not mail_queue.stats()['worker_alive']
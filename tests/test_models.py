@@ -6,8 +6,8 @@ from unittest.mock import patch, MagicMock
 from datetime import datetime
 from pymongo.errors import DuplicateKeyError
 
-from models import UserModel, FormModel
-from tests.conftest import UserFactory, FormFactory, create_test_user, create_test_form
+from models import UserModel, FormModel, SchemaConflictError
+from tests.conftest import UserFactory, FormFactory, create_test_user, create_test_form, create_test_submission
 
 
 @pytest.mark.database
@@ -68,6 +68,40 @@ class TestUserModel:
         with pytest.raises(ValueError, match="User not found"):
             UserModel.update_user('nonexistent_id', update_data)
     
+    def test_upsert_user_creates(self, mock_mongo):
+        """Test the first login creates the user"""
+        user = UserModel.upsert_user({'email': 'new@example.com', 'name': 'New User'})
+        
+        assert user['id'] == UserModel.upsert_user({'email': 'new@example.com'})['id']
+        stored = mock_mongo.users.find_one({'email': 'new@example.com'})
+        assert stored['name'] == 'New User'
+        assert stored['picture'] == ''
+        assert stored['role'] == 'user'
+        assert mock_mongo.users.count_documents({}) == 1
+    
+    def test_upsert_user_keeps_role_and_missing_fields(self, mock_mongo):
+        """Test later logins refresh the profile without touching role or fields not sent"""
+        create_test_user(mock_mongo, UserFactory(id='user_123', email='admin@example.com',
+                                                 role='admin', picture='pic.jpg'))
+        
+        user = UserModel.upsert_user({'email': 'admin@example.com', 'name': 'Renamed'})
+        
+        assert user['id'] == 'user_123'
+        assert user['role'] == 'admin'
+        assert user['name'] == 'Renamed'
+        assert user['picture'] == 'pic.jpg'
+    
+    def test_upsert_user_retries_insert_race(self, mock_mongo):
+        """Test losing a concurrent first-login insert retries as an update"""
+        stored = UserFactory(email='race@example.com')
+        
+        with patch.object(mock_mongo.users, 'find_one_and_update',
+                          side_effect=[DuplicateKeyError('E11000'), stored]) as mock_upsert:
+            user = UserModel.upsert_user({'email': 'race@example.com', 'name': 'Racer'})
+        
+        assert mock_upsert.call_count == 2
+        assert user['id'] == stored['id']
+    
     def test_get_user_by_email_found(self, mock_mongo):
         """Test getting user by email when found"""
         user = create_test_user(mock_mongo, UserFactory(email='test@example.com'))
@@ -112,6 +146,29 @@ class TestUserModel:
         assert user1['email'] in user_emails
         assert user2['email'] in user_emails
     
+    def test_get_users_by_ids(self, mock_mongo):
+        """Test getting many users by ID with a field projection"""
+        user1 = create_test_user(mock_mongo, UserFactory())
+        user2 = create_test_user(mock_mongo, UserFactory())
+        create_test_user(mock_mongo, UserFactory())
+        
+        users = UserModel.get_users_by_ids([user1['id'], user2['id'], 'missing'], ['name'])
+        
+        assert set(users) == {user1['id'], user2['id']}
+        assert users[user1['id']]['name'] == user1['name']
+        assert 'email' not in users[user1['id']]
+    
+    def test_get_users_by_ids_cached(self, mock_mongo):
+        """Test repeated lookups are served from the user cache until the user changes"""
+        user = create_test_user(mock_mongo, UserFactory(name='Old Name'))
+        UserModel.get_users_by_ids([user['id']], ['name'])
+        
+        mock_mongo.users.update_one({'id': user['id']}, {'$set': {'name': 'Direct Write'}})
+        assert UserModel.get_users_by_ids([user['id']], ['name'])[user['id']]['name'] == 'Old Name'
+        
+        UserModel.update_user(user['id'], {'name': 'New Name'})
+        assert UserModel.get_users_by_ids([user['id']], ['name'])[user['id']]['name'] == 'New Name'
+    
     def test_delete_user_success(self, mock_mongo):
         """Test successful user deletion"""
         user = create_test_user(mock_mongo, UserFactory(id='user_123'))
@@ -195,12 +252,123 @@ class TestFormModel:
             ]
         }
         
-        updated_form = FormModel.update_form('test_form', update_data)
+        updated_form = FormModel.update_form('test_form', update_data, 'schema')
         
         assert updated_form['status'] == 'published'
         assert updated_form['questions'][0]['title'] == 'Updated Question'
         assert updated_form['questions'][0]['required'] is True
         assert 'updated_at' in updated_form
+        assert 'permissions' not in updated_form
+    
+    def test_update_form_without_profiles(self, mock_mongo):
+        """Test form update returns nothing unless fields are asked for"""
+        create_test_form(mock_mongo, FormFactory(name='test_form'))
+        
+        assert FormModel.update_form('test_form', {'status': 'published'}) is None
+        assert mock_mongo.forms.find_one({'name': 'test_form'})['status'] == 'published'
+    
+    def test_update_form_questions_bumps_schema_version(self, mock_mongo):
+        """Test replacing the questions moves the schema version on"""
+        create_test_form(mock_mongo, FormFactory(name='test_form'))
+        
+        FormModel.update_form('test_form', {'status': 'published'})
+        assert 'schema_version' not in mock_mongo.forms.find_one({'name': 'test_form'})
+        
+        FormModel.update_form('test_form', {'questions': []})
+        assert mock_mongo.forms.find_one({'name': 'test_form'})['schema_version'] == 1
+    
+    def test_patch_questions_targets_one_question(self, mock_mongo):
+        """Test an update op only touches its question and invalidates cached schemas"""
+        create_test_form(mock_mongo, FormFactory(name='test_form', questions=[
+            {'id': 'q_1', 'title': 'One'}, {'id': 'q_2', 'title': 'Two'}
+        ]))
+        assert FormModel.get_form_by_name('test_form', 'schema')['questions'][1]['title'] == 'Two'
+        
+        version = FormModel.patch_questions('test_form', 0, [{'op': 'update', 'id': 'q_2', 'fields': {'title': 'Second'}}])
+        
+        assert version == 1
+        form = FormModel.get_form_by_name('test_form', 'schema')
+        assert form['schema_version'] == 1
+        assert [q['title'] for q in form['questions']] == ['One', 'Second']
+    
+    def test_get_schema_changes(self, mock_mongo):
+        """Test changes since a version are replayed from the change log"""
+        create_test_form(mock_mongo, FormFactory(name='test_form', questions=[
+            {'id': 'q_1', 'title': 'One'}, {'id': 'q_2', 'title': 'Two'}
+        ]))
+        FormModel.patch_questions('test_form', 0, [{'op': 'update', 'id': 'q_1', 'fields': {'title': 'First'}}])
+        FormModel.patch_questions('test_form', 1, [{'op': 'move', 'id': 'q_2', 'index': 0}])
+        
+        delta = FormModel.get_schema_changes('test_form', 1)
+        
+        assert delta == {'version': 2, 'changes': [{'op': 'move', 'id': 'q_2', 'index': 0}]}
+        assert FormModel.get_schema_changes('test_form', 2) == {'version': 2, 'changes': []}
+        
+        mock_mongo.form_changes.delete_many({'version': 1})
+        assert FormModel.get_schema_changes('test_form', 0)['questions'] == [
+            {'id': 'q_2', 'title': 'Two'}, {'id': 'q_1', 'title': 'First'}
+        ]
+    
+    def test_patch_questions_batch_is_one_version(self, mock_mongo):
+        """Test a batch is written once under one version, or not at all"""
+        create_test_form(mock_mongo, FormFactory(name='test_form', questions=[
+            {'id': 'q_1', 'title': 'One'}, {'id': 'q_2', 'title': 'Two'}
+        ]))
+        ops = [{'op': 'move', 'id': 'q_2', 'index': 0}, {'op': 'update', 'id': 'q_1', 'fields': {'title': 'First'}}]
+        
+        assert FormModel.patch_questions('test_form', 0, ops) == 1
+        
+        stored = mock_mongo.forms.find_one({'name': 'test_form'})
+        assert stored['questions'] == [{'id': 'q_2', 'title': 'Two'}, {'id': 'q_1', 'title': 'First'}]
+        assert FormModel.get_schema_changes('test_form', 0, entries=True)['changes'] == [
+            {'version': 1, 'ops': ops, 'author': None}
+        ]
+        
+        with pytest.raises(ValueError, match="Question q_404 not found"):
+            FormModel.patch_questions('test_form', 1, [{'op': 'delete', 'id': 'q_1'}, {'op': 'delete', 'id': 'q_404'}])
+        stored = mock_mongo.forms.find_one({'name': 'test_form'})
+        assert stored['schema_version'] == 1
+        assert [q['id'] for q in stored['questions']] == ['q_2', 'q_1']
+    
+    def test_patch_questions_targeted_writes(self, mock_mongo):
+        """Test updates, deletes and a single add write only the questions they touch"""
+        create_test_form(mock_mongo, FormFactory(name='test_form', questions=[
+            {'id': 'q_1', 'title': 'One', 'help': 'Old'}, {'id': 'q_2', 'title': 'Two'}, {'id': 'q_3', 'title': 'Three'}
+        ]))
+        forms_collection = mock_mongo.forms
+        
+        with patch.object(forms_collection, 'update_one', wraps=forms_collection.update_one) as update_one, \
+                patch('models.db_manager.get_forms_collection', return_value=forms_collection):
+            FormModel.patch_questions('test_form', 0, [
+                {'op': 'update', 'id': 'q_2', 'fields': {'title': 'Second'}},
+                {'op': 'update', 'id': 'q_1', 'remove': ['help']}
+            ])
+            FormModel.patch_questions('test_form', 1, [{'op': 'add', 'question': {'id': 'q_4', 'title': 'Four'}, 'index': 1}])
+            FormModel.patch_questions('test_form', 2, [{'op': 'delete', 'id': 'q_3'}])
+        
+        updates = [call.args[1] for call in update_one.call_args_list]
+        assert updates[0]['$set']['questions.1.title'] == 'Second'
+        assert updates[0]['$unset'] == {'questions.0.help': ''}
+        assert updates[1]['$push'] == {'questions': {'$each': [{'id': 'q_4', 'title': 'Four'}], '$position': 1}}
+        assert updates[2]['$pull'] == {'questions': {'id': {'$in': ['q_3']}}}
+        assert all('questions' not in update['$set'] for update in updates)
+        
+        stored = mock_mongo.forms.find_one({'name': 'test_form'})
+        assert stored['schema_version'] == 3
+        assert stored['questions'] == [
+            {'id': 'q_1', 'title': 'One'}, {'id': 'q_4', 'title': 'Four'}, {'id': 'q_2', 'title': 'Second'}
+        ]
+    
+    def test_patch_questions_conflict(self, mock_mongo):
+        """Test operations based on another version raise SchemaConflictError"""
+        create_test_form(mock_mongo, FormFactory(name='test_form'))
+        
+        with pytest.raises(SchemaConflictError) as exc_info:
+            FormModel.patch_questions('test_form', 3, [{'op': 'delete', 'id': 'q_1'}])
+        
+        assert exc_info.value.current_version == 0
+        with pytest.raises(ValueError, match="Form not found"):
+            FormModel.patch_questions('nonexistent_form', 0, [{'op': 'delete', 'id': 'q_1'}])
     
     def test_update_form_not_found(self, mock_mongo):
         """Test form update when form not found"""
@@ -208,6 +376,8 @@ class TestFormModel:
         
         with pytest.raises(ValueError, match="Form not found"):
             FormModel.update_form('nonexistent_form', update_data)
+        with pytest.raises(ValueError, match="Form not found"):
+            FormModel.update_form('nonexistent_form', update_data, 'schema')
     
     def test_get_form_by_name_found(self, mock_mongo):
         """Test getting form by name when found"""
@@ -266,6 +436,66 @@ class TestFormModel:
         assert 'viewer_form' in form_names
         assert 'no_access_form' not in form_names
     
+    def test_get_form_by_name_with_profile(self, mock_mongo):
+        """Test reading a form limited to a field profile"""
+        create_test_form(mock_mongo, FormFactory(
+            name='test_form',
+            status='published',
+            permissions={'admin': ['user_123'], 'editor': [], 'viewer': []}
+        ))
+        
+        form = FormModel.get_form_by_name('test_form', 'meta')
+        
+        assert form['status'] == 'published'
+        assert 'questions' not in form
+        assert 'permissions' not in form
+        
+        form = FormModel.get_form_by_name('test_form', 'schema', 'permissions')
+        
+        assert len(form['questions']) == 1
+        assert form['permissions']['admin'] == ['user_123']
+        assert 'invites' not in form
+    
+    def test_get_form_by_name_unknown_profile(self, mock_mongo):
+        """Test reading a form with an unknown field profile"""
+        with pytest.raises(ValueError, match="Unknown form field profile"):
+            FormModel.get_form_by_name('test_form', 'everything')
+    
+    def test_get_public_schema(self, mock_mongo):
+        """Test public render schema only exposes what visitors need"""
+        form = create_test_form(mock_mongo, FormFactory(name='test_form', status='published'))
+        
+        schema = FormModel.get_public_schema('test_form')
+        
+        assert set(schema) == {'id', 'name', 'questions', 'settings'}
+        assert schema['id'] == str(form['_id'])
+        assert schema['questions'][0]['id'] == 'q_1'
+    
+    def test_get_public_schema_invalidated_on_update(self, mock_mongo):
+        """Test public render schema is dropped when the form changes"""
+        create_test_form(mock_mongo, FormFactory(name='test_form', status='published'))
+        assert FormModel.get_public_schema('test_form') is not None
+        
+        FormModel.update_form('test_form', {'status': 'draft'})
+        
+        assert FormModel.get_public_schema('test_form') is None
+    
+    def test_get_user_forms_dashboard_profile(self, mock_mongo):
+        """Test dashboard listing only projects metadata and counters"""
+        create_test_form(mock_mongo, FormFactory(
+            name='admin_form',
+            permissions={'admin': ['user_123'], 'editor': [], 'viewer': []},
+            submission_count=7
+        ))
+        
+        forms = FormModel.get_user_forms('user_123', 'dashboard')
+        
+        assert len(forms) == 1
+        assert forms[0]['question_count'] == 1
+        assert forms[0]['submission_count'] == 7
+        assert 'questions' not in forms[0]
+        assert 'permissions' not in forms[0]
+    
     def test_delete_form_success(self, mock_mongo):
         """Test successful form deletion"""
         form = create_test_form(mock_mongo, FormFactory(name='test_form'))
@@ -297,11 +527,16 @@ class TestFormModel:
         
         assert result is True
         
-        # Verify submission was added
+        # Verify submission was stored in its own collection
+        submissions = FormModel.get_submissions('test_form')
+        assert len(submissions) == 1
+        assert submissions[0]['id'] == 'submission_123'
+        assert submissions[0]['form_id'] == str(form['_id'])
+        assert 'submitted_at' in submissions[0]
+        
+        # Verify the form document does not grow
         updated_form = FormModel.get_form_by_name('test_form')
-        assert len(updated_form['submissions']) == 1
-        assert updated_form['submissions'][0]['id'] == 'submission_123'
-        assert 'submitted_at' in updated_form['submissions'][0]
+        assert 'submissions' not in updated_form
     
     def test_add_submission_form_not_found(self, mock_mongo):
         """Test submission addition when form not found"""
@@ -314,25 +549,65 @@ class TestFormModel:
         
         assert result is False
     
+    def test_get_submission(self, mock_mongo):
+        """Test getting a single submission"""
+        form = create_test_form(mock_mongo, FormFactory(name='test_form'))
+        create_test_submission(mock_mongo, form, {'id': 'submission_123', 'responses': {}})
+        
+        assert FormModel.get_submission('test_form', 'submission_123')['id'] == 'submission_123'
+        assert FormModel.get_submission('test_form', 'nonexistent_submission') is None
+        assert FormModel.get_submission('nonexistent_form', 'submission_123') is None
+    
+    def test_add_submission_updates_counters(self, mock_mongo):
+        """Test submission counters are maintained on the form"""
+        create_test_form(mock_mongo, FormFactory(name='test_form'))
+        
+        FormModel.add_submission('test_form', {'id': 'sub_1', 'responses': {}})
+        FormModel.add_submission('test_form', {'id': 'sub_2', 'responses': {}})
+        
+        form = FormModel.get_form_by_name('test_form')
+        today = datetime.now().strftime('%Y-%m-%d')
+        assert form['submission_count'] == 2
+        assert form['daily_submissions'] == {today: 2}
+        assert form['last_submission_at'] is not None
+        
+        FormModel.delete_submission('test_form', 'sub_1')
+        FormModel.delete_submission('test_form', 'sub_1')
+        
+        form = FormModel.get_form_by_name('test_form')
+        assert form['submission_count'] == 1
+        assert form['daily_submissions'] == {today: 1}
+    
+    def test_rebuild_submission_counters(self, mock_mongo):
+        """Test recomputing counters from the submissions collection"""
+        form1 = create_test_form(mock_mongo, FormFactory(name='form_1'))
+        create_test_form(mock_mongo, FormFactory(name='form_2'))
+        create_test_submission(mock_mongo, form1, {'id': 'sub_1', 'submitted_at': datetime(2024, 1, 1, 9), 'responses': {}})
+        create_test_submission(mock_mongo, form1, {'id': 'sub_2', 'submitted_at': datetime(2024, 1, 1, 10), 'responses': {}})
+        create_test_submission(mock_mongo, form1, {'id': 'sub_3', 'submitted_at': datetime(2024, 1, 2, 9), 'responses': {}})
+        
+        FormModel.rebuild_submission_counters()
+        
+        form = FormModel.get_form_by_name('form_1')
+        assert form['submission_count'] == 3
+        assert form['daily_submissions'] == {'2024-01-01': 2, '2024-01-02': 1}
+        assert form['last_submission_at'] == datetime(2024, 1, 2, 9).isoformat()
+        assert FormModel.get_form_by_name('form_2')['submission_count'] == 0
+    
     def test_delete_submission_success(self, mock_mongo):
         """Test successful submission deletion"""
-        form_data = FormFactory(
-            name='test_form',
-            submissions=[
-                {'id': 'submission_123', 'responses': {'q_1': 'Response 1'}},
-                {'id': 'submission_456', 'responses': {'q_1': 'Response 2'}}
-            ]
-        )
-        form = create_test_form(mock_mongo, form_data)
+        form = create_test_form(mock_mongo, FormFactory(name='test_form'))
+        create_test_submission(mock_mongo, form, {'id': 'submission_123', 'responses': {'q_1': 'Response 1'}})
+        create_test_submission(mock_mongo, form, {'id': 'submission_456', 'responses': {'q_1': 'Response 2'}})
         
         result = FormModel.delete_submission('test_form', 'submission_123')
         
         assert result is True
         
         # Verify submission was deleted
-        updated_form = FormModel.get_form_by_name('test_form')
-        assert len(updated_form['submissions']) == 1
-        assert updated_form['submissions'][0]['id'] == 'submission_456'
+        submissions = FormModel.get_submissions('test_form')
+        assert len(submissions) == 1
+        assert submissions[0]['id'] == 'submission_456'
     
     def test_delete_submission_not_found(self, mock_mongo):
         """Test submission deletion when submission not found"""
@@ -340,7 +615,7 @@ class TestFormModel:
         
         result = FormModel.delete_submission('test_form', 'nonexistent_submission')
         
-        assert result is True  # MongoDB update returns success even if no match
+        assert result is True  # Deleting a missing submission is a no-op
     
     def test_delete_submission_form_not_found(self, mock_mongo):
         """Test submission deletion when form not found"""
@@ -348,6 +623,36 @@ class TestFormModel:
         
         assert result is False
     
+    def test_delete_form_removes_submissions(self, mock_mongo):
+        """Test form deletion also removes its submissions"""
+        form = create_test_form(mock_mongo, FormFactory(name='test_form'))
+        create_test_submission(mock_mongo, form, {'id': 'submission_123', 'responses': {}})
+        
+        FormModel.delete_form('test_form')
+        
+        assert mock_mongo.submissions.count_documents({}) == 0
+    
+    def test_migrate_embedded_submissions(self, mock_mongo):
+        """Test moving embedded submissions to the submissions collection"""
+        form = create_test_form(mock_mongo, FormFactory(
+            name='test_form',
+            submissions=[
+                {'id': 'submission_123', 'submitted_at': datetime(2024, 1, 1), 'responses': {'q_1': 'Response 1'}},
+                {'id': 'submission_456', 'submitted_at': datetime(2024, 1, 2), 'responses': {'q_1': 'Response 2'}}
+            ]
+        ))
+        
+        migrated = FormModel.migrate_embedded_submissions()
+        
+        assert migrated == 2
+        assert 'submissions' not in FormModel.get_form_by_name('test_form')
+        submissions = FormModel.get_submissions('test_form')
+        assert [s['id'] for s in submissions] == ['submission_456', 'submission_123']
+        assert all(s['form_id'] == str(form['_id']) for s in submissions)
+        
+        # Running the migration again is a no-op
+        assert FormModel.migrate_embedded_submissions() == 0
+    
     def test_add_collaborator_success(self, mock_mongo):
         """Test successful collaborator addition"""
         form = create_test_form(mock_mongo, FormFactory(name='test_form'))
@@ -359,6 +664,21 @@ class TestFormModel:
         # Verify collaborator was added
         updated_form = FormModel.get_form_by_name('test_form')
         assert 'user_456' in updated_form['permissions']['editor']
+        assert updated_form['members']['user_456'] == 'editor'
+        assert 'user_456' in updated_form['member_ids']
+    
+    def test_add_collaborators_updates_members(self, mock_mongo):
+        """Test bulk additions keep the members map and member_ids in step"""
+        create_test_form(mock_mongo, FormFactory(
+            name='test_form', permissions={'admin': ['user_1'], 'editor': [], 'viewer': []}
+        ))
+        
+        FormModel.add_collaborators('test_form', {'user_456': 'editor', 'user_789': 'viewer'})
+        
+        stored = mock_mongo.forms.find_one({'name': 'test_form'})
+        assert stored['members'] == {'user_1': 'admin', 'user_456': 'editor', 'user_789': 'viewer'}
+        assert sorted(stored['member_ids']) == ['user_1', 'user_456', 'user_789']
+        assert [f['name'] for f in FormModel.get_user_forms('user_789')] == ['test_form']
     
     def test_add_collaborator_form_not_found(self, mock_mongo):
         """Test collaborator addition when form not found"""
@@ -386,6 +706,8 @@ class TestFormModel:
         updated_form = FormModel.get_form_by_name('test_form')
         assert 'user_456' not in updated_form['permissions']['editor']
         assert 'user_789' in updated_form['permissions']['viewer']  # Other collaborators remain
+        assert updated_form['members'] == {'user_123': 'admin', 'user_789': 'viewer'}
+        assert 'user_456' not in updated_form['member_ids']
     
     def test_remove_collaborator_from_multiple_roles(self, mock_mongo):
         """Test collaborator removal from multiple roles"""
@@ -408,6 +730,71 @@ class TestFormModel:
         assert 'user_456' not in updated_form['permissions']['editor']
         assert 'user_456' not in updated_form['permissions']['viewer']
     
+    def test_create_form_builds_members(self, mock_mongo):
+        """Test new forms store a members map with each user's highest role"""
+        FormModel.create_form({
+            'name': 'new_form',
+            'permissions': {'admin': ['user_1'], 'editor': ['user_2'], 'viewer': ['user_2', 'user_3']}
+        })
+        
+        stored = mock_mongo.forms.find_one({'name': 'new_form'})
+        assert stored['members'] == {'user_1': 'admin', 'user_2': 'editor', 'user_3': 'viewer'}
+        assert sorted(stored['member_ids']) == ['user_1', 'user_2', 'user_3']
+    
+    def test_get_members_of_legacy_form(self, mock_mongo):
+        """Test forms stored without a members map get one built from their role lists"""
+        mock_mongo.forms.insert_one({
+            'name': 'legacy_form',
+            'permissions': {'admin': ['user_1'], 'editor': [], 'viewer': ['user_2']}
+        })
+        
+        form = FormModel.get_form_by_name('legacy_form', 'permissions')
+        
+        assert FormModel.get_members(form) == {'user_1': 'admin', 'user_2': 'viewer'}
+        assert FormModel.get_user_forms('user_2') == []
+        
+        assert FormModel.rebuild_members() == 1
+        assert [f['name'] for f in FormModel.get_user_forms('user_2')] == ['legacy_form']
+    
+    def test_backfill_members_of_legacy_forms(self, mock_mongo):
+        """Test the startup backfill builds the members map only where it is missing"""
+        mock_mongo.forms.insert_one({
+            'name': 'legacy_form',
+            'permissions': {'admin': ['user_1'], 'editor': [], 'viewer': ['user_2']}
+        })
+        create_test_form(mock_mongo, FormFactory(name='test_form'))
+        
+        assert FormModel.backfill_members() == 1
+        assert FormModel.backfill_members() == 0
+        assert [f['name'] for f in FormModel.get_user_forms('user_2')] == ['legacy_form']
+    
+    def test_add_collaborator_to_legacy_form(self, mock_mongo):
+        """Test adding a collaborator to a form without a members map builds the whole map"""
+        mock_mongo.forms.insert_one({
+            'name': 'legacy_form',
+            'permissions': {'admin': ['user_1'], 'editor': [], 'viewer': ['user_2']}
+        })
+        
+        assert FormModel.add_collaborators('legacy_form', {'user_3': 'editor', 'user_2': 'admin'}) is True
+        
+        stored = mock_mongo.forms.find_one({'name': 'legacy_form'})
+        assert stored['members'] == {'user_1': 'admin', 'user_2': 'admin', 'user_3': 'editor'}
+        assert sorted(stored['member_ids']) == ['user_1', 'user_2', 'user_3']
+        assert stored['permissions'] == {'admin': ['user_1', 'user_2'], 'editor': ['user_3'], 'viewer': ['user_2']}
+    
+    def test_remove_collaborator_from_legacy_form(self, mock_mongo):
+        """Test removing a collaborator from a form without a members map keeps the others"""
+        mock_mongo.forms.insert_one({
+            'name': 'legacy_form',
+            'permissions': {'admin': ['user_1'], 'editor': ['user_2'], 'viewer': ['user_3']}
+        })
+        
+        assert FormModel.remove_collaborator('legacy_form', 'user_2') is True
+        
+        stored = mock_mongo.forms.find_one({'name': 'legacy_form'})
+        assert stored['members'] == {'user_1': 'admin', 'user_3': 'viewer'}
+        assert [f['name'] for f in FormModel.get_user_forms('user_3')] == ['legacy_form']
+    
     def test_remove_collaborator_not_found(self, mock_mongo):
         """Test collaborator removal when collaborator not found"""
         form = create_test_form(mock_mongo, FormFactory(name='test_form'))
@@ -434,6 +821,7 @@ class TestDatabaseConnection:
         assert db_manager.db is not None
         assert db_manager.users_collection is not None
         assert db_manager.forms_collection is not None
+        assert db_manager.submissions_collection is not None
     
     def test_collection_access(self, mock_mongo):
         """Test collection access methods"""
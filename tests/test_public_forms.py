@@ -492,7 +492,7 @@ class TestPublicFormSecurity:
         malicious_data = {
             'responses': {
                 'q_1': '<script>alert("xss")</script>',
-                'q_2': ''; DROP TABLE users; --',
+                'q_2': "'; DROP TABLE users; --",
                 'q_3': '\\x00\\x01\\x02',  # Binary data
                 '__proto__': 'malicious',  # Prototype pollution attempt
                 'eval': 'dangerous_code()'
@@ -516,4 +516,7 @@ class TestPublicFormSecurity:
             
             # Data should be preserved for analysis but handled safely
             assert '<script>' in responses['q_1']
-            assert 'DROP TABLE' in responses['q_2']
\ No newline at end of file
+            
+            # Answers to questions the form doesn't have are not stored
+            assert 'q_2' not in responses
+            assert '__proto__' not in responses
\ No newline at end of file
@@ -0,0 +1,249 @@
+"""
+Rate limiting tests for aForm application
+"""
+import pytest
+import json
+from unittest.mock import MagicMock, patch
+from werkzeug.middleware.proxy_fix import ProxyFix
+
+from models import FormModel
+from ratelimit import MemoryBucketStore, RateLimiter, parse_rate
+from tests.conftest import FormFactory, create_test_form
+
+
+@pytest.mark.unit
+class TestParseRate:
+    """Test parsing of count/seconds limits"""
+
+    def test_valid(self):
+        """Test limits parse into (count, seconds)"""
+        assert parse_rate('30/60') == (30, 60.0)
+        assert parse_rate('5/0.5') == (5, 0.5)
+
+    def test_unlimited(self):
+        """Test empty and zero limits mean unlimited"""
+        assert parse_rate(None) is None
+        assert parse_rate('') is None
+        assert parse_rate('0') is None
+        assert parse_rate(0) is None
+
+    @pytest.mark.parametrize('value', ['30', 'a/60', '0/60', '30/0', '30/60/1'])
+    def test_invalid(self, value):
+        """Test malformed limits are rejected"""
+        with pytest.raises(ValueError):
+            parse_rate(value)
+
+
+@pytest.mark.unit
+class TestMemoryBucketStore:
+    """Test the in-process token buckets"""
+
+    def test_bucket_empties_and_refills(self):
+        """Test a bucket allows count requests, then refills over time"""
+        store = MemoryBucketStore()
+
+        with patch('ratelimit.time.monotonic', return_value=100.0):
+            assert [store.take('key', 2, 10) for _ in range(2)] == [0, 0]
+            assert store.take('key', 2, 10) == pytest.approx(5.0)
+
+        with patch('ratelimit.time.monotonic', return_value=105.0):
+            assert store.take('key', 2, 10) == 0
+            assert store.take('key', 2, 10) > 0
+
+    def test_least_recently_used_evicted(self):
+        """Test buckets beyond max_keys are evicted"""
+        store = MemoryBucketStore(max_keys=1)
+
+        store.take('a', 1, 60)
+        store.take('b', 1, 60)
+
+        assert store.take('a', 1, 60) == 0
+
+
+@pytest.mark.unit
+class TestRateLimiter:
+    """Test per-client and per-form limits"""
+
+    def test_client_limit(self):
+        """Test each client gets its own bucket"""
+        limiter = RateLimiter({'submit': {'client': (1, 60)}})
+
+        assert limiter.check('submit', 'form', '1.1.1.1') == 0
+        assert limiter.check('submit', 'form', '1.1.1.1') == 60
+        assert limiter.check('submit', 'form', '2.2.2.2') == 0
+        assert limiter.stats()['rejected']['submit'] == 1
+
+    def test_form_limit(self):
+        """Test the form bucket is shared by all clients"""
+        limiter = RateLimiter({'submit': {'form': (1, 60)}})
+
+        assert limiter.check('submit', 'form', '1.1.1.1') == 0
+        assert limiter.check('submit', 'form', '2.2.2.2') > 0
+        assert limiter.check('submit', 'other_form', '2.2.2.2') == 0
+
+    def test_form_override(self):
+        """Test a form's rate limits override the default limits"""
+        limiter = RateLimiter({'submit': {'client': (100, 60)}})
+        form = {'name': 'form', 'rate_limits': {'submit': {'client': '1/60'}}}
+
+        assert limiter.check('submit', 'form', '1.1.1.1', form) == 0
+        assert limiter.check('submit', 'form', '1.1.1.1', form) > 0
+
+    def test_zero_override_lifts_limit(self):
+        """Test an override of 0 removes the default limit"""
+        limiter = RateLimiter({'submit': {'client': (1, 60)}})
+        form = {'name': 'form', 'rate_limits': {'submit': {'client': 0}}}
+
+        assert [limiter.check('submit', 'form', '1.1.1.1', form) for _ in range(3)] == [0, 0, 0]
+
+    def test_rejected_request_takes_no_tokens(self):
+        """Test a request the form bucket rejects doesn't use up the client's bucket"""
+        limiter = RateLimiter({'submit': {'client': (1, 60), 'form': (1, 60)}})
+
+        assert limiter.check('submit', 'form', '1.1.1.1') == 0
+        assert limiter.check('submit', 'form', '2.2.2.2') > 0
+        assert limiter.store.take('submit:form:client:2.2.2.2', 1, 60) == 0
+
+    def test_client_checked_before_form_known(self):
+        """Test a client bucket checked without the form uses the override the form last had"""
+        limiter = RateLimiter({'submit': {'client': (100, 60)}})
+        form = {'name': 'form', 'rate_limits': {'submit': {'client': '1/60'}}}
+
+        assert limiter.check('submit', 'form', '1.1.1.1', buckets=('client',)) == 0
+        assert limiter.check('submit', 'form', '1.1.1.1', form, buckets=('form',)) == 0
+        assert limiter.check('submit', 'form', '2.2.2.2', buckets=('client',)) == 0
+        assert limiter.check('submit', 'form', '2.2.2.2', buckets=('client',)) > 0
+        assert limiter.stats()['allowed']['submit'] == 1
+
+    def test_store_failure_allows_request(self):
+        """Test requests are let through when the store fails"""
+        store = MagicMock()
+        store.take_all.side_effect = Exception('connection refused')
+        limiter = RateLimiter({'submit': {'client': (1, 60)}}, store)
+
+        assert limiter.check('submit', 'form', '1.1.1.1') == 0
+        assert limiter.stats()['store_errors'] == 1
+
+
+@pytest.mark.api
+class TestRateLimitedEndpoints:
+    """Test 429 responses on the public form endpoints"""
+
+    def test_submit_rate_limited(self, client, mock_mongo):
+        """Test submissions over the limit get 429 with Retry-After"""
+        create_test_form(mock_mongo, FormFactory(name='test_form', status='published'))
+        limiter = RateLimiter({'submit': {'client': (1, 60)}})
+
+        with patch('app.rate_limiter', limiter):
+            first = client.post('/api/form/test_form/submit',
+                              data=json.dumps({'responses': {}}),
+                              content_type='application/json')
+            second = client.post('/api/form/test_form/submit',
+                               data=json.dumps({'responses': {}}),
+                               content_type='application/json')
+
+        assert first.status_code == 200
+        assert second.status_code == 429
+        assert second.headers['Retry-After'] == '60'
+        assert mock_mongo.submissions.count_documents({}) == 1
+
+    def test_client_rejected_before_form_read(self, client, mock_mongo):
+        """Test a client over its limit is turned away without reading the form"""
+        create_test_form(mock_mongo, FormFactory(name='test_form', status='published'))
+        limiter = RateLimiter({'submit': {'client': (1, 60)}})
+
+        with patch('app.rate_limiter', limiter):
+            client.post('/api/form/test_form/submit', data=json.dumps({'responses': {}}),
+                        content_type='application/json')
+            with patch('app.FormModel.get_form_by_name') as get_form_by_name:
+                response = client.post('/api/form/test_form/submit', data=json.dumps({'responses': {}}),
+                                       content_type='application/json')
+
+        assert response.status_code == 429
+        get_form_by_name.assert_not_called()
+
+    def test_render_rate_limited(self, client, mock_mongo):
+        """Test form page loads over the limit get 429"""
+        create_test_form(mock_mongo, FormFactory(name='test_form', status='published'))
+        limiter = RateLimiter({'render': {'client': (1, 60)}})
+
+        with patch('app.rate_limiter', limiter):
+            assert client.get('/submit/test_form').status_code == 200
+            response = client.get('/submit/test_form')
+
+        assert response.status_code == 429
+        assert 'Retry-After' in response.headers
+
+    def test_client_address_from_trusted_proxy(self, app, client, mock_mongo):
+        """Test clients behind a trusted proxy are told apart by X-Forwarded-For"""
+        create_test_form(mock_mongo, FormFactory(name='test_form', status='published'))
+        limiter = RateLimiter({'render': {'client': (1, 60)}})
+
+        with patch('app.rate_limiter', limiter), patch.object(app, 'wsgi_app', ProxyFix(app.wsgi_app, x_for=1)):
+            first = client.get('/submit/test_form', headers={'X-Forwarded-For': '1.1.1.1'})
+            second = client.get('/submit/test_form', headers={'X-Forwarded-For': '2.2.2.2'})
+
+        assert first.status_code == 200
+        assert second.status_code == 200
+
+
+@pytest.mark.api
+class TestRateLimitSettings:
+    """Test the per-form rate limit endpoint"""
+
+    def test_admin_sets_limits(self, client, mock_mongo, authenticated_session):
+        """Test form admins can override the limits"""
+        create_test_form(mock_mongo, FormFactory(
+            name='test_form', permissions={'admin': [authenticated_session['id']], 'editor': [], 'viewer': []}
+        ))
+
+        response = client.put('/api/form/test_form/rate-limits',
+                            data=json.dumps({'submit': {'client': '5/60'}}),
+                            content_type='application/json')
+
+        assert response.status_code == 200
+        stored = mock_mongo.forms.find_one({'name': 'test_form'})
+        assert stored['rate_limits'] == {'submit': {'client': '5/60'}}
+        assert 'rate_limits' not in FormModel.build_public_schema(stored)['settings']
+
+    def test_zero_limit_accepted(self, client, mock_mongo, authenticated_session):
+        """Test an integer 0 lifts a limit"""
+        create_test_form(mock_mongo, FormFactory(
+            name='test_form', permissions={'admin': [authenticated_session['id']], 'editor': [], 'viewer': []}
+        ))
+
+        response = client.put('/api/form/test_form/rate-limits',
+                            data=json.dumps({'submit': {'client': 0}}),
+                            content_type='application/json')
+
+        assert response.status_code == 200
+        assert mock_mongo.forms.find_one({'name': 'test_form'})['rate_limits'] == {'submit': {'client': '0'}}
+
+    @pytest.mark.parametrize('payload', [
+        {'export': {'client': '5/60'}},
+        {'submit': {'ip': '5/60'}},
+        {'submit': {'client': 'fast'}}
+    ])
+    def test_invalid_limits_rejected(self, client, mock_mongo, authenticated_session, payload):
+        """Test unknown scopes, buckets and malformed limits are rejected"""
+        create_test_form(mock_mongo, FormFactory(
+            name='test_form', permissions={'admin': [authenticated_session['id']], 'editor': [], 'viewer': []}
+        ))
+
+        response = client.put('/api/form/test_form/rate-limits',
+                            data=json.dumps(payload),
+                            content_type='application/json')
+
+        assert response.status_code == 400
+
+    def test_non_admin_forbidden(self, client, mock_mongo, authenticated_session):
+        """Test users who don't admin the form can't change its limits"""
+        create_test_form(mock_mongo, FormFactory(
+            name='test_form', permissions={'admin': ['someone_else'], 'editor': [authenticated_session['id']], 'viewer': []}
+        ))
+
+        response = client.put('/api/form/test_form/rate-limits',
+                            data=json.dumps({'submit': {'client': '5/60'}}),
+                            content_type='application/json')
+
+        assert response.status_code == 403
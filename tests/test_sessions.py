@@ -0,0 +1,143 @@
+"""
+Session tests for aForm application
+"""
+import pytest
+from unittest.mock import patch
+
+from flask import session
+
+from auth import auth_manager
+from models import UserModel
+from sessions import RedisSessionInterface
+from tests.conftest import UserFactory, log_in
+
+
+class FakeRedis:
+    """In-memory stand-in for the Redis commands the session store uses"""
+
+    def __init__(self):
+        self.data = {}
+        self.ttls = {}
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def setex(self, key, seconds, value):
+        self.data[key] = value
+        self.ttls[key] = seconds
+
+    def expire(self, key, seconds):
+        self.ttls[key] = seconds
+
+    def delete(self, key):
+        self.data.pop(key, None)
+        self.ttls.pop(key, None)
+
+
+@pytest.mark.auth
+class TestCompactSession:
+    """Test the session holds only the user's ID, role and version"""
+
+    def test_login_stores_compact_user(self, client, mock_mongo):
+        """Test logging in stores only the ID, role and version"""
+        user = UserModel.upsert_user({'email': 'compact@example.com', 'name': 'Compact', 'picture': 'http://example.com/p.jpg'})
+
+        with client.application.test_request_context():
+            auth_manager.login_user(user)
+            assert session['user'] == {'id': user['id'], 'role': 'user', 'v': 0}
+
+    def test_role_change_applies_to_existing_session(self, client, mock_mongo):
+        """Test a role change takes effect without logging in again"""
+        user = log_in(client, UserFactory(role='user'))
+        assert client.get('/api/metrics').status_code == 403
+
+        UserModel.update_user(user['id'], {'role': 'admin'})
+
+        assert client.get('/api/metrics').status_code == 200
+        with client.session_transaction() as sess:
+            assert sess['user']['role'] == 'admin'
+
+    def test_revoked_session_logged_out(self, client, mock_mongo):
+        """Test revoking a user's sessions logs them out"""
+        user = log_in(client, UserFactory())
+        assert client.get('/').status_code == 200
+
+        UserModel.revoke_sessions(user['id'])
+
+        assert client.get('/').status_code == 302
+        with client.session_transaction() as sess:
+            assert 'user' not in sess
+
+    def test_inactive_user_logged_out(self, client, mock_mongo):
+        """Test deactivated users lose their sessions"""
+        user = log_in(client, UserFactory())
+
+        UserModel.update_user(user['id'], {'status': 'disabled'})
+
+        assert client.get('/').status_code == 302
+
+    def test_deleted_user_logged_out(self, client, mock_mongo):
+        """Test sessions of users who no longer exist are ended"""
+        user = log_in(client, UserFactory())
+        mock_mongo.users.delete_one({'id': user['id']})
+
+        assert client.get('/').status_code == 302
+
+    def test_legacy_session_rewritten(self, client, mock_mongo):
+        """Test sessions holding a whole user document are compacted"""
+        user = UserFactory()
+        mock_mongo.users.insert_one(dict(user))
+        with client.session_transaction() as sess:
+            sess['user'] = user
+
+        assert client.get('/').status_code == 200
+        with client.session_transaction() as sess:
+            assert sess['user'] == {'id': user['id'], 'role': user['role'], 'v': 0}
+
+
+@pytest.mark.auth
+class TestRedisSessionInterface:
+    """Test the server-side session store"""
+
+    @pytest.fixture
+    def store(self, app):
+        redis_client = FakeRedis()
+        with patch.object(app, 'session_interface', RedisSessionInterface(redis_client)):
+            yield redis_client
+
+    def test_cookie_holds_only_session_id(self, client, mock_mongo, store):
+        """Test session data is kept in the store, not the cookie"""
+        user = log_in(client, UserFactory())
+
+        assert client.get('/').status_code == 200
+        assert len(store.data) == 1
+        cookie = client.get_cookie('session')
+        assert user['id'] not in cookie.value
+        assert store.ttls[next(iter(store.data))] == int(client.application.permanent_session_lifetime.total_seconds())
+
+    def test_login_rotates_session_id(self, client, mock_mongo, store):
+        """Test the session ID changes when a user logs in"""
+        with client.session_transaction() as sess:
+            sess['next'] = '/'
+        before = client.get_cookie('session').value
+
+        log_in(client, UserFactory())
+
+        assert client.get_cookie('session').value != before
+        assert len(store.data) == 1
+
+    def test_logout_deletes_session(self, client, mock_mongo, store):
+        """Test logging out removes the stored session"""
+        log_in(client, UserFactory())
+
+        client.get('/logout')
+
+        assert store.data == {}
+
+    def test_tampered_cookie_ignored(self, client, mock_mongo, store):
+        """Test session IDs without a valid signature start a new session"""
+        log_in(client, UserFactory())
+        sid = next(iter(store.data))[len('session:'):]
+        client.set_cookie('session', f'{sid}.forged')
+
+        assert client.get('/').status_code == 302
@@ -0,0 +1,211 @@
+"""
+File upload tests for aForm application
+"""
+import pytest
+import hashlib
+import io
+import json
+from unittest.mock import patch
+
+import mongomock.gridfs
+
+from models import FormModel, serialize_doc
+from uploads import DiskBlobStore, GridFSBlobStore, UploadError, UploadManager
+from tests.conftest import FormFactory, create_test_form
+
+FILE_QUESTION = {
+    'id': 'q_1', 'title': 'Resume', 'type': 'file', 'required': True,
+    'maxFileSize': 1, 'fileTypes': ['.pdf', '.txt'], 'allowMultipleFiles': True
+}
+
+
+@pytest.fixture
+def manager(tmp_path):
+    """Upload manager storing files under a temporary directory, with tiny chunks"""
+    upload_manager = UploadManager(
+        DiskBlobStore(str(tmp_path / 'files')),
+        staging_dir=str(tmp_path / 'partial'),
+        max_size=2 * 1024 * 1024,
+        chunk_size=4
+    )
+    with patch('app.upload_manager', upload_manager):
+        yield upload_manager
+
+
+@pytest.fixture
+def upload_form(mock_mongo):
+    """A published form with a file question, as routes read it"""
+    return serialize_doc(create_test_form(mock_mongo, FormFactory(
+        name='test_form', status='published', questions=[dict(FILE_QUESTION)]
+    )))
+
+
+def upload_all(manager, form, upload, content):
+    """Send content in chunk_size chunks"""
+    offset = 0
+    while offset < len(content):
+        upload = manager.write_chunk(form, upload['id'], offset, io.BytesIO(content[offset:offset + manager.chunk_size]))
+        offset = upload['received']
+    return upload
+
+
+@pytest.mark.database
+class TestUploadManager:
+    """Test chunked uploads, limits and deduplication"""
+
+    def test_chunked_upload(self, manager, upload_form):
+        """Test chunks are stored in order and the file is stored under its hash"""
+        content = b'hello world'
+        upload = manager.create(upload_form, 'q_1', 'a.txt', len(content), 'text/plain')
+
+        upload = upload_all(manager, upload_form, upload, content)
+
+        assert upload['status'] == 'complete'
+        assert upload['sha256'] == hashlib.sha256(content).hexdigest()
+        with manager.open(upload) as stored:
+            assert stored.read() == content
+
+    def test_out_of_order_chunk_rejected(self, manager, upload_form):
+        """Test a chunk at the wrong offset gets 409 with the offset to resume from"""
+        upload = manager.create(upload_form, 'q_1', 'a.txt', 8, 'text/plain')
+        manager.write_chunk(upload_form, upload['id'], 0, io.BytesIO(b'abcd'))
+
+        with pytest.raises(UploadError) as exc_info:
+            manager.write_chunk(upload_form, upload['id'], 0, io.BytesIO(b'abcd'))
+
+        assert exc_info.value.status == 409
+        assert exc_info.value.offset == 4
+
+    def test_oversized_chunk_rejected(self, manager, upload_form):
+        """Test chunks beyond the chunk size or the declared file size are rejected"""
+        upload = manager.create(upload_form, 'q_1', 'a.txt', 6, 'text/plain')
+
+        with pytest.raises(UploadError) as exc_info:
+            manager.write_chunk(upload_form, upload['id'], 0, io.BytesIO(b'abcdef'))
+
+        assert exc_info.value.status == 413
+        assert manager.get(upload_form, upload['id'])['received'] == 0
+
+    @pytest.mark.parametrize('name,size,mime_type', [
+        ('a.exe', 10, 'application/x-msdownload'),
+        ('a.pdf', 2 * 1024 * 1024, 'application/pdf'),
+        ('a.pdf', 0, 'application/pdf')
+    ])
+    def test_question_limits(self, manager, upload_form, name, size, mime_type):
+        """Test the question's file type and size limits apply before any bytes are sent"""
+        with pytest.raises(UploadError):
+            manager.create(upload_form, 'q_1', name, size, mime_type)
+
+    def test_identical_files_stored_once(self, manager, upload_form, tmp_path):
+        """Test uploads with the same content share one stored file"""
+        content = b'same bytes'
+        first = upload_all(manager, upload_form, manager.create(upload_form, 'q_1', 'a.txt', len(content), 'text/plain'), content)
+        second = upload_all(manager, upload_form, manager.create(upload_form, 'q_1', 'b.txt', len(content), 'text/plain'), content)
+
+        assert first['sha256'] == second['sha256']
+        assert [path.name for path in (tmp_path / 'files').rglob('*') if path.is_file()] == [first['sha256']]
+        assert manager.stats()['deduplicated'] == 1
+        assert list((tmp_path / 'partial').iterdir()) == []
+
+    def test_attach_replaces_answers(self, manager, upload_form):
+        """Test file answers become references to completed uploads"""
+        upload = upload_all(manager, upload_form, manager.create(upload_form, 'q_1', 'a.txt', 4, 'text/plain'), b'data')
+
+        responses = manager.attach(upload_form, {'q_1': [{'upload_id': upload['id'], 'name': 'renamed.txt', 'size': 1}]})
+
+        assert responses['q_1'] == [{
+            'upload_id': upload['id'], 'name': 'a.txt', 'size': 4, 'type': 'text/plain', 'sha256': upload['sha256']
+        }]
+
+
+@pytest.mark.database
+class TestGridFSBlobStore:
+    """Test storing uploads in GridFS"""
+
+    def test_store_and_deduplicate(self, mock_mongo, tmp_path):
+        """Test files are stored once per hash and read back"""
+        mongomock.gridfs.enable_gridfs_integration()
+        store = GridFSBlobStore(lambda: mock_mongo)
+
+        for name in ('a.part', 'b.part'):
+            staged = tmp_path / name
+            staged.write_bytes(b'content')
+            store.put('abc123', str(staged), {'name': name})
+            assert not staged.exists()
+
+        assert store.exists('abc123')
+        assert mock_mongo['uploads.files'].count_documents({}) == 1
+        assert store.open('abc123').read() == b'content'
+
+
+@pytest.mark.api
+class TestUploadEndpoints:
+    """Test the upload API and file answers on submit"""
+
+    def test_resumable_upload_and_submit(self, client, manager, upload_form, mock_mongo):
+        """Test a file uploaded in chunks is referenced by the stored submission"""
+        content = b'%PDF-resume'
+        created = client.post('/api/form/test_form/uploads',
+                            data=json.dumps({'question_id': 'q_1', 'name': 'cv.pdf',
+                                             'size': len(content), 'type': 'application/pdf'}),
+                            content_type='application/json')
+        assert created.status_code == 201
+        upload_id = json.loads(created.data)['upload_id']
+
+        client.put(f'/api/form/test_form/uploads/{upload_id}', data=content[:4],
+                   headers={'Upload-Offset': '0'})
+        status = client.get(f'/api/form/test_form/uploads/{upload_id}')
+        assert json.loads(status.data)['offset'] == 4
+
+        offset = 4
+        while offset < len(content):
+            response = client.put(f'/api/form/test_form/uploads/{upload_id}', data=content[offset:offset + 4],
+                                  headers={'Upload-Offset': str(offset)})
+            offset = json.loads(response.data)['offset']
+        assert json.loads(response.data)['complete'] is True
+
+        response = client.post('/api/form/test_form/submit',
+                             data=json.dumps({'responses': {'q_1': [{'upload_id': upload_id, 'name': 'cv.pdf', 'size': len(content)}]}}),
+                             content_type='application/json')
+
+        assert response.status_code == 200
+        stored = mock_mongo.submissions.find_one()['responses']['q_1']
+        assert stored[0]['upload_id'] == upload_id
+        assert stored[0]['sha256'] == hashlib.sha256(content).hexdigest()
+
+    def test_chunk_at_wrong_offset(self, client, manager, upload_form):
+        """Test a chunk at the wrong offset gets 409 and the offset to resume from"""
+        upload = manager.create(upload_form, 'q_1', 'a.txt', 8, 'text/plain')
+
+        response = client.put(f"/api/form/test_form/uploads/{upload['id']}", data=b'abcd',
+                              headers={'Upload-Offset': '4'})
+
+        assert response.status_code == 409
+        assert response.headers['Upload-Offset'] == '0'
+
+    def test_submit_without_upload_rejected(self, client, manager, upload_form, mock_mongo):
+        """Test file answers that don't refer to a completed upload are rejected"""
+        response = client.post('/api/form/test_form/submit',
+                             data=json.dumps({'responses': {'q_1': [{'name': 'cv.pdf', 'size': 10, 'type': 'application/pdf'}]}}),
+                             content_type='application/json')
+
+        assert response.status_code == 400
+        assert 'q_1' in json.loads(response.data)['errors']
+        assert mock_mongo.submissions.count_documents({}) == 0
+
+    def test_download_requires_permission(self, client, manager, mock_mongo, authenticated_session):
+        """Test files can be downloaded by users who can view submissions"""
+        form = serialize_doc(create_test_form(mock_mongo, FormFactory(
+            name='test_form', status='published', questions=[dict(FILE_QUESTION)],
+            permissions={'admin': [authenticated_session['id']], 'editor': [], 'viewer': []}
+        )))
+        upload = upload_all(manager, form, manager.create(form, 'q_1', 'a.txt', 4, 'text/plain'), b'data')
+
+        response = client.get(f"/api/form/test_form/uploads/{upload['id']}/file")
+
+        assert response.status_code == 200
+        assert response.data == b'data'
+        assert 'a.txt' in response.headers['Content-Disposition']
+
+        FormModel.remove_collaborator('test_form', authenticated_session['id'])
+        assert client.get(f"/api/form/test_form/uploads/{upload['id']}/file").status_code == 403
@@ -0,0 +1,178 @@
+"""
+Submission validation tests for aForm application
+"""
+import pytest
+import json
+from unittest.mock import patch
+
+from validation import SubmissionValidator, ValidationError, ValidatorCache, validator_cache
+from models import FormModel
+from tests.conftest import FormFactory, create_test_form
+
+
+def errors_for(questions, responses):
+    """Validate responses and return the error messages by question ID"""
+    try:
+        SubmissionValidator(questions).validate(responses)
+    except ValidationError as e:
+        return e.errors
+    return {}
+
+
+@pytest.mark.unit
+class TestSubmissionValidator:
+    """Test SubmissionValidator checks per question type"""
+
+    def test_required(self):
+        """Test required questions must be answered"""
+        questions = [
+            {'id': 'q_1', 'type': 'text', 'required': True},
+            {'id': 'q_2', 'type': 'checkbox', 'required': True, 'options': ['A']},
+            {'id': 'q_3', 'type': 'text', 'required': False}
+        ]
+
+        assert set(errors_for(questions, {'q_1': '', 'q_2': []})) == {'q_1', 'q_2'}
+        assert errors_for(questions, {'q_1': 'x', 'q_2': ['A']}) == {}
+
+    def test_unknown_answers_dropped(self):
+        """Test answers to questions the form doesn't have are not kept"""
+        validator = SubmissionValidator([{'id': 'q_1', 'type': 'text'}])
+
+        assert validator.validate({'q_1': 'x', 'q_9': 'extra'}) == {'q_1': 'x'}
+
+    def test_number_answers_stored_as_numbers(self):
+        """Test number answers are parsed, keeping integers integral"""
+        validator = SubmissionValidator([{'id': 'q_1', 'type': 'number'}, {'id': 'q_2', 'type': 'number'}])
+
+        assert validator.validate({'q_1': '25.5', 'q_2': '30'}) == {'q_1': 25.5, 'q_2': 30}
+
+    def test_responses_must_be_object(self):
+        """Test a non-object responses payload is rejected"""
+        with pytest.raises(ValidationError):
+            SubmissionValidator([]).validate(['q_1'])
+
+    @pytest.mark.parametrize('question,valid,invalid', [
+        ({'type': 'email'}, 'user@example.com', 'user@domain'),
+        ({'type': 'phone'}, '(555) 123-4567', '123'),
+        ({'type': 'url'}, 'https://example.com/path', 'example.com'),
+        ({'type': 'number', 'minValue': 0, 'maxValue': 100}, '25.5', 101),
+        ({'type': 'number'}, 7, 'seven'),
+        ({'type': 'date', 'minDate': '2023-01-01'}, '2023-06-15', '2022-12-31'),
+        ({'type': 'date'}, '2023-06-15', '15/06/2023'),
+        ({'type': 'time'}, '14:30', '25:00'),
+        ({'type': 'rating', 'ratingScale': 5}, '5', 6),
+        ({'type': 'textarea', 'charLimit': 5}, 'short', 'too long'),
+        ({'type': 'select', 'options': ['A', 'B']}, 'A', 'C'),
+        ({'type': 'select', 'multiple': True, 'options': ['A', 'B']}, ['A', 'B'], 'A'),
+        ({'type': 'radio', 'options': ['Yes', 'No']}, 'No', 'Maybe'),
+        ({'type': 'checkbox', 'options': ['A', 'B']}, ['B'], ['A', 'Z']),
+        ({'type': 'text'}, 'text', {'nested': 'object'}),
+    ])
+    def test_type_checks(self, question, valid, invalid):
+        """Test each question type accepts valid and rejects invalid answers"""
+        questions = [dict(question, id='q_1')]
+
+        assert errors_for(questions, {'q_1': valid}) == {}
+        assert 'q_1' in errors_for(questions, {'q_1': invalid})
+
+    def test_file_constraints(self):
+        """Test file count, size and type constraints"""
+        questions = [{
+            'id': 'q_1', 'type': 'file', 'maxFileSize': 1,
+            'fileTypes': ['.pdf', 'image/*'], 'allowMultipleFiles': False
+        }]
+        pdf = {'name': 'cv.pdf', 'size': 1000, 'type': 'application/pdf'}
+
+        assert errors_for(questions, {'q_1': [pdf]}) == {}
+        assert errors_for(questions, {'q_1': [{'name': 'a.png', 'size': 10, 'type': 'image/png'}]}) == {}
+        assert 'q_1' in errors_for(questions, {'q_1': [pdf, pdf]})
+        assert 'q_1' in errors_for(questions, {'q_1': [dict(pdf, size=2 * 1024 * 1024)]})
+        assert 'q_1' in errors_for(questions, {'q_1': [dict(pdf, name='run.exe', type='application/x-msdownload')]})
+
+    def test_phone_extension(self):
+        """Test phone extensions are kept only when the question allows them"""
+        with_ext = SubmissionValidator([{'id': 'q_1', 'type': 'phone', 'allowExtension': True}])
+        without_ext = SubmissionValidator([{'id': 'q_1', 'type': 'phone'}])
+        responses = {'q_1': '555-123-4567', 'q_1_ext': '123'}
+
+        assert with_ext.validate(responses) == responses
+        assert without_ext.validate(responses) == {'q_1': '555-123-4567'}
+        assert 'q_1_ext' in errors_for([{'id': 'q_1', 'type': 'phone', 'allowExtension': True}],
+                                       {'q_1': '555-123-4567', 'q_1_ext': 'abc'})
+
+
+@pytest.mark.unit
+class TestValidatorCache:
+    """Test compiled validators are cached per form version"""
+
+    def test_reused_until_form_changes(self):
+        """Test the validator is compiled once per form version"""
+        cache = ValidatorCache()
+        form = {'name': 'form', 'updated_at': 'v1', 'questions': []}
+
+        validator = cache.get(form)
+        assert cache.get(dict(form)) is validator
+        assert cache.get(dict(form, updated_at='v2')) is not validator
+
+    def test_invalidate(self):
+        """Test invalidation drops the compiled validator"""
+        cache = ValidatorCache()
+        form = {'name': 'form', 'updated_at': 'v1', 'questions': []}
+        validator = cache.get(form)
+
+        cache.invalidate('form')
+
+        assert cache.get(form) is not validator
+
+    def test_update_form_invalidates(self, mock_mongo):
+        """Test saving new questions drops the form's validator"""
+        create_test_form(mock_mongo, FormFactory(name='test_form'))
+
+        with patch.object(validator_cache, 'invalidate') as mock_invalidate:
+            FormModel.update_form('test_form', {'questions': []})
+            mock_invalidate.assert_called_once_with('test_form')
+
+
+@pytest.mark.api
+class TestSubmitValidation:
+    """Test the submit endpoint validates answers"""
+
+    def test_invalid_submission_rejected(self, client):
+        """Test invalid answers get a 400 with per-question errors and are not stored"""
+        form = FormFactory(
+            name='test_form',
+            status='published',
+            questions=[
+                {'id': 'q_1', 'title': 'Email', 'type': 'email', 'required': True},
+                {'id': 'q_2', 'title': 'Age', 'type': 'number', 'minValue': 0}
+            ]
+        )
+
+        with patch('models.FormModel.get_form_by_name', return_value=form), \
+             patch('models.FormModel.add_submission', return_value=True) as mock_add:
+
+            response = client.post('/api/form/test_form/submit',
+                                 data=json.dumps({'responses': {'q_1': 'not-an-email', 'q_2': -1}}),
+                                 content_type='application/json')
+
+            assert response.status_code == 400
+            assert set(json.loads(response.data)['errors']) == {'q_1', 'q_2'}
+            mock_add.assert_not_called()
+
+    def test_valid_submission_stored(self, client):
+        """Test valid answers are stored"""
+        form = FormFactory(
+            name='test_form',
+            status='published',
+            questions=[{'id': 'q_1', 'title': 'Email', 'type': 'email', 'required': True}]
+        )
+
+        with patch('models.FormModel.get_form_by_name', return_value=form), \
+             patch('models.FormModel.add_submission', return_value=True) as mock_add:
+
+            response = client.post('/api/form/test_form/submit',
+                                 data=json.dumps({'responses': {'q_1': 'user@example.com'}}),
+                                 content_type='application/json')
+
+            assert response.status_code == 200
+            assert mock_add.call_args[0][1]['responses'] == {'q_1': 'user@example.com'}
@@ -0,0 +1,318 @@
+"""
+File uploads for file questions: resumable chunked uploads stored by content hash on disk or in GridFS
+"""
+import hashlib
+import logging
+import os
+import shutil
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from models import UploadModel
+from validation import SubmissionValidator, ValidationError
+
+logger = logging.getLogger(__name__)
+
+# Block size for streaming request bodies and files without holding them in memory
+COPY_BLOCK_SIZE = 64 * 1024
+
+UPLOAD_STORAGES = ('disk', 'gridfs')
+
+class UploadError(Exception):
+    """An upload request that can't be accepted"""
+
+    def __init__(self, message, status=400, offset=None):
+        super().__init__(message)
+        self.status = status
+        self.offset = offset
+
+class DiskBlobStore:
+    """Stores files on disk under root/<sha[:2]>/<sha>"""
+
+    def __init__(self, root):
+        self.root = root
+
+    def _path(self, sha256):
+        return os.path.join(self.root, sha256[:2], sha256)
+
+    def exists(self, sha256):
+        return os.path.exists(self._path(sha256))
+
+    def put(self, sha256, staged_path, metadata):
+        """Move a staged file into the store; a file already stored under its hash is kept"""
+        path = self._path(sha256)
+        if os.path.exists(path):
+            os.remove(staged_path)
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(staged_path, path)
+
+    def open(self, sha256):
+        return open(self._path(sha256), 'rb')
+
+class GridFSBlobStore:
+    """Stores files in a GridFS bucket, using the content hash as the file ID"""
+
+    def __init__(self, get_database, bucket_name='uploads'):
+        self._get_database = get_database
+        self.bucket_name = bucket_name
+
+    def _bucket(self):
+        import gridfs
+        return gridfs.GridFSBucket(self._get_database(), self.bucket_name)
+
+    def exists(self, sha256):
+        return self._get_database()[f'{self.bucket_name}.files'].find_one({'_id': sha256}, {'_id': 1}) is not None
+
+    def put(self, sha256, staged_path, metadata):
+        """Stream a staged file into GridFS unless a file with the same hash is stored"""
+        try:
+            if not self.exists(sha256):
+                with open(staged_path, 'rb') as staged, self._bucket().open_upload_stream_with_id(
+                        sha256, metadata.get('name') or sha256, metadata=metadata) as stored:
+                    shutil.copyfileobj(staged, stored, COPY_BLOCK_SIZE)
+        except Exception as e:
+            # Another process stored the same content first
+            if not self.exists(sha256):
+                raise
+            logger.info(f"File {sha256} was stored concurrently: {e}")
+        finally:
+            if os.path.exists(staged_path):
+                os.remove(staged_path)
+
+    def open(self, sha256):
+        return self._bucket().open_download_stream(sha256)
+
+class UploadManager:
+    """Accepts resumable chunked uploads for file questions
+
+    An upload is created with the file's name, size and type, which are checked
+    against the question (maxFileSize, fileTypes) and max_size. Chunks are then
+    sent in order, each at the offset the server has received so far, and are
+    streamed into a staging file; a client that lost its connection asks for
+    the offset and resumes from there. Once all bytes are in, the file is
+    hashed and moved into the blob store; identical files are stored once.
+
+    Submissions keep a reference to the upload ({upload_id, name, size, type,
+    sha256}), never the bytes. Unfinished uploads expire after ttl seconds.
+    """
+
+    def __init__(self, store, staging_dir, max_size=25 * 1024 * 1024, chunk_size=5 * 1024 * 1024, ttl=86400):
+        self.store = store
+        self.staging_dir = staging_dir
+        self.max_size = max_size
+        self.chunk_size = chunk_size
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._last_purge = 0
+        self.created = 0
+        self.completed = 0
+        self.deduplicated = 0
+        self.bytes_received = 0
+
+    def _staged_path(self, upload_id):
+        return os.path.join(self.staging_dir, f'{upload_id}.part')
+
+    def create(self, form, question_id, name, size, mime_type):
+        """Start an upload for a file question of a published form"""
+        question = next((q for q in form.get('questions', []) if q.get('id') == question_id), None)
+        if not question or question.get('type') != 'file':
+            raise UploadError("Unknown file question")
+        if not isinstance(name, str) or not name.strip():
+            raise UploadError("File name is required")
+        if not isinstance(size, int) or isinstance(size, bool) or size < 1:
+            raise UploadError("File size must be a positive number of bytes")
+        if size > self.max_size:
+            raise UploadError(f"Files must be at most {self.max_size // (1024 * 1024)}MB", 413)
+
+        # The question's own size and type limits
+        file_info = {'name': name, 'size': size, 'type': mime_type or ''}
+        try:
+            SubmissionValidator([question]).validate({question_id: [file_info]})
+        except ValidationError as e:
+            raise UploadError(e.errors[question_id])
+
+        self._purge_stale_parts()
+
+        now = datetime.now()
+        upload = UploadModel.create_upload({
+            'id': str(uuid.uuid4()),
+            'form_id': form['_id'],
+            'question_id': question_id,
+            'name': name,
+            'size': size,
+            'type': mime_type or '',
+            'created_at': now,
+            'expires_at': now + timedelta(seconds=self.ttl)
+        })
+        with self._lock:
+            self.created += 1
+        return upload
+
+    def get(self, form, upload_id):
+        """Get an upload of a form"""
+        upload = UploadModel.get_upload(upload_id)
+        if not upload or upload['form_id'] != form['_id']:
+            raise UploadError("Upload not found", 404)
+        return upload
+
+    def write_chunk(self, form, upload_id, offset, stream):
+        """Append the chunk in stream at offset; returns the upload, completed once all bytes are in"""
+        upload = self.get(form, upload_id)
+        if upload['status'] != 'pending':
+            raise UploadError("Upload is already complete", 409, upload['received'])
+        if offset != upload['received']:
+            raise UploadError(f"Expected a chunk at offset {upload['received']}", 409, upload['received'])
+
+        limit = min(self.chunk_size, upload['size'] - offset)
+        os.makedirs(self.staging_dir, exist_ok=True)
+        path = self._staged_path(upload_id)
+        if offset and not os.path.exists(path):
+            raise UploadError("Upload data was lost, please upload the file again", 410)
+
+        written = 0
+        with open(path, 'r+b' if offset else 'wb') as staged:
+            staged.seek(offset)
+            while True:
+                block = stream.read(min(COPY_BLOCK_SIZE, limit - written + 1))
+                if not block:
+                    break
+                if written + len(block) > limit:
+                    raise UploadError(f"Chunks must be at most {limit} bytes here", 413, offset)
+                staged.write(block)
+                written += len(block)
+            staged.truncate(offset + written)
+
+        if not written:
+            raise UploadError("Empty chunk", 400, offset)
+        if not UploadModel.advance_upload(upload_id, offset, offset + written):
+            # A retry of the same chunk got there first
+            upload = UploadModel.get_upload(upload_id)
+            raise UploadError("Chunk already received", 409, upload['received'])
+
+        with self._lock:
+            self.bytes_received += written
+
+        upload['received'] = offset + written
+        if upload['received'] == upload['size']:
+            upload = self._complete(upload)
+        return upload
+
+    def _complete(self, upload):
+        """Hash the staged file and move it into the store"""
+        path = self._staged_path(upload['id'])
+        digest = hashlib.sha256()
+        with open(path, 'rb') as staged:
+            for block in iter(lambda: staged.read(COPY_BLOCK_SIZE), b''):
+                digest.update(block)
+        sha256 = digest.hexdigest()
+
+        duplicate = self.store.exists(sha256)
+        self.store.put(sha256, path, {'name': upload['name'], 'type': upload['type']})
+
+        with self._lock:
+            self.completed += 1
+            if duplicate:
+                self.deduplicated += 1
+        return UploadModel.complete_upload(upload['id'], sha256)
+
+    def attach(self, form, responses):
+        """Replace the file answers of validated responses with references to completed uploads
+
+        Raises ValidationError if an answer doesn't refer to a completed upload
+        of that question.
+        """
+        answers = {
+            q['id']: responses[q['id']] for q in form.get('questions', [])
+            if q.get('type') == 'file' and responses.get(q['id'])
+        }
+        if not answers:
+            return responses
+
+        upload_ids = {f.get('upload_id') for files in answers.values() for f in files
+                      if isinstance(f.get('upload_id'), str)}
+        uploads = UploadModel.get_uploads(upload_ids)
+
+        errors = {}
+        for question_id, files in answers.items():
+            references = []
+            for f in files:
+                upload_id = f.get('upload_id')
+                upload = uploads.get(upload_id) if isinstance(upload_id, str) else None
+                if (not upload or upload['status'] != 'complete' or
+                        upload['form_id'] != form['_id'] or upload['question_id'] != question_id):
+                    errors[question_id] = f'{f["name"]} was not uploaded'
+                    break
+                references.append({
+                    'upload_id': upload['id'],
+                    'name': upload['name'],
+                    'size': upload['size'],
+                    'type': upload['type'],
+                    'sha256': upload['sha256']
+                })
+            responses[question_id] = references
+
+        if errors:
+            raise ValidationError(errors)
+        return responses
+
+    def open(self, upload):
+        """Open the stored file of a completed upload for reading"""
+        return self.store.open(upload['sha256'])
+
+    def _purge_stale_parts(self):
+        """Delete staging files of expired uploads, at most once per ttl"""
+        now = time.time()
+        with self._lock:
+            if now - self._last_purge < self.ttl:
+                return
+            self._last_purge = now
+
+        try:
+            entries = list(os.scandir(self.staging_dir))
+        except FileNotFoundError:
+            return
+        for entry in entries:
+            try:
+                if entry.name.endswith('.part') and now - entry.stat().st_mtime > self.ttl:
+                    os.remove(entry.path)
+            except OSError as e:
+                logger.warning(f"Failed to remove stale upload {entry.name}: {e}")
+
+    def stats(self):
+        """Get upload metrics"""
+        with self._lock:
+            return {
+                'storage': type(self.store).__name__,
+                'created': self.created,
+                'completed': self.completed,
+                'deduplicated': self.deduplicated,
+                'bytes_received': self.bytes_received
+            }
+
+def create_upload_manager():
+    """Create the upload manager configured by UPLOAD_* environment variables"""
+    from database import db_manager
+
+    storage = os.getenv('UPLOAD_STORAGE', 'disk')
+    if storage not in UPLOAD_STORAGES:
+        raise ValueError(f"Unknown upload storage: {storage}")
+
+    upload_dir = os.getenv('UPLOAD_DIR', 'uploads')
+    if storage == 'gridfs':
+        store = GridFSBlobStore(db_manager.get_database)
+    else:
+        store = DiskBlobStore(os.path.join(upload_dir, 'files'))
+
+    return UploadManager(
+        store,
+        staging_dir=os.path.join(upload_dir, 'partial'),
+        max_size=int(float(os.getenv('UPLOAD_MAX_SIZE_MB', 25)) * 1024 * 1024),
+        chunk_size=int(float(os.getenv('UPLOAD_CHUNK_SIZE_MB', 5)) * 1024 * 1024),
+        ttl=int(os.getenv('UPLOAD_TTL', 86400))
+    )
+
+# Global upload manager instance
+upload_manager = create_upload_manager()
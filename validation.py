@@ -0,0 +1,320 @@
+"""
+Server-side validation of form submissions
+
+A form's questions are compiled once into a SubmissionValidator: each question
+becomes a check with its constraints (patterns, bounds, option sets) already
+parsed. Compiled validators are cached per form and version (updated_at), so
+the submit path only runs the checks. A check may return the value to store
+instead of the answer, e.g. the number parsed from a number answer.
+"""
+from collections import OrderedDict
+from datetime import datetime
+from urllib.parse import urlparse
+import math
+import re
+import threading
+
+# Same patterns the public form uses in the browser
+EMAIL_PATTERN = re.compile(r'^[^\s@]+@[^\s@]+\.[^\s@]+$')
+PHONE_PATTERN = re.compile(r'^[\d\s\-\(\)\+\.]+$')
+TIME_PATTERN = re.compile(r'^([01]?[0-9]|2[0-3]):[0-5][0-9](:[0-5][0-9])?$')
+MIN_PHONE_DIGITS = 7
+
+# Upper bound for free-text answers without their own character limit
+MAX_ANSWER_LENGTH = 10000
+DEFAULT_RATING_SCALE = 10
+
+class ValidationError(ValueError):
+    """A submission failed validation; errors maps question IDs to messages"""
+
+    def __init__(self, errors):
+        super().__init__("Invalid submission")
+        self.errors = errors
+
+class _Invalid(Exception):
+    pass
+
+def _is_empty(value):
+    return value is None or value == '' or value == []
+
+def _number(value):
+    """Parse a number answer or constraint, or None if it is not a number"""
+    if isinstance(value, bool):
+        return None
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return None
+    return number if math.isfinite(number) else None
+
+def number_answer(value):
+    """Parse a number answer into the number stored for it, or None if it is not a number
+
+    Integral numbers are stored as integers so they read back as they were typed.
+    """
+    number = _number(value)
+    if number is not None and number == int(number) and abs(number) < 2 ** 53:
+        return int(number)
+    return number
+
+def _date(value):
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').date()
+    except (TypeError, ValueError):
+        return None
+
+def _string_check(max_length=MAX_ANSWER_LENGTH, pattern=None, message='Invalid value'):
+    def check(value):
+        if not isinstance(value, str):
+            raise _Invalid('Must be text')
+        if len(value) > max_length:
+            raise _Invalid(f'Must be at most {max_length} characters')
+        if pattern is not None and not pattern.match(value):
+            raise _Invalid(message)
+    return check
+
+def _compile_text(question):
+    return _string_check()
+
+def _compile_textarea(question):
+    char_limit = _number(question.get('charLimit'))
+    return _string_check(max_length=int(char_limit) if char_limit else MAX_ANSWER_LENGTH)
+
+def _compile_email(question):
+    return _string_check(pattern=EMAIL_PATTERN, message='Must be a valid email address')
+
+def _compile_phone(question):
+    base = _string_check(pattern=PHONE_PATTERN, message='Must be a valid phone number')
+
+    def check(value):
+        base(value)
+        if len(re.sub(r'\D', '', value)) < MIN_PHONE_DIGITS:
+            raise _Invalid(f'Must have at least {MIN_PHONE_DIGITS} digits')
+    return check
+
+def _compile_url(question):
+    def check(value):
+        if not isinstance(value, str):
+            raise _Invalid('Must be text')
+        parsed = urlparse(value)
+        if parsed.scheme not in ('http', 'https') or not parsed.netloc or len(value) > MAX_ANSWER_LENGTH:
+            raise _Invalid('Must be a valid http(s) URL')
+    return check
+
+def _compile_number(question):
+    minimum = _number(question.get('minValue'))
+    maximum = _number(question.get('maxValue'))
+
+    def check(value):
+        number = _number(value)
+        if number is None:
+            raise _Invalid('Must be a number')
+        if minimum is not None and number < minimum:
+            raise _Invalid(f'Must be at least {question["minValue"]}')
+        if maximum is not None and number > maximum:
+            raise _Invalid(f'Must be at most {question["maxValue"]}')
+        # Stored as a number so analytics can bin it in the database
+        return number_answer(value)
+    return check
+
+def _compile_date(question):
+    earliest = _date(question.get('minDate'))
+    latest = _date(question.get('maxDate'))
+
+    def check(value):
+        date = _date(value)
+        if date is None:
+            raise _Invalid('Must be a date (YYYY-MM-DD)')
+        if earliest is not None and date < earliest:
+            raise _Invalid(f'Must be on or after {question["minDate"]}')
+        if latest is not None and date > latest:
+            raise _Invalid(f'Must be on or before {question["maxDate"]}')
+    return check
+
+def _compile_time(question):
+    return _string_check(pattern=TIME_PATTERN, message='Must be a time (HH:MM)')
+
+def _compile_rating(question):
+    scale = int(_number(question.get('ratingScale')) or DEFAULT_RATING_SCALE)
+
+    def check(value):
+        rating = _number(value)
+        if rating is None or rating != int(rating) or not 1 <= rating <= scale:
+            raise _Invalid(f'Must be a rating from 1 to {scale}')
+    return check
+
+def _compile_choice(question, multiple):
+    options = question.get('options')
+    allowed = frozenset(str(option) for option in options) if options else None
+
+    def check_option(value):
+        if not isinstance(value, str):
+            raise _Invalid('Must be text')
+        if allowed is not None and value not in allowed:
+            raise _Invalid(f'"{value}" is not one of the options')
+
+    def check(value):
+        if not multiple:
+            check_option(value)
+            return
+        if not isinstance(value, list):
+            raise _Invalid('Must be a list of options')
+        for item in value:
+            check_option(item)
+    return check
+
+def _compile_select(question):
+    return _compile_choice(question, bool(question.get('multiple')))
+
+def _compile_checkbox(question):
+    return _compile_choice(question, True)
+
+def _file_type_matcher(file_types):
+    """Match files against accept-style types: extensions (.pdf) and MIME types (image/*)"""
+    extensions = tuple(t.lower() for t in file_types if t.startswith('.'))
+    mime_types = {t.lower() for t in file_types if '/' in t and not t.endswith('/*')}
+    mime_prefixes = tuple(t.lower()[:-1] for t in file_types if t.endswith('/*'))
+
+    def matches(name, mime_type):
+        name, mime_type = name.lower(), mime_type.lower()
+        return (
+            (extensions and name.endswith(extensions)) or
+            mime_type in mime_types or
+            (mime_prefixes and mime_type.startswith(mime_prefixes))
+        )
+    return matches
+
+def _compile_file(question):
+    multiple = bool(question.get('allowMultipleFiles'))
+    max_size_mb = _number(question.get('maxFileSize'))
+    max_bytes = max_size_mb * 1024 * 1024 if max_size_mb else None
+    file_types = question.get('fileTypes') or []
+    matches = _file_type_matcher(file_types) if file_types else None
+
+    def check(value):
+        if not isinstance(value, list):
+            raise _Invalid('Must be a list of files')
+        if len(value) > 1 and not multiple:
+            raise _Invalid('Only one file is allowed')
+        for f in value:
+            if not isinstance(f, dict) or not isinstance(f.get('name'), str):
+                raise _Invalid('Invalid file')
+            size = _number(f.get('size', 0))
+            if size is None or size < 0:
+                raise _Invalid('Invalid file size')
+            if max_bytes is not None and size > max_bytes:
+                raise _Invalid(f'{f["name"]} is larger than {question["maxFileSize"]}MB')
+            if matches is not None and not matches(f['name'], str(f.get('type') or '')):
+                raise _Invalid(f'{f["name"]} is not an allowed file type')
+    return check
+
+def _compile_any(question):
+    def check(value):
+        values = value if isinstance(value, list) else [value]
+        for item in values:
+            if not isinstance(item, (str, int, float)) or isinstance(item, bool):
+                raise _Invalid('Invalid value')
+            if isinstance(item, str) and len(item) > MAX_ANSWER_LENGTH:
+                raise _Invalid(f'Must be at most {MAX_ANSWER_LENGTH} characters')
+    return check
+
+COMPILERS = {
+    'text': _compile_text,
+    'textarea': _compile_textarea,
+    'email': _compile_email,
+    'phone': _compile_phone,
+    'url': _compile_url,
+    'number': _compile_number,
+    'date': _compile_date,
+    'time': _compile_time,
+    'rating': _compile_rating,
+    'select': _compile_select,
+    'radio': _compile_select,
+    'checkbox': _compile_checkbox,
+    'file': _compile_file
+}
+
+_extension_check = _string_check(max_length=10, pattern=re.compile(r'^\d*$'), message='Must be digits')
+
+class SubmissionValidator:
+    """Validator compiled from a form's questions"""
+
+    def __init__(self, questions):
+        self._checks = []
+        for question in questions or []:
+            compile_check = COMPILERS.get(question.get('type'), _compile_any)
+            self._checks.append((question['id'], bool(question.get('required')), compile_check(question)))
+
+            if question.get('type') == 'phone' and question.get('allowExtension'):
+                self._checks.append((f"{question['id']}_ext", False, _extension_check))
+
+    def validate(self, responses):
+        """Check a submission's responses
+
+        Returns the responses limited to the form's questions, with number
+        answers parsed, or raises ValidationError listing every invalid answer.
+        """
+        if not isinstance(responses, dict):
+            raise ValidationError({'responses': 'Must be an object'})
+
+        cleaned = {}
+        errors = {}
+        for question_id, required, check in self._checks:
+            value = responses.get(question_id)
+
+            if _is_empty(value):
+                if required:
+                    errors[question_id] = 'This question is required'
+                elif value is not None:
+                    cleaned[question_id] = value
+                continue
+
+            try:
+                stored = check(value)
+            except _Invalid as e:
+                errors[question_id] = str(e)
+            else:
+                cleaned[question_id] = value if stored is None else stored
+
+        if errors:
+            raise ValidationError(errors)
+        return cleaned
+
+class ValidatorCache:
+    """LRU of compiled validators keyed by form name, checked against the form's version"""
+
+    def __init__(self, max_entries=1000):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, form):
+        """Get the validator for a form read with the 'schema' profile"""
+        form_name = form['name']
+        version = str(form.get('updated_at'))
+
+        with self._lock:
+            entry = self._entries.get(form_name)
+            if entry and entry[0] == version:
+                self._entries.move_to_end(form_name)
+                return entry[1]
+
+        validator = SubmissionValidator(form.get('questions'))
+        with self._lock:
+            self._entries[form_name] = (version, validator)
+            self._entries.move_to_end(form_name)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return validator
+
+    def invalidate(self, form_name):
+        """Drop a form's validator after its questions change"""
+        with self._lock:
+            self._entries.pop(form_name, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+# Global validator cache instance
+validator_cache = ValidatorCache()